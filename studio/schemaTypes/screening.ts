@@ -49,6 +49,15 @@ export default defineType({
       }),
     }),
 
+    // --- CAPACITY ---
+    defineField({
+      name: 'capacity',
+      title: 'Seats Available',
+      type: 'number',
+      description: 'Total tickets that can be sold. Leave empty for no limit.',
+      validation: (Rule) => Rule.integer().min(1),
+    }),
+
     // --- VENUE ---
     defineField({
       name: 'locationName',
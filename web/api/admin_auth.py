@@ -0,0 +1,114 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+from clients import get_async_http
+from telemetry import span
+
+logger = logging.getLogger("FalutinAPI.admin_auth")
+
+# CONFIGURATION
+# Static key for scripts and the load harness (X-Admin-Key); unset disables it
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY")
+# How long a verified Supabase session (admin or member) is trusted before asking again (seconds)
+ADMIN_SESSION_TTL = int(os.environ.get("ADMIN_SESSION_TTL", "300"))
+# Supabase's JWT secret (Settings > API). When set, HS256 access tokens are verified
+# locally instead of with a round trip to /auth/v1/user per new session
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
+# How many remotely verified sessions are remembered
+SESSION_CACHE_MAX = int(os.environ.get("SESSION_CACHE_MAX", "20000"))
+
+# token hash -> (user, expires_at); user is None for a token Supabase rejected
+_sessions = {}
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _jwt_algorithm(token: str):
+    try:
+        return json.loads(_b64decode(token.split(".")[0])).get("alg")
+    except Exception:
+        return None
+
+
+def _verify_jwt(token: str):
+    """Checks an HS256 access token's signature and expiry: {"id", "role"}, or None if it is not valid."""
+    try:
+        header, payload, signature = token.split(".")
+        expected = hmac.new(SUPABASE_JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except Exception:
+        return None
+    if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] <= time.time() or not claims.get("sub"):
+        return None
+    return {"id": claims["sub"], "role": (claims.get("app_metadata") or {}).get("role")}
+
+
+async def _fetch_user(token: str):
+    """Asks Supabase Auth who the bearer token belongs to: {"id", "role"}, or None if it is not valid."""
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        logger.error("Supabase credentials missing; cannot verify session")
+        return None
+
+    with span("supabase", "auth_user"):
+        response = await get_async_http().get(
+            f"{url}/auth/v1/user",
+            headers={"apikey": key, "Authorization": f"Bearer {token}"},
+            timeout=5,
+        )
+    if response.status_code != 200:
+        return None
+    user = response.json()
+    # app_metadata, not user_metadata: users can edit their own user_metadata with auth.updateUser()
+    return {"id": user.get("id"), "role": (user.get("app_metadata") or {}).get("role")}
+
+
+async def session_user(authorization: str = None):
+    """The Supabase user behind a Bearer token (None if absent or invalid), cached per token."""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+
+    token = authorization[7:].strip()
+    if SUPABASE_JWT_SECRET and _jwt_algorithm(token) == "HS256":
+        # Microseconds of CPU: no upstream call and nothing to cache
+        return _verify_jwt(token)
+
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    now = time.monotonic()
+    cached = _sessions.get(digest)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    try:
+        user = await _fetch_user(token)
+    except Exception as e:
+        logger.error(f"AUTH ERROR: {str(e)}")
+        return None
+
+    if len(_sessions) > SESSION_CACHE_MAX:
+        _sessions.clear()
+    _sessions[digest] = (user, now + ADMIN_SESSION_TTL)
+    return user
+
+
+async def member_id(authorization: str = None):
+    """User id of a signed-in member (any role), or None."""
+    user = await session_user(authorization)
+    return user["id"] if user else None
+
+
+async def is_admin(authorization: str = None, admin_key: str = None) -> bool:
+    """True for a valid X-Admin-Key or a Supabase session whose app_metadata carries role=admin."""
+    if ADMIN_API_KEY and admin_key == ADMIN_API_KEY:
+        return True
+    user = await session_user(authorization)
+    return bool(user) and user["role"] == "admin"
@@ -0,0 +1,165 @@
+import os
+import math
+import asyncio
+import threading
+from collections import OrderedDict
+from ratelimit import TokenBucket
+from telemetry import register_gauges
+
+# --- CONFIGURATION ---
+# All limits below are totals for the deployment. State is per process, so
+# with N workers (uvicorn reads WEB_CONCURRENCY too) each one enforces 1/N.
+WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# Per-client request rates (requests per minute) and burst sizes
+PAY_PER_PHONE_PER_MIN = float(os.environ.get("PAY_PER_PHONE_PER_MIN", "3")) / WORKERS
+PAY_PER_IP_PER_MIN = float(os.environ.get("PAY_PER_IP_PER_MIN", "10")) / WORKERS
+CHAT_PER_IP_PER_MIN = float(os.environ.get("CHAT_PER_IP_PER_MIN", "20")) / WORKERS
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "3"))
+
+# Concurrent calls allowed per paid upstream, and how many may queue behind them
+UPSTREAM_LIMITS = {
+    name: max(1, int(os.environ.get(f"UPSTREAM_LIMIT_{name.upper()}", default)) // WORKERS)
+    for name, default in (("daraja", "20"), ("groq", "10"), ("resend", "2"))
+}
+UPSTREAM_MAX_WAITING = int(os.environ.get("UPSTREAM_MAX_WAITING", "50"))
+UPSTREAM_WAIT_TIMEOUT = float(os.environ.get("UPSTREAM_WAIT_TIMEOUT", "10"))
+
+# Proxies in front of the app that append to X-Forwarded-For (Vercel's edge is one)
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+
+
+class Overloaded(Exception):
+    """Request shed by admission control; maps to 429 + Retry-After."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+# --- PER-CLIENT TOKEN BUCKETS ---
+
+class KeyedRateLimiter:
+    """One token bucket per key (IP, phone). Oldest keys are forgotten past max_keys."""
+
+    def __init__(self, name: str, per_minute: float, burst: float = RATE_LIMIT_BURST, max_keys: int = 10000):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key: str):
+        """Raises Overloaded if `key` is over its rate."""
+        if not key:
+            return
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+
+        wait = bucket.try_acquire()
+        if wait:
+            self.rejected += 1
+            raise Overloaded(f"Too many {self.name} requests", wait)
+
+
+pay_phone_limiter = KeyedRateLimiter("payment", PAY_PER_PHONE_PER_MIN)
+pay_ip_limiter = KeyedRateLimiter("payment", PAY_PER_IP_PER_MIN)
+chat_ip_limiter = KeyedRateLimiter("chat", CHAT_PER_IP_PER_MIN)
+
+
+# --- PER-UPSTREAM CONCURRENCY ---
+
+class UpstreamGate:
+    """
+    Caps in-flight calls to one upstream. Callers beyond the cap wait in a
+    bounded queue; when the queue is full, or the wait times out, the
+    request is shed with Overloaded instead of piling up.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int = UPSTREAM_MAX_WAITING,
+                 wait_timeout: float = UPSTREAM_WAIT_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self._sem = None
+
+    async def __aenter__(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        if self.waiting >= self.max_waiting:
+            self.shed += 1
+            raise Overloaded(f"{self.name} is busy", self.wait_timeout)
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise Overloaded(f"{self.name} is busy", self.wait_timeout)
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def release(self):
+        """Frees the slot without awaiting, so it also runs inside a cancelled task's cleanup."""
+        self._sem.release()
+        self.in_flight -= 1
+
+    def get_stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "queue_depth": self.waiting, "shed": self.shed}
+
+
+upstream_gates = {name: UpstreamGate(name, limit) for name, limit in UPSTREAM_LIMITS.items()}
+
+
+def _gate_gauges():
+    samples = []
+    for name, gate in upstream_gates.items():
+        samples.append(("falutin_upstream_in_flight", {"upstream": name}, gate.in_flight))
+        samples.append(("falutin_upstream_queue_depth", {"upstream": name}, gate.waiting))
+        samples.append(("falutin_upstream_shed", {"upstream": name}, gate.shed))
+    return samples
+
+
+register_gauges(_gate_gauges)
+
+
+def client_ip(headers, fallback: str = None) -> str:
+    """
+    Caller IP from X-Forwarded-For. Only the entries our own proxies
+    appended are trusted: anything further left is whatever the client
+    sent, so it can't be used to dodge the per-IP limits.
+    """
+    forwarded = headers.get("x-forwarded-for")
+    if forwarded and TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return fallback or "unknown"
+
+
+def get_admission_stats():
+    return {
+        "upstreams": {name: gate.get_stats() for name, gate in upstream_gates.items()},
+        "rejected": {
+            "pay_per_phone": pay_phone_limiter.rejected,
+            "pay_per_ip": pay_ip_limiter.rejected,
+            "chat_per_ip": chat_ip_limiter.rejected,
+        },
+    }
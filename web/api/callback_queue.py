@@ -0,0 +1,188 @@
+import os
+import logging
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+
+logger = logging.getLogger("FalutinAPI.callback_queue")
+
+# CONFIGURATION
+CALLBACK_QUEUE_PATH = os.environ.get("CALLBACK_QUEUE_PATH", "/tmp/falutin_callbacks.db")
+CALLBACK_WORKERS = int(os.environ.get("CALLBACK_WORKERS", "4"))
+CALLBACK_MAX_ATTEMPTS = int(os.environ.get("CALLBACK_MAX_ATTEMPTS", "5"))
+# Jobs one worker claims and applies together (one reservations round trip)
+CALLBACK_BATCH = int(os.environ.get("CALLBACK_BATCH", "50"))
+CALLBACK_RETRY_DELAY = float(os.environ.get("CALLBACK_RETRY_DELAY", "2"))
+# A claimed job whose worker died is picked up again after this long
+CALLBACK_LEASE = float(os.environ.get("CALLBACK_LEASE", "60"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS callbacks (
+    checkout_request_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS callbacks_ready ON callbacks (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    checkout_request_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class CallbackQueue:
+    """
+    Durable local work queue for M-Pesa callbacks.
+    /callback persists the payload and acks straight away; a pool of workers
+    claims ready jobs in batches and runs `handler(payloads)` on each batch,
+    with retries and backoff. CheckoutRequestID is the
+    primary key, so Daraja's re-deliveries are ignored (idempotency).
+    Several worker processes may share one file: claims take a lease rather
+    than a lock, so a crashed process's jobs are retried once it lapses.
+    """
+
+    def __init__(self, handler, path: str = CALLBACK_QUEUE_PATH, workers: int = CALLBACK_WORKERS,
+                 max_attempts: int = CALLBACK_MAX_ATTEMPTS, retry_delay: float = CALLBACK_RETRY_DELAY,
+                 batch_size: int = CALLBACK_BATCH):
+        self.handler = handler
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._wakeup = None
+        self._tasks = []
+
+    # --- STORAGE ---
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._db_lock:
+            return self._conn().execute(sql, params).fetchall()
+
+    def _insert(self, checkout_id: str, payload: dict) -> bool:
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn().execute(
+                "INSERT OR IGNORE INTO callbacks (checkout_request_id, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (checkout_id, json.dumps(payload), now, now),
+            )
+            return cursor.rowcount == 1
+
+    def _claim(self):
+        """Atomically takes up to batch_size of the oldest ready (or lease-expired) jobs."""
+        now = time.time()
+        with self._db_lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT checkout_request_id, payload, attempts FROM callbacks "
+                    "WHERE status IN ('queued', 'processing') AND next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                    (now, self.batch_size),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE callbacks SET status = 'processing', next_attempt_at = ? WHERE checkout_request_id = ?",
+                    [(now + CALLBACK_LEASE, row[0]) for row in rows],
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [{"checkout_id": row[0], "payload": json.loads(row[1]), "attempts": row[2]} for row in rows]
+
+    def _complete(self, jobs: list):
+        with self._db_lock:
+            self._conn().executemany(
+                "UPDATE callbacks SET status = 'done', last_error = NULL WHERE checkout_request_id = ?",
+                [(job["checkout_id"],) for job in jobs],
+            )
+
+    def _fail(self, job: dict, error: str):
+        attempts = job["attempts"] + 1
+        if attempts >= self.max_attempts:
+            with self._db_lock:
+                db = self._conn()
+                db.execute("BEGIN IMMEDIATE")
+                db.execute(
+                    "INSERT OR REPLACE INTO dead_letters (checkout_request_id, payload, attempts, last_error, failed_at) VALUES (?, ?, ?, ?, ?)",
+                    (job["checkout_id"], json.dumps(job["payload"]), attempts, error, time.time()),
+                )
+                db.execute(
+                    "UPDATE callbacks SET status = 'dead', attempts = ?, last_error = ? WHERE checkout_request_id = ?",
+                    (attempts, error, job["checkout_id"]),
+                )
+                db.execute("COMMIT")
+            logger.error(f"CALLBACK DEAD-LETTERED: {job['checkout_id']} after {attempts} attempts: {error}")
+            return
+
+        # Exponential backoff: 2s, 4s, 8s, ...
+        delay = self.retry_delay * (2 ** (attempts - 1))
+        self._execute(
+            "UPDATE callbacks SET status = 'queued', attempts = ?, last_error = ?, next_attempt_at = ? WHERE checkout_request_id = ?",
+            (attempts, error, time.time() + delay, job["checkout_id"]),
+        )
+        logger.warning(f"CALLBACK RETRY: {job['checkout_id']} in {delay:.0f}s ({error})")
+
+    # --- PUBLIC API ---
+
+    async def enqueue(self, checkout_id: str, payload: dict) -> bool:
+        """Persists a callback. Returns False if this CheckoutRequestID was already queued."""
+        created = await asyncio.to_thread(self._insert, checkout_id, payload)
+        if created and self._wakeup:
+            self._wakeup.set()
+        return created
+
+    async def start(self):
+        # Jobs interrupted by a restart are reclaimed when their lease lapses
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            jobs = await asyncio.to_thread(self._claim)
+            if not jobs:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.handler([job["payload"] for job in jobs])
+                await asyncio.to_thread(self._complete, jobs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The handler is idempotent, so the whole batch is retried
+                for job in jobs:
+                    await asyncio.to_thread(self._fail, job, str(e))
+
+    def get_stats(self):
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM callbacks GROUP BY status"))
+        counts["dead_letters"] = self._execute("SELECT COUNT(*) FROM dead_letters")[0][0]
+        return counts
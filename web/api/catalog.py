@@ -0,0 +1,294 @@
+import os
+import logging
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from clients import get_session
+from telemetry import span
+
+logger = logging.getLogger("FalutinAPI.catalog")
+
+# CONFIGURATION
+SANITY_PROJECT_ID = os.environ.get("SANITY_PROJECT_ID", "xet7dw4q")
+SANITY_DATASET = os.environ.get("SANITY_DATASET", "production")
+SANITY_API_URL = os.environ.get("SANITY_API_URL", f"https://{SANITY_PROJECT_ID}.api.sanity.io")
+SANITY_QUERY_URL = f"{SANITY_API_URL}/v2021-10-21/data/query/{SANITY_DATASET}"
+SCREENINGS_QUERY = (
+    '*[_type == "screening"]{_id, date, price, isFree, capacity, locationName, location, discussionLead, '
+    'isSecret, redactedTitle, clues, revealDate, movie->{title, description, poster, themes, trailer}}'
+)
+
+SANITY_CDN_URL = f"https://cdn.sanity.io/images/{SANITY_PROJECT_ID}/{SANITY_DATASET}"
+# Screening times in tickets are shown in the venue's local time
+SCREENING_TIMEZONE = ZoneInfo(os.environ.get("SCREENING_TIMEZONE", "Africa/Nairobi"))
+
+# How long a catalog is served without asking Sanity (seconds)
+CATALOG_TTL = int(os.environ.get("CATALOG_TTL", "60"))
+# How long a stale catalog may still be served while a refresh runs in the background
+CATALOG_MAX_STALE = int(os.environ.get("CATALOG_MAX_STALE", "900"))
+
+EMPTY_CONTEXT = "No movies currently scheduled."
+SECRET_TITLE = "Secret Screening"
+TICKET_FALLBACK = {"movie_title": "Falutin Screening", "date": "Upcoming", "poster_url": ""}
+
+
+def _parse_time(value: str):
+    """Sanity datetime -> aware datetime (None if missing or malformed)."""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+    except ValueError:
+        return None
+
+
+def image_url(image) -> str:
+    """Sanity image field -> CDN URL ("" if missing). Asset refs look like image-<id>-<w>x<h>-<ext>."""
+    ref = ((image or {}).get("asset") or {}).get("_ref") or ""
+    parts = ref.split("-")
+    if len(parts) != 4 or parts[0] != "image":
+        return ""
+    _, asset_id, size, ext = parts
+    return f"{SANITY_CDN_URL}/{asset_id}-{size}.{ext}"
+
+
+def _is_hidden(screening: dict, now: datetime) -> bool:
+    """Secret until revealDate; a secret screening without one stays hidden."""
+    if not screening.get("isSecret"):
+        return False
+    reveal_at = _parse_time(screening.get("revealDate"))
+    return reveal_at is None or now < reveal_at
+
+
+def public_view(screening: dict, now: datetime) -> dict:
+    """What anyone may see of a screening: the film is swapped for its codename and clues until the reveal."""
+    movie = screening.get("movie") or {}
+    hidden = _is_hidden(screening, now)
+    free = bool(screening.get("isFree"))
+    view = {
+        "_id": screening.get("_id"),
+        "date": screening.get("date"),
+        "isFree": free,
+        "price": 0 if free else screening.get("price"),
+        "capacity": screening.get("capacity"),
+        "locationName": screening.get("locationName"),
+        "location": screening.get("location"),
+        "discussionLead": screening.get("discussionLead"),
+        "isSecret": bool(screening.get("isSecret")),
+        "revealed": not hidden,
+        "revealDate": screening.get("revealDate"),
+        "movie": movie,
+    }
+    if hidden:
+        view["codename"] = screening.get("redactedTitle") or SECRET_TITLE
+        view["clues"] = screening.get("clues") or []
+        view["movie"] = {"title": view["codename"], "description": None, "poster": None, "themes": None, "trailer": None}
+    return view
+
+
+def _context_line(view: dict) -> str:
+    price = "FREE" if view["isFree"] else f"{view['price']} KES"
+    line = f"- MOVIE: {view['movie'].get('title')} | DATE: {view['date']} | PRICE: {price}"
+    if view.get("locationName"):
+        line += f" | VENUE: {view['locationName']}"
+    if not view["revealed"]:
+        line += " | SECRET SCREENING (title not yet revealed)"
+        if view["clues"]:
+            line += f" | CLUES: {', '.join(view['clues'])}"
+    return line + "\n"
+
+
+class ScreeningCatalog:
+    """
+    In-process cache of the Sanity screening schedule.
+    Fresh for CATALOG_TTL, then served stale while a background refresh
+    revalidates it with If-None-Match.
+    Alongside the raw documents it keeps one redacted public snapshot,
+    which both Fellini's context and GET /screenings are built from. A
+    timer set for the next revealDate rebuilds it the moment a secret
+    screening is revealed.
+    """
+
+    def __init__(self, ttl: int = CATALOG_TTL, max_stale: int = CATALOG_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.screenings = []
+        self.by_id = {}
+        self.public = []
+        self.public_by_id = {}
+        self.public_etag = None
+        self.next_reveal = None
+        self.context = None
+        self.version = 0
+        self.etag = None
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refreshed = threading.Event()
+        self._reveal_timer = None
+
+    # --- READ PATH ---
+
+    def get_context(self) -> str:
+        """Returns the pre-built AI context. Only blocks when nothing usable is cached."""
+        age = time.monotonic() - self.fetched_at
+
+        if self.context is None or age > self.max_stale:
+            self.refresh()
+        elif age > self.ttl:
+            self.refresh_in_background()
+
+        return self.context or EMPTY_CONTEXT
+
+    # --- WRITE PATH ---
+
+    def invalidate(self) -> int:
+        """Marks the catalog stale (e.g. from a Sanity webhook) and revalidates it."""
+        self.fetched_at = 0.0
+        self.refresh_in_background()
+        return self.version
+
+    def refresh_in_background(self):
+        if self._refreshing:
+            return
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def _servable(self) -> bool:
+        return self.context is not None and time.monotonic() - self.fetched_at <= self.max_stale
+
+    def refresh(self):
+        """
+        Fetches the schedule from Sanity. Concurrent callers share one request:
+        they return at once when there is a catalog they may serve meanwhile,
+        and otherwise wait for the request in flight.
+        """
+        with self._lock:
+            if self._refreshing:
+                in_flight = self._refreshed
+            else:
+                in_flight = None
+                self._refreshing = True
+                self._refreshed = threading.Event()
+
+        if in_flight is not None:
+            if not self._servable():
+                in_flight.wait(timeout=10)
+            return
+
+        try:
+            headers = {"If-None-Match": self.etag} if self.etag else {}
+            with span("sanity", "screenings"):
+                response = get_session(SANITY_QUERY_URL).get(
+                    SANITY_QUERY_URL,
+                    params={"query": SCREENINGS_QUERY},
+                    headers=headers,
+                    timeout=8,
+                )
+
+            if response.status_code == 304:
+                self.fetched_at = time.monotonic()
+                return
+
+            response.raise_for_status()
+            self._publish(response.json().get("result", []), response.headers.get("ETag"))
+
+        except Exception as e:
+            # Keeps serving whatever we had; the next read retries
+            logger.error(f"SANITY ERROR: {str(e)}")
+        finally:
+            self._refreshing = False
+            self._refreshed.set()
+
+    def _publish(self, screenings: list, etag: str = None):
+        """Swaps in a new catalog version with its public snapshot built once."""
+        self.screenings = screenings
+        self.by_id = {s.get("_id"): s for s in screenings}
+        self.etag = etag
+        self._build_public()
+        self.fetched_at = time.monotonic()
+
+    def _build_public(self):
+        """Redacts the cached documents as of now and schedules the next reveal."""
+        now = datetime.now(timezone.utc)
+        public = sorted((public_view(s, now) for s in self.screenings), key=lambda v: v["date"] or "")
+
+        self.public = public
+        self.public_by_id = {v["_id"]: v for v in public}
+        self.context = "".join(_context_line(v) for v in public) or EMPTY_CONTEXT
+        self.version += 1
+        self.public_etag = hashlib.sha1(f"{self.etag}:{self.version}:{len(public)}".encode()).hexdigest()[:16]
+        self._schedule_reveal(now)
+
+    def _schedule_reveal(self, now: datetime):
+        if self._reveal_timer:
+            self._reveal_timer.cancel()
+            self._reveal_timer = None
+
+        reveals = [_parse_time(s.get("revealDate")) for s in self.screenings if _is_hidden(s, now)]
+        reveals = [r for r in reveals if r is not None]
+        self.next_reveal = min(reveals) if reveals else None
+        if self.next_reveal is None:
+            return
+
+        # Fires once, at the reveal; no polling in between
+        self._reveal_timer = threading.Timer((self.next_reveal - now).total_seconds() + 0.5, self._reveal)
+        self._reveal_timer.daemon = True
+        self._reveal_timer.start()
+
+    def _reveal(self):
+        logger.info("Secret screening reveal: rebuilding the public catalog")
+        with self._lock:
+            self._build_public()
+
+    def seconds_to_next_reveal(self):
+        if self.next_reveal is None:
+            return None
+        return max(0.0, (self.next_reveal - datetime.now(timezone.utc)).total_seconds())
+
+
+# Shared instance used by the API
+screening_catalog = ScreeningCatalog()
+
+
+def get_screening(screening_id: str):
+    """Cached screening document (or None); refreshes the catalog like get_context."""
+    screening_catalog.get_context()
+    return screening_catalog.by_id.get(screening_id)
+
+
+def get_public_screenings():
+    """The redacted public snapshot (same data Fellini's context is built from)."""
+    screening_catalog.get_context()
+    return screening_catalog.public
+
+
+def get_upcoming_screenings():
+    """Public screenings that haven't started yet, soonest first."""
+    now = datetime.now(timezone.utc)
+    return [v for v in get_public_screenings() if (_parse_time(v["date"]) or now) >= now]
+
+
+def get_public_screening(screening_id: str):
+    screening_catalog.get_context()
+    return screening_catalog.public_by_id.get(screening_id)
+
+
+def get_ticket_details(screening_id: str) -> dict:
+    """Title, date and poster for a ticket email, redacted like the public listing."""
+    view = get_public_screening(screening_id) if screening_id else None
+    if not view:
+        return dict(TICKET_FALLBACK)
+    when = _parse_time(view["date"])
+    return {
+        "movie_title": view["movie"].get("title") or TICKET_FALLBACK["movie_title"],
+        "date": when.astimezone(SCREENING_TIMEZONE).strftime("%A %d %B %Y, %H:%M") if when else TICKET_FALLBACK["date"],
+        "poster_url": image_url(view["movie"].get("poster")),
+    }
+
+
+def get_movie_context() -> str:
+    return screening_catalog.get_context()
+
+
+def invalidate_catalog() -> int:
+    return screening_catalog.invalidate()
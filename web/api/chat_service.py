@@ -1,20 +1,24 @@
 import os
-from groq import Groq
+import logging
+import json
+import time
+import asyncio
+import textwrap
+from functools import lru_cache
+from clients import get_async_http
+from response_cache import chat_cache, context_version
+from prompt_budget import assemble_prompt, estimate_tokens
+from admission import upstream_gates, Overloaded
+from telemetry import span, upstream_latency
 
-def get_ai_response(history: list, movie_context: str):
-    """
-    FELLINI: The Public-Facing Concierge.
-    """
-    try:
-        # Initializes only when needed
-        api_key = os.environ.get("GROQ_API_KEY")
-        if not api_key:
-            print("Error: GROQ_API_KEY not found.")
-            return "I'm having trouble connecting to the cinema archive."
-            
-        client = Groq(api_key=api_key)
+logger = logging.getLogger("FalutinAPI.chat_service")
+
+MODEL = "llama-3.3-70b-versatile"
 
-        system_prompt = f"""
+# --- SYSTEM PROMPTS ---
+# Dedented once at import; only the schedule is substituted per catalog version.
+
+FELLINI_PROMPT_TEMPLATE = textwrap.dedent("""
         ### SYSTEM INSTRUCTIONS ###
         **ROLE & PERSONA**
         You are **Fellini**, the charismatic, witty, and deeply knowledgeable digital concierge for the **'Falutin Fam'** (Falutin Film Club) in Nairobi.
@@ -44,7 +48,8 @@ def get_ai_response(history: list, movie_context: str):
                 • <b>Inception</b> (Sci-Fi Thriller) – Screening on <b>Jan 30th</b>.<br>
                 • <b>In Time</b> (Dystopian Drama) – Screening on <b>Jan 24th</b>.<br><br>
                 Which one are you grabbing a ticket for?"
-        5.  **VISUAL FORMATTING PROTOCOL (STRICT HTML)**
+        5.  **Secret Screenings:** Entries marked SECRET SCREENING are hidden until their reveal date. Use the codename and clues given, build the mystery, and never guess or hint at the actual film.
+        6.  **VISUAL FORMATTING PROTOCOL (STRICT HTML)**
             * Use `<b>` tags for all headers and key data points.
             * Use `<br>` tags for spacing.
             * Do NOT use markdown lists (`*` or `-`); use manual bullet points (`•`) if necessary.
@@ -54,46 +59,9 @@ def get_ai_response(history: list, movie_context: str):
         **INTERACTION STYLE**
         * **Ice Breaker:** If the user says "Hi", ask them about their favorite movie genre.
         * **Pivot:** If asked off-topic questions, wittily pivot back to film (e.g., "I don't know about that, but the drama in our next screening is guaranteed.").
-        """
+        """).strip()
 
-        # Builds the message chain
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Appends history (Safe version that skips empty messages)
-        for msg in history:
-            role = msg.get('role') if isinstance(msg, dict) else getattr(msg, 'role', 'user')
-            content = msg.get('content') if isinstance(msg, dict) else getattr(msg, 'content', '')
-            
-            if content and str(content).strip():
-                messages.append({"role": role, "content": content})
-
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile", 
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1000,
-        )
-
-        return completion.choices[0].message.content
-
-    except Exception as e:
-        print(f"AI ERROR: {str(e)}")
-        return "I'm having a bit of stage fright. Please ask again later."
-
-
-def get_admin_ai_response(history: list):
-    """
-    THE CURATOR: Lumière The Admin Aide.
-    Focuses on Dashboard help and Film Curation/Planning.
-    """
-    try:
-        api_key = os.environ.get("GROQ_API_KEY")
-        if not api_key:
-            return "System Error: API Key missing."
-            
-        client = Groq(api_key=api_key)
-
-        system_prompt = """
+LUMIERE_SYSTEM_PROMPT = textwrap.dedent("""
         ### SYSTEM INSTRUCTIONS ###
         **IDENTITY & PROTOCOL**
         You are **Lumière**, the Strategic Cinema Consultant and Operational Co-pilot for the **Falutin RSVP System**.
@@ -136,28 +104,281 @@ def get_admin_ai_response(history: list):
 
         **TONE**
         Professional, Visionary, Insightful, and Precise. You speak like a seasoned Creative Director.
-        """
+        """).strip()
+
+@lru_cache(maxsize=8)
+def _fellini_system_prompt(movie_context: str) -> str:
+    return FELLINI_PROMPT_TEMPLATE.replace("{movie_context}", movie_context or "")
 
-        # Builds message chain
-        messages = [{"role": "system", "content": system_prompt}]
+def _history_messages(history: list):
+    """Converts client history into Groq messages (Safe version that skips empty messages)"""
+    messages = []
+    for msg in history:
+        role = msg.get('role') if isinstance(msg, dict) else getattr(msg, 'role', 'user')
+        content = msg.get('content') if isinstance(msg, dict) else getattr(msg, 'content', '')
         
-        # Appends history (Safe version that skips empty messages)
-        for msg in history:
-            role = msg.get('role') if isinstance(msg, dict) else getattr(msg, 'role', 'user')
-            content = msg.get('content') if isinstance(msg, dict) else getattr(msg, 'content', '')
-            
-            if content and str(content).strip():
-                messages.append({"role": role, "content": content})
-
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile", 
-            messages=messages,
-            temperature=0.7, 
-            max_tokens=800,
-        )
+        if content and str(content).strip():
+            messages.append({"role": role, "content": content})
+    return messages
+
+def _total_tokens(completion):
+    usage = getattr(completion, "usage", None)
+    return getattr(usage, "total_tokens", 0) or 0
+
+def _stream_tokens(chunk):
+    """Total tokens reported on a stream chunk (Groq puts usage under x_groq on the last one), else 0."""
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        x_groq = getattr(chunk, "x_groq", None)
+        usage = x_groq.get("usage") if isinstance(x_groq, dict) else getattr(x_groq, "usage", None)
+    if isinstance(usage, dict):
+        return usage.get("total_tokens") or 0
+    return getattr(usage, "total_tokens", 0) or 0
+
+def _fellini_messages(history: list, movie_context: str):
+    """Builds the Fellini message chain for a chat turn."""
+    messages, metrics = assemble_prompt(_fellini_system_prompt(movie_context), _history_messages(history))
+    logger.info(f"Fellini prompt ~{metrics['prompt_tokens']} tokens ({metrics['dropped_turns']} turns summarized, {metrics['clipped_turns']} clipped)")
+    return messages
+
+def _lumiere_messages(history: list):
+    """Builds the Lumière message chain for an admin chat turn."""
+    messages, metrics = assemble_prompt(LUMIERE_SYSTEM_PROMPT, _history_messages(history))
+    logger.info(f"Lumière prompt ~{metrics['prompt_tokens']} tokens ({metrics['dropped_turns']} turns summarized, {metrics['clipped_turns']} clipped)")
+    return messages
+
+# --- GROQ CLIENT ---
+
+_async_groq = None
+
+def _get_async_groq():
+    """Shared AsyncGroq client riding on the app-wide connection pool."""
+    global _async_groq
+    api_key = os.environ.get("GROQ_API_KEY")
+    if not api_key:
+        return None
+    if _async_groq is None:
+        from groq import AsyncGroq  # the SDK is heavy; loaded on the first chat, not at cold start
+        _async_groq = AsyncGroq(api_key=api_key, base_url=os.environ.get("GROQ_BASE_URL"), http_client=get_async_http())
+    return _async_groq
+
+async def _shared_reply(history: list, version: str):
+    """
+    A cached reply, or the reply to the identical question another request
+    is already asking Groq (single-flight). None means this caller asks,
+    and must settle the flight with chat_cache.finish() or abandon().
+    """
+    while True:
+        cached = chat_cache.get(history, version)
+        if cached:
+            return cached
+        flight = chat_cache.join(history, version)
+        if flight is None:
+            return None
+        reply = await asyncio.shield(flight)
+        # None: that request was shed or cancelled, so try again
+        if reply:
+            return reply
+
+async def get_ai_response_async(history: list, movie_context: str):
+    """
+    FELLINI: The Public-Facing Concierge.
+    """
+    try:
+        client = _get_async_groq()
+        if not client:
+            logger.error("Error: GROQ_API_KEY not found.")
+            return "I'm having trouble connecting to the cinema archive."
+
+        version = context_version(movie_context)
+        shared = await _shared_reply(history, version)
+        if shared:
+            return shared
+
+        reply = None
+        try:
+            started = time.perf_counter()
+            async with upstream_gates["groq"]:
+                with span("groq", "chat"):
+                    completion = await client.chat.completions.create(
+                        model=MODEL,
+                        messages=_fellini_messages(history, movie_context),
+                        temperature=0.7,
+                        max_tokens=1000,
+                    )
+
+            reply = completion.choices[0].message.content
+            chat_cache.finish(history, version, reply, _total_tokens(completion), time.perf_counter() - started)
+            return reply
+        except Overloaded:
+            raise
+        except Exception:
+            reply = "I'm having a bit of stage fright. Please ask again later."
+            raise
+        finally:
+            # No-op after finish(); otherwise waiters get the fallback, or retry if shed/cancelled
+            chat_cache.abandon(history, version, reply)
+
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"AI ERROR: {str(e)}")
+        return "I'm having a bit of stage fright. Please ask again later."
+
+async def get_admin_ai_response_async(history: list):
+    """
+    THE CURATOR: Lumière The Admin Aide.
+    Focuses on Dashboard help and Film Curation/Planning.
+    """
+    try:
+        client = _get_async_groq()
+        if not client:
+            return "System Error: API Key missing."
+
+        async with upstream_gates["groq"]:
+            with span("groq", "chat"):
+                completion = await client.chat.completions.create(
+                    model=MODEL,
+                    messages=_lumiere_messages(history),
+                    temperature=0.7,
+                    max_tokens=800,
+                )
 
         return completion.choices[0].message.content
 
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"ADMIN AI ERROR: {str(e)}")
+        return "I'm unable to access the archives right now. Please try again."
+
+
+# --- STREAMING (SSE) ---
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Formats one Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+async def _stream_completion_async(messages: list, max_tokens: int, fallback: str,
+                                   on_complete=None, on_abandon=None):
+    """
+    Yields SSE frames as Groq produces tokens.
+    Starlette cancels the generator if the client disconnects, which closes
+    the upstream stream so Groq stops generating tokens nobody will read.
+    on_complete(reply, tokens, latency) runs after a full reply; otherwise
+    on_abandon(fallback) after an upstream error, or on_abandon(None) when
+    the stream was shed or cancelled.
+    """
+    client = _get_async_groq()
+    if not client:
+        if on_abandon:
+            on_abandon(fallback)
+        yield sse_event({"delta": fallback})
+        yield sse_event({}, event="done")
+        return
+
+    stream = None
+    parts = []
+    tokens = 0
+    started = time.perf_counter()
+    gate = upstream_gates["groq"]
+    admitted = False
+    settled = False
+    outcome = None
+    try:
+        await gate.__aenter__()
+        admitted = True
+        stream = await client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        async for chunk in stream:
+            tokens = _stream_tokens(chunk) or tokens
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+        reply = "".join(parts)
+        if not tokens:
+            # No usage on the stream; estimated the way the prompt budget is
+            tokens = sum(estimate_tokens(m["content"]) for m in messages) + estimate_tokens(reply)
+        settled = True
+        if on_complete:
+            on_complete(reply, tokens, time.perf_counter() - started)
+        yield sse_event({}, event="done")
+
+    except asyncio.CancelledError:
+        logger.info("Chat stream abandoned by client.")
+        raise
+    except Overloaded:
+        # Raised before the first frame; _started turns it into a 429
+        raise
     except Exception as e:
-        print(f"ADMIN AI ERROR: {str(e)}")
-        return "I'm unable to access the archives right now. Please try again."
\ No newline at end of file
+        logger.error(f"AI STREAM ERROR: {str(e)}")
+        outcome = fallback
+        if on_abandon:
+            on_abandon(outcome)
+            settled = True
+        yield sse_event({"delta": fallback})
+        yield sse_event({}, event="done")
+    finally:
+        # Nothing here may await before the slot is freed: on disconnect the
+        # cancellation is re-delivered at every await in this block
+        if on_abandon and not settled:
+            on_abandon(outcome)
+        if admitted:
+            upstream_latency.observe(time.perf_counter() - started, upstream="groq", operation="stream")
+            gate.release()
+        if stream is not None:
+            await asyncio.shield(stream.response.aclose())
+
+async def _replay(frames: list):
+    for frame in frames:
+        yield frame
+
+async def _started(frames):
+    """
+    Runs the stream up to its first frame before the response starts, so a
+    shed request (Overloaded) still gets a 429 + Retry-After instead of a
+    200 followed by a broken stream.
+    """
+    first = await frames.__anext__()
+
+    async def resumed():
+        yield first
+        async for frame in frames:
+            yield frame
+    return resumed()
+
+async def stream_ai_response_async(history: list, movie_context: str):
+    """
+    Streaming Fellini (FastAPI). Raises Overloaded when Groq is saturated.
+    Cached replies, and replies to a question another request is already
+    streaming, are sent as a single frame.
+    """
+    version = context_version(movie_context)
+    shared = await _shared_reply(history, version)
+    if shared:
+        return _replay([sse_event({"delta": shared}), sse_event({}, event="done")])
+    try:
+        messages = _fellini_messages(history, movie_context)
+    except BaseException:
+        chat_cache.abandon(history, version)
+        raise
+    return await _started(_stream_completion_async(
+        messages, 1000,
+        "I'm having a bit of stage fright. Please ask again later.",
+        on_complete=lambda reply, tokens, latency: chat_cache.finish(history, version, reply, tokens, latency),
+        on_abandon=lambda reply: chat_cache.abandon(history, version, reply),
+    ))
+
+async def stream_admin_ai_response_async(history: list):
+    """Streaming Lumière (FastAPI). Raises Overloaded when Groq is saturated."""
+    return await _started(_stream_completion_async(
+        _lumiere_messages(history), 800,
+        "I'm unable to access the archives right now. Please try again.",
+    ))
@@ -0,0 +1,287 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+import reservations
+
+logger = logging.getLogger("FalutinAPI.checkin")
+
+# CONFIGURATION
+# Rows per keyset page when preloading a screening's guest list
+CHECKIN_PAGE_SIZE = int(os.environ.get("CHECKIN_PAGE_SIZE", "1000"))
+# How often queued scans are written back, and how many per round trip
+CHECKIN_FLUSH_INTERVAL = float(os.environ.get("CHECKIN_FLUSH_INTERVAL", "1"))
+CHECKIN_BATCH = int(os.environ.get("CHECKIN_BATCH", "200"))
+# Serverless instances are frozen between requests: scans are written before the answer there
+CHECKIN_WRITE_THROUGH = os.environ.get("CHECKIN_WRITE_THROUGH", "1" if os.environ.get("VERCEL") else "0") == "1"
+
+# Server outcomes that mean this worker's local answer was wrong
+REJECTED_OUTCOMES = ("conflict", "not_paid", "unknown")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Guest:
+    __slots__ = ("checkout_id", "receipt", "name", "tickets", "checked_in_at", "checked_in_by")
+
+    def __init__(self, row: dict):
+        self.checkout_id = row["checkout_request_id"]
+        self.receipt = row.get("mpesa_receipt")
+        self.name = row.get("name")
+        self.tickets = row.get("tickets") or 1
+        self.checked_in_at = row.get("checked_in_at")
+        self.checked_in_by = row.get("checked_in_by")
+
+    def to_dict(self) -> dict:
+        return {
+            "checkout_request_id": self.checkout_id,
+            "mpesa_receipt": self.receipt,
+            "name": self.name,
+            "tickets": self.tickets,
+            "checked_in_at": self.checked_in_at,
+            "checked_in_by": self.checked_in_by,
+        }
+
+
+class GuestList:
+    """
+    One screening's paid tickets, indexed by every code a guest can
+    present: the checkout ID the ticket QR encodes, or the M-Pesa receipt
+    from their SMS. Lookups are a single dict hit.
+    """
+
+    def __init__(self, screening_id: str):
+        self.screening_id = screening_id
+        self.guests = {}
+        self._by_code = {}
+        self.checked_in = 0
+        self.loaded_at = time.time()
+
+    def add(self, row: dict) -> Guest:
+        guest = Guest(row)
+        previous = self.guests.get(guest.checkout_id)
+        if previous and previous.checked_in_at:
+            self.checked_in -= 1
+        self.guests[guest.checkout_id] = guest
+        self._by_code[guest.checkout_id] = guest
+        if guest.receipt:
+            self._by_code[guest.receipt.upper()] = guest
+        if guest.checked_in_at:
+            self.checked_in += 1
+        return guest
+
+    def find(self, code: str):
+        code = code.strip()
+        return self._by_code.get(code) or self._by_code.get(code.upper())
+
+    def set_state(self, guest: Guest, checked_in_at, checked_in_by):
+        self.checked_in += bool(checked_in_at) - bool(guest.checked_in_at)
+        guest.checked_in_at = checked_in_at
+        guest.checked_in_by = checked_in_by
+
+    def get_stats(self) -> dict:
+        return {
+            "screening_id": self.screening_id,
+            "guests": len(self.guests),
+            "tickets": sum(g.tickets for g in self.guests.values()),
+            "checked_in": self.checked_in,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class CheckInService:
+    """
+    Door check-in against an in-memory guest list.
+    A screening's paid reservations are preloaded once; scans are answered
+    from the index and queued, and a background task writes them back in
+    batches through apply_check_ins() (schema.sql), or before the answer
+    on serverless, where no background task survives. The database settles
+    races between workers or devices: the first check-in wins, and any scan
+    it rejects is recorded as a conflict and corrected in the index.
+    """
+
+    def __init__(self):
+        self._lists = {}
+        self._loading = {}
+        self._pending = []
+        # The chunk flush() is writing back right now
+        self._in_flight = []
+        self.conflicts = deque(maxlen=200)
+        self._flusher = None
+
+    # --- INDEX ---
+
+    async def load(self, screening_id: str) -> GuestList:
+        """(Re)builds a screening's guest list with a keyset scan over its paid rows."""
+        guest_list = GuestList(screening_id)
+        after_id = 0
+        while True:
+            rows = await reservations.paid_page(screening_id, after_id, CHECKIN_PAGE_SIZE)
+            for row in rows:
+                guest_list.add(row)
+            if len(rows) < CHECKIN_PAGE_SIZE:
+                break
+            after_id = rows[-1]["id"]
+
+        # Scans still waiting to be written back (or being written) must survive the reload
+        for pending_screening, event in self._in_flight + self._pending:
+            guest = guest_list.guests.get(event["checkout_request_id"]) if pending_screening == screening_id else None
+            if guest:
+                checked_in = event["action"] == "check_in"
+                guest_list.set_state(guest, event["at"] if checked_in else None, event["device"] if checked_in else None)
+
+        self._lists[screening_id] = guest_list
+        logger.info(f"Loaded {len(guest_list.guests)} guests for screening {screening_id}")
+        return guest_list
+
+    async def guest_list(self, screening_id: str) -> GuestList:
+        """The screening's guest list, loading it on first use (one load however many scans wait)."""
+        guest_list = self._lists.get(screening_id)
+        if guest_list:
+            return guest_list
+        task = self._loading.get(screening_id)
+        if task is None:
+            task = self._loading[screening_id] = asyncio.ensure_future(self.load(screening_id))
+            task.add_done_callback(lambda _: self._loading.pop(screening_id, None))
+        return await asyncio.shield(task)
+
+    async def _resolve(self, guest_list: GuestList, code: str):
+        """(guest, None), or (None, reason) when the code is not a ticket for this screening."""
+        guest = guest_list.find(code)
+        if guest:
+            return guest, None
+
+        # Bought after the preload? One round trip, then it is indexed too
+        row = await reservations.find_ticket(code.strip())
+        if row is None:
+            return None, "unknown"
+        if row.get("screening_id") != guest_list.screening_id:
+            return None, "wrong_screening"
+        if row.get("status") != "paid":
+            return None, "not_paid"
+        return guest_list.add(row), None
+
+    # --- SCANS ---
+
+    async def scan(self, screening_id: str, code: str, device: str = "door") -> dict:
+        """Admits a ticket. Answered from the index; the write-back is queued."""
+        guest_list = await self.guest_list(screening_id)
+        guest, reason = await self._resolve(guest_list, code)
+        if guest is None:
+            return {"result": reason}
+        if guest.checked_in_at:
+            return {"result": "already_checked_in", "guest": guest.to_dict()}
+
+        at = _now()
+        guest_list.set_state(guest, at, device)
+        self._pending.append((screening_id, {"checkout_request_id": guest.checkout_id, "action": "check_in", "at": at, "device": device}))
+
+        if CHECKIN_WRITE_THROUGH:
+            await self.flush()
+        return {"result": "admitted", "guest": guest.to_dict()}
+
+    async def undo(self, screening_id: str, code: str, device: str = "door") -> dict:
+        """Reverses a check-in (wrong guest scanned, or they stepped out)."""
+        guest_list = await self.guest_list(screening_id)
+        guest, reason = await self._resolve(guest_list, code)
+        if guest is None:
+            return {"result": reason}
+        if not guest.checked_in_at:
+            return {"result": "not_checked_in", "guest": guest.to_dict()}
+
+        guest_list.set_state(guest, None, None)
+        self._pending.append((screening_id, {"checkout_request_id": guest.checkout_id, "action": "undo", "at": _now(), "device": device}))
+
+        if CHECKIN_WRITE_THROUGH:
+            await self.flush()
+        return {"result": "undone", "guest": guest.to_dict()}
+
+    async def sync(self, screening_id: str, events: list) -> list:
+        """
+        Applies scans an offline device made against its downloaded list.
+        events: [{"code", "action", "at", "device"}, ...] in scan order.
+        Written through immediately, so the device gets the real outcomes.
+        """
+        guest_list = await self.guest_list(screening_id)
+        batch = []
+        for event in events:
+            guest = guest_list.find(str(event.get("code", "")))
+            batch.append({
+                "checkout_request_id": guest.checkout_id if guest else str(event.get("code", "")).strip(),
+                "action": "undo" if event.get("action") == "undo" else "check_in",
+                "at": event.get("at") or _now(),
+                "device": event.get("device") or "offline",
+            })
+        results = await reservations.apply_check_ins(batch)
+        self._reconcile(screening_id, batch, results)
+        return results
+
+    # --- WRITE-BACK ---
+
+    def _reconcile(self, screening_id: str, events: list, results: list):
+        """Makes the index agree with what the database kept."""
+        guest_list = self._lists.get(screening_id)
+        for event, result in zip(events, results):
+            guest = guest_list.guests.get(result["checkout_request_id"]) if guest_list else None
+            if guest and result["outcome"] != "unknown":
+                guest_list.set_state(guest, result.get("checked_in_at"), result.get("checked_in_by"))
+            if result["outcome"] in REJECTED_OUTCOMES:
+                self.conflicts.append(dict(result, screening_id=screening_id, action=event["action"], device=event["device"]))
+                logger.warning(f"CHECK-IN {result['outcome'].upper()} for {result['checkout_request_id']} ({event['action']} by {event['device']})")
+
+    async def flush(self) -> int:
+        """Writes queued scans back in batches. Returns how many were applied."""
+        written = 0
+        while self._pending and not self._in_flight:
+            chunk, self._pending = self._pending[:CHECKIN_BATCH], self._pending[CHECKIN_BATCH:]
+            # Stays visible to load() until the results are reconciled
+            self._in_flight = chunk
+            try:
+                results = await reservations.apply_check_ins([event for _, event in chunk])
+            except BaseException:
+                # Kept in order at the front; the next flush retries them
+                self._pending[:0] = chunk
+                raise
+            finally:
+                self._in_flight = []
+            for (screening_id, event), result in zip(chunk, results):
+                self._reconcile(screening_id, [event], [result])
+            written += len(chunk)
+        return written
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(CHECKIN_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"CHECK-IN SYNC ERROR: {e}")
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"CHECK-IN SYNC ERROR: {len(self._in_flight) + len(self._pending)} scans not written back: {e}")
+
+    # --- STATS ---
+
+    def get_stats(self) -> dict:
+        return {
+            "screenings": len(self._lists),
+            "guests": sum(len(g.guests) for g in self._lists.values()),
+            "pending": len(self._in_flight) + len(self._pending),
+            "conflicts": len(self.conflicts),
+        }
+
+
+check_in_service = CheckInService()
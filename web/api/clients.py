@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+# requests, httpx and the SDKs are imported on first use, not at module load:
+# a cold start that only serves /health never pays for them.
+
+# --- CONFIGURATION ---
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", "0.3"))
+HTTP_DEFAULT_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "8"))
+# The async client is one pool for every upstream host (Daraja, Groq, Sanity,
+# Supabase, Resend); it keeps HTTP_POOL_SIZE idle connections per host
+HTTP_UPSTREAM_HOSTS = 5
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+
+# --- SHARED SYNC SESSIONS (one keep-alive pool per host) ---
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _new_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class _TimeoutSession(requests.Session):
+        """requests.Session that applies a default timeout to every call"""
+
+        def request(self, *args, **kwargs):
+            kwargs.setdefault("timeout", HTTP_DEFAULT_TIMEOUT)
+            return super().request(*args, **kwargs)
+
+    # Only idempotent methods are retried, so an STK push POST is never sent twice
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+
+    session = _TimeoutSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url: str):
+    """Returns the keep-alive session for the host of `url`, creating it on first use."""
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.setdefault(host, _new_session())
+    return session
+
+
+def _reuse(requests_sent: int, connections_opened: int):
+    return {
+        "requests": requests_sent,
+        "connections": connections_opened,
+        "reused": max(requests_sent - connections_opened, 0),
+    }
+
+
+def get_connection_stats():
+    """
+    Per-host connection reuse for both pools: how many requests went out
+    vs. how many new connections (TLS handshakes) were opened to serve them.
+    """
+    stats = {"async": {host: _reuse(c["requests"], c["connections"]) for host, c in list(_async_counts.items())},
+             "sync": {}}
+    for host, session in list(_sessions.items()):
+        requests_sent, connections_opened = 0, 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_sent += pool.num_requests
+                    connections_opened += pool.num_connections
+        stats["sync"][host] = _reuse(requests_sent, connections_opened)
+    return stats
+
+
+# --- SHARED ASYNC HTTP POOL ---
+# One connection pool for every async outbound call (Daraja, Groq,
+# Supabase, Resend), so connections are reused across requests instead of
+# being opened per call. Clients that need their own defaults (PostgREST's
+# base URL and headers) share it through async_session().
+
+_async_http = None
+_async_transport = None
+_async_counts = defaultdict(lambda: {"requests": 0, "connections": 0})
+
+
+def _origin_host(origin) -> str:
+    """host[:port] as urlsplit() gives it, so both pools report the same keys."""
+    host = origin.host.decode()
+    return host if origin.port in (None, 80, 443) else f"{host}:{origin.port}"
+
+
+def _count_pool(pool):
+    """Counts requests and newly opened connections per host on the httpcore pool."""
+    create_connection, handle_async_request = pool.create_connection, pool.handle_async_request
+
+    def counted_create(origin):
+        _async_counts[_origin_host(origin)]["connections"] += 1
+        return create_connection(origin)
+
+    async def counted_handle(request):
+        _async_counts[_origin_host(request.url.origin)]["requests"] += 1
+        return await handle_async_request(request)
+
+    pool.create_connection = counted_create
+    pool.handle_async_request = counted_handle
+
+
+def _get_async_transport():
+    global _async_transport
+    if _async_transport is None:
+        import httpx
+        # Transport retries only cover failed connects, so a POST is never sent twice
+        _async_transport = httpx.AsyncHTTPTransport(
+            retries=HTTP_RETRIES,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_SIZE * HTTP_UPSTREAM_HOSTS,
+            ),
+        )
+        _count_pool(_async_transport._pool)
+    return _async_transport
+
+
+def async_session(**kwargs):
+    """An httpx.AsyncClient with its own defaults (base_url, headers, ...) on the shared pool."""
+    import httpx
+    return httpx.AsyncClient(transport=_get_async_transport(), **kwargs)
+
+
+def get_async_http():
+    """Returns the shared httpx.AsyncClient, creating it on first use."""
+    global _async_http
+    if _async_http is None or _async_http.is_closed:
+        import httpx
+        _async_http = async_session(timeout=httpx.Timeout(HTTP_DEFAULT_TIMEOUT, connect=5.0))
+    return _async_http
+
+
+async def close_async_http():
+    """Closes the shared pool (called on app shutdown)."""
+    global _async_http, _async_transport
+    if _async_http is not None:
+        await _async_http.aclose()
+        _async_http = None
+    if _async_transport is not None:
+        await _async_transport.aclose()
+        _async_transport = None
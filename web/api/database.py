@@ -1,8 +1,10 @@
 import os
+import logging
 from pathlib import Path
-from supabase import create_client, Client
 from dotenv import load_dotenv
 
+logger = logging.getLogger("FalutinAPI.database")
+
 # 1. Gets the path of the current file 
 current_file_path = Path(__file__).resolve()
 
@@ -18,18 +20,53 @@ env_path = api_directory / ".env"
 # 5. Loads it
 load_dotenv(dotenv_path=env_path)
 
-# 6. Fetches Credentials
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
+# Clients are built on first use, not at import: a cold start that never
+# touches the database (health, chat, QR) doesn't load supabase/postgrest,
+# and missing credentials fail the request that needs them, not every import.
+
 
-# 7. Safety Check
-if not url or not key:
-    print(f"DEBUG: Looking for .env at: {env_path}")
-    raise ValueError("Supabase credentials missing from .env file. Please check path and values.")
+def _credentials():
+    """Fetches and checks the Supabase credentials."""
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        logger.error(f"Supabase credentials missing. Looked for .env at: {env_path}")
+        raise ValueError("Supabase credentials missing from .env file. Please check path and values.")
+    return url, key
 
-# Initializes the client
-supabase: Client = create_client(url, key)
+
+_supabase = None
 
 def get_db():
     """Dependency to get the database client in other files"""
-    return supabase
\ No newline at end of file
+    global _supabase
+    if _supabase is None:
+        from supabase import create_client
+        _supabase = create_client(*_credentials())
+    return _supabase
+
+# --- ASYNC CLIENT (FastAPI) ---
+_async_db = None
+
+def get_async_db():
+    """
+    Async PostgREST client for the FastAPI app.
+    Shares the credentials above and the pool in clients.py; created on first use.
+    """
+    global _async_db
+    if _async_db is None:
+        from postgrest import AsyncPostgrestClient
+        from clients import async_session
+
+        class PooledPostgrestClient(AsyncPostgrestClient):
+            """Sends PostgREST calls over the app-wide connection pool."""
+
+            def create_session(self, base_url, headers, timeout):
+                return async_session(base_url=base_url, headers=headers, timeout=timeout)
+
+        url, key = _credentials()
+        _async_db = PooledPostgrestClient(
+            f"{url}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+        )
+    return _async_db
@@ -1,49 +1,93 @@
-import resend
 import os
+import logging
+from html import escape
+from string import Template
+from functools import lru_cache
+from urllib.parse import quote
+from clients import get_async_http
+from qr_codes import qr_url
+from telemetry import span
 
-def send_ticket_email(to_email: str, movie_title: str, date: str, ticket_id: str, poster_url: str):
-    try:
-        api_key = os.getenv("RESEND_API_KEY")
-        if not api_key:
-            print("EMAIL ERROR: RESEND_API_KEY is missing.")
-            return False
-            
-        resend.api_key = api_key
-        
-        print(f"DEBUG: Sending email to {to_email}...")
-        
-        html_content = f"""
+logger = logging.getLogger("FalutinAPI.email_service")
+
+RESEND_API_URL = os.environ.get("RESEND_API_URL", "https://api.resend.com")
+RESEND_EMAILS_URL = f"{RESEND_API_URL}/emails"
+
+# --- TEMPLATES ---
+# Parsed once at import. The screening part (title, date, poster) is rendered
+# once per screening and cached; only the ticket ID is filled in per email.
+
+TICKET_TEMPLATE = Template("""
         <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto;">
             <div style="background-color: #000; padding: 20px; text-align: center;">
                 <h1 style="color: #EAB308; margin: 0;">FALUTIN FILM CLUB</h1>
             </div>
-            
+            $poster_block
             <div style="padding: 20px; border: 1px solid #ddd;">
                 <h2>Your Ticket is Confirmed!</h2>
-                <p>You are going to see <strong>{movie_title}</strong>.</p>
-                <p><strong>Date:</strong> {date}</p>
-                <p><strong>Ticket ID:</strong> {ticket_id}</p>
-                
+                <p>You are going to see <strong>$movie_title</strong>.</p>
+                <p><strong>Date:</strong> $date</p>
+                <p><strong>Ticket ID:</strong> $ticket_id</p>
+
                 <div style="background-color: #f4f4f4; padding: 15px; margin: 20px 0; text-align: center; border-radius: 8px;">
-                    <img src="https://api.qrserver.com/v1/create-qr-code/?size=150x150&data={ticket_id}" alt="Ticket QR" />
+                    <img src="$qr_url" width="150" height="150" alt="Ticket QR" />
                     <p style="font-size: 12px; color: #666;">Show this QR code at the entrance</p>
                 </div>
-                
+
                 <p>See you at the movies!</p>
             </div>
         </div>
-        """
-
-        r = resend.Emails.send({
-            "from": "onboarding@resend.dev", # For Testing
-            "to": to_email,
-            "subject": f"Ticket: {movie_title}",
-            "html": html_content
-        })
-        
-        print(f"DEBUG: Email sent! ID: {r.get('id')}")
+        """)
+
+POSTER_BLOCK = Template('''<img src="$poster_url" alt="$movie_title" style="width: 100%; display: block;" />''')
+
+@lru_cache(maxsize=64)
+def screening_template(movie_title: str, date: str, poster_url: str = "") -> Template:
+    """Ticket template with the screening details already filled in."""
+    title = escape(movie_title or "")
+    poster_block = POSTER_BLOCK.substitute(poster_url=escape(poster_url), movie_title=title) if poster_url else ""
+    # "$" in screening data must survive the second (per-ticket) substitution
+    return Template(TICKET_TEMPLATE.safe_substitute(
+        movie_title=title.replace("$", "$$"),
+        date=escape(date or "").replace("$", "$$"),
+        poster_block=poster_block.replace("$", "$$"),
+    ))
+
+def build_ticket_email(to_email: str, movie_title: str, date: str, ticket_id: str, poster_url: str = ""):
+    """Builds the Resend payload for a ticket confirmation"""
+    html_content = screening_template(movie_title, date, poster_url or "").substitute(
+        ticket_id=escape(str(ticket_id)),
+        qr_url=escape(qr_url(quote(str(ticket_id)))),
+    )
+
+    return {
+        "from": "onboarding@resend.dev", # For Testing
+        "to": to_email,
+        "subject": f"Ticket: {movie_title}",
+        "html": html_content
+    }
+
+async def send_ticket_email_async(to_email: str, movie_title: str, date: str, ticket_id: str, poster_url: str):
+    """Sends one ticket email through the Resend REST API over the shared pool"""
+    try:
+        api_key = os.getenv("RESEND_API_KEY")
+        if not api_key:
+            logger.error("EMAIL ERROR: RESEND_API_KEY is missing.")
+            return False
+
+        logger.info(f"Sending email to {to_email}...")
+
+        with span("resend", "send"):
+            response = await get_async_http().post(
+                RESEND_EMAILS_URL,
+                json=build_ticket_email(to_email, movie_title, date, ticket_id, poster_url),
+                headers={"Authorization": f"Bearer {api_key}"},
+            )
+        response.raise_for_status()
+
+        logger.info(f"Email sent! ID: {response.json().get('id')}")
         return True
-        
+
     except Exception as e:
-        print(f"EMAIL ERROR: {str(e)}")
-        return False
\ No newline at end of file
+        logger.error(f"EMAIL ERROR: {str(e)}")
+        return False
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from telemetry import pay_duplicates
+
+# CONFIGURATION
+# How long a successful /pay answer is replayed to repeats of the same submission (seconds)
+PAY_RESULT_TTL = float(os.environ.get("PAY_RESULT_TTL", "60"))
+PAY_RESULT_MAX = int(os.environ.get("PAY_RESULT_MAX", "5000"))
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused for a different request body."""
+
+
+class PaymentCoalescer:
+    """
+    Collapses duplicate /pay submissions into one STK push.
+    A submission is known by its Idempotency-Key (when the client sends one)
+    and by its fingerprint: (phone, screening, tickets). Concurrent
+    duplicates await the first attempt and get the same CheckoutRequestID;
+    a successful result is replayed for PAY_RESULT_TTL afterwards. Errors
+    are shared with whoever is waiting but never cached.
+    """
+
+    def __init__(self, ttl: float = PAY_RESULT_TTL, max_entries: int = PAY_RESULT_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"calls": 0, "joined": 0, "replayed": 0}
+        self._inflight = {}           # key -> (future, fingerprint)
+        self._results = OrderedDict() # key -> (result, fingerprint, expires_at)
+        self._by_checkout = {}        # checkout_id -> keys its result is stored under
+
+    @staticmethod
+    def keys(fingerprint: tuple, idempotency_key: str = None) -> list:
+        keys = [("submission", *fingerprint)]
+        if idempotency_key:
+            keys.insert(0, ("key", idempotency_key.strip()))
+        return keys
+
+    def _check(self, key: tuple, stored_fingerprint: tuple, fingerprint: tuple):
+        if key[0] == "key" and stored_fingerprint != fingerprint:
+            raise IdempotencyConflict("Idempotency-Key was already used for a different payment")
+
+    def _cached(self, key: tuple):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            self._results.pop(key, None)
+            return None
+        return entry
+
+    async def run(self, fingerprint: tuple, idempotency_key: str, call):
+        """
+        Runs `call()` once per group of matching submissions.
+        Returns (result, shared): shared is True when the result came from
+        another request's attempt rather than this one's.
+        """
+        keys = self.keys(fingerprint, idempotency_key)
+
+        for key in keys:
+            cached = self._cached(key)
+            if cached:
+                self._check(key, cached[1], fingerprint)
+                self.stats["replayed"] += 1
+                pay_duplicates.inc(kind="replayed")
+                return cached[0], True
+
+        for key in keys:
+            inflight = self._inflight.get(key)
+            if inflight:
+                self._check(key, inflight[1], fingerprint)
+                self.stats["joined"] += 1
+                pay_duplicates.inc(kind="joined")
+                return await asyncio.shield(inflight[0]), True
+
+        self.stats["calls"] += 1
+        future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._inflight[key] = (future, fingerprint)
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()   # Marks it retrieved when nobody joined
+            raise
+        finally:
+            for key in keys:
+                if self._inflight.get(key, (None,))[0] is future:
+                    del self._inflight[key]
+
+        future.set_result(result)
+        if result.get("status") == "success":
+            self._store(keys, fingerprint, result)
+        return result, False
+
+    def _store(self, keys: list, fingerprint: tuple, result: dict):
+        expires_at = time.monotonic() + self.ttl
+        for key in keys:
+            self._results[key] = (result, fingerprint, expires_at)
+            self._results.move_to_end(key)
+        self._by_checkout[result.get("checkout_id")] = keys
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        if len(self._by_checkout) > self.max_entries:
+            self._by_checkout.pop(next(iter(self._by_checkout)))
+
+    def forget(self, checkout_id: str):
+        """
+        The payment failed: the same submission may now start a new STK push.
+        Results stored under an Idempotency-Key stay, so a retry of that exact
+        request still gets its original answer.
+        """
+        for key in self._by_checkout.pop(checkout_id, ()):
+            if key[0] == "submission":
+                self._results.pop(key, None)
+
+    def get_stats(self):
+        return dict(self.stats, in_flight=len({id(f) for f, _ in self._inflight.values()}), cached=len(self._results))
+
+
+# Shared instance used by /pay
+pay_coalescer = PaymentCoalescer()
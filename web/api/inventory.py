@@ -0,0 +1,147 @@
+import os
+import logging
+import time
+import uuid
+import asyncio
+from database import get_async_db
+from telemetry import span
+
+logger = logging.getLogger("FalutinAPI.inventory")
+
+# CONFIGURATION
+# Must outlive the STK prompt (~60s) plus a slow callback
+SEAT_HOLD_TTL = int(os.environ.get("SEAT_HOLD_TTL", "180"))
+# How long an availability figure is trusted for reads and fast sold-out rejects
+AVAILABILITY_TTL = float(os.environ.get("AVAILABILITY_TTL", "2"))
+HOLD_SWEEP_INTERVAL = int(os.environ.get("HOLD_SWEEP_INTERVAL", "30"))
+
+
+class SoldOutError(Exception):
+    def __init__(self, available: int):
+        super().__init__(f"Only {max(available, 0)} seats left")
+        self.available = max(available, 0)
+
+
+class SeatInventory:
+    """
+    Per-screening seat counts.
+    The database is the source of truth: hold_seats() is a conditional
+    UPDATE under a row lock, so concurrent /pay calls cannot oversell.
+    The in-memory counter only serves availability reads and rejects
+    obviously sold-out requests without a round trip.
+    """
+
+    def __init__(self):
+        self._available = {}
+        self._sweeper = None
+
+    # --- MEMORY ---
+
+    def _cached(self, screening_id: str):
+        entry = self._available.get(screening_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def _remember(self, screening_id: str, available: int):
+        self._available[screening_id] = (available, time.monotonic() + AVAILABILITY_TTL)
+
+    # --- OPERATIONS ---
+
+    async def availability(self, screening_id: str, capacity: int):
+        """Seats left, from memory if fresh. None means the screening has no limit."""
+        if not capacity:
+            return None
+        cached = self._cached(screening_id)
+        if cached is not None:
+            return cached
+
+        with span("supabase", "seats_available"):
+            response = await get_async_db().rpc("seats_available", {"p_screening_id": screening_id}).execute()
+        available = response.data if isinstance(response.data, int) else capacity
+        self._remember(screening_id, available)
+        return available
+
+    async def hold(self, screening_id: str, capacity: int, tickets: int):
+        """
+        Holds seats for an STK push. Returns the hold ID (None for unlimited
+        screenings). Raises SoldOutError if not enough seats remain.
+        """
+        if not capacity:
+            return None
+
+        cached = self._cached(screening_id)
+        if cached is not None and cached < tickets:
+            raise SoldOutError(cached)
+
+        hold_id = uuid.uuid4().hex
+        with span("supabase", "hold_seats"):
+            response = await get_async_db().rpc("hold_seats", {
+                "p_hold_id": hold_id,
+                "p_screening_id": screening_id,
+                "p_capacity": capacity,
+                "p_tickets": tickets,
+                "p_ttl_seconds": SEAT_HOLD_TTL,
+            }).execute()
+
+        remaining = response.data
+        if remaining is None or remaining < 0:
+            # Re-reads the true figure so the next caller gets a correct fast reject
+            self._available.pop(screening_id, None)
+            raise SoldOutError(await self.availability(screening_id, capacity) or 0)
+
+        self._remember(screening_id, remaining)
+        return hold_id
+
+    async def attach(self, hold_id: str, checkout_id: str):
+        if hold_id:
+            with span("supabase", "attach_hold"):
+                await get_async_db().rpc("attach_hold", {"p_hold_id": hold_id, "p_checkout_request_id": checkout_id}).execute()
+
+    async def release(self, hold_id: str = None, checkout_id: str = None):
+        """Gives held seats back (failed/abandoned payment)."""
+        await self._settle(hold_id, checkout_id, paid=False)
+
+    async def confirm(self, checkout_id: str):
+        """Turns the hold for a paid checkout into sold seats."""
+        await self._settle(None, checkout_id, paid=True)
+
+    async def _settle(self, hold_id, checkout_id, paid: bool):
+        if not hold_id and not checkout_id:
+            return
+        with span("supabase", "settle_hold"):
+            await get_async_db().rpc("settle_hold", {
+                "p_hold_id": hold_id,
+                "p_checkout_request_id": checkout_id,
+                "p_paid": paid,
+            }).execute()
+        # Counts changed; the next read goes to the DB
+        self._available.clear()
+
+    # --- EXPIRY ---
+
+    async def expire_stale_holds(self):
+        with span("supabase", "expire_seat_holds"):
+            response = await get_async_db().rpc("expire_seat_holds", {}).execute()
+        if response.data:
+            logger.info(f"Released expired seat holds on {response.data} screening(s).")
+            self._available.clear()
+
+    async def _sweep(self):
+        while True:
+            try:
+                await self.expire_stale_holds()
+            except Exception as e:
+                logger.error(f"INVENTORY ERROR: {e}")
+            await asyncio.sleep(HOLD_SWEEP_INTERVAL)
+
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+
+
+seat_inventory = SeatInventory()
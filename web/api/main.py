@@ -1,29 +1,105 @@
 import asyncio
-import requests
+import logging
+import os
+import time
 import re 
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Header, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from app.database import supabase
-from app.mpesa import trigger_stk_push
-from app.email_service import send_ticket_email
-from app.chat_service import get_ai_response, get_admin_ai_response 
+import reservations
+from mpesa import initiate_stk_push_async, get_token_stats, normalize_phone
+from notifications import email_dispatcher
+from email_service import send_ticket_email_async
+from chat_service import get_ai_response_async, get_admin_ai_response_async, stream_ai_response_async, stream_admin_ai_response_async, sse_event
+from catalog import get_movie_context, get_screening, get_ticket_details, invalidate_catalog, get_public_screening, get_public_screenings, get_upcoming_screenings, screening_catalog
+from inventory import seat_inventory, SoldOutError
+from admission import Overloaded, pay_ip_limiter, pay_phone_limiter, chat_ip_limiter, client_ip, get_admission_stats
+from clients import close_async_http, get_connection_stats
+from response_cache import chat_cache
+from prompt_budget import prompt_stats
+from callback_queue import CallbackQueue
+from reconciler import Reconciler
+from status_hub import status_hub, TERMINAL_STATUSES
+from qr_codes import get_qr, pregenerate, qr_etag, is_valid_ticket_id, CONTENT_TYPES, QR_CACHE_HEADERS
+from stats import admin_stats
+import reservation_feed
+from idempotency import pay_coalescer, IdempotencyConflict
+from checkin import check_in_service
+from polls import poll_service, recent_votes, POLL_RESULTS_TTL
+from admin_auth import is_admin, member_id
+from telemetry import configure_logging, new_request_id, http_latency, payment_results, register_gauges, render_metrics
+
+configure_logging()
+logger = logging.getLogger("FalutinAPI.main")
 
 app = FastAPI(title="Falutin Fam API", version="1.0.1")
+# Every route is served both at the root (local dev, NEXT_PUBLIC_API_URL)
+# and under /api (the Vercel deployment, where the frontend calls /api/*)
+router = APIRouter()
 
 # --- CONFIGURATION ---
-SANITY_PROJECT_ID = "xet7dw4q" 
-SANITY_DATASET = "production"
+SANITY_WEBHOOK_SECRET = os.environ.get("SANITY_WEBHOOK_SECRET")
+# Serverless instances are frozen between requests, so background queue
+# workers can't be relied on there: callbacks are then processed before the ack.
+CALLBACK_MODE = os.environ.get("CALLBACK_MODE", "inline" if os.environ.get("VERCEL") else "queue")
 
 # --- CORS CONFIGURATION ---
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000"],
+    allow_origins=os.environ.get("CORS_ORIGINS", "http://localhost:3000").split(","),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# --- ADMISSION CONTROL ---
+def overloaded_response(error: Overloaded):
+    return JSONResponse(
+        {"status": "error", "details": str(error)},
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+@app.exception_handler(Overloaded)
+async def handle_overloaded(request: Request, error: Overloaded):
+    return overloaded_response(error)
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Per-IP token buckets for the endpoints that spend paid upstream quota."""
+    path = request.url.path.removeprefix("/api")
+    ip = client_ip(request.headers, request.client.host if request.client else None)
+    try:
+        if path == "/pay":
+            pay_ip_limiter.check(ip)
+        elif path.startswith("/chat") or path.startswith("/admin-chat"):
+            chat_ip_limiter.check(ip)
+    except Overloaded as e:
+        return overloaded_response(e)
+    return await call_next(request)
+
+# --- INSTRUMENTATION ---
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Tags logs with a request ID and records latency per route template."""
+    request_id = new_request_id(request.headers.get("x-request-id"))
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_latency.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status,
+        )
+
 # --- DATA MODELS ---
 class PaymentRequest(BaseModel):
     name: str      
@@ -40,26 +116,16 @@ class Message(BaseModel):
 
 class ChatRequest(BaseModel): 
     history: list[Message] 
+    isAdmin: bool = False
 
-# --- HELPER FUNCTIONS ---
+class EmailRequest(BaseModel):
+    email: str
+    ticketId: str
+    movie: str = "Falutin Screening"
+    date: str = "Upcoming"
+    poster: str = ""
 
-def fetch_movies_for_context():
-    """Fetches active screenings from Sanity to feed the AI."""
-    query = '*[_type == "screening"]{date, price, movie->{title, description}}'
-    url = f"https://{SANITY_PROJECT_ID}.api.sanity.io/v2021-10-21/data/query/{SANITY_DATASET}?query={query}"
-    
-    try:
-        response = requests.get(url).json()
-        screenings = response.get('result', [])
-        
-        context_text = ""
-        for s in screenings:
-            context_text += f"- MOVIE: {s['movie']['title']} | DATE: {s['date']} | PRICE: {s['price']} KES\n"
-        
-        return context_text
-    except Exception as e:
-        print(f"SANITY ERROR: {str(e)}")
-        return "No movies currently scheduled."
+# --- HELPER FUNCTIONS ---
 
 def sanitize_email(email: str) -> str:
     """Attempts to fix common email typos automatically."""
@@ -69,50 +135,197 @@ def sanitize_email(email: str) -> str:
         email = email.replace("gmailcom", "gmail.com")
     return email
 
+async def require_admin(authorization: str = Header(None), x_admin_key: str = Header(None)):
+    """Route dependency: a Supabase admin session (Bearer token) or the X-Admin-Key."""
+    if not await is_admin(authorization, x_admin_key):
+        raise HTTPException(status_code=401, detail="Admin session required")
+
+async def require_member(authorization: str = Header(None)) -> str:
+    """Route dependency: the signed-in member's Supabase user id."""
+    user_id = await member_id(authorization)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Sign in to vote")
+    return user_id
+
 # --- ENDPOINTS ---
 
-@app.get("/")
+@router.get("/")
+@router.get("/health")
 async def health_check():
-    return {"status": "active", "message": "Falutin Reservation System Online"}
+    return {
+        "status": "active",
+        "message": "Falutin Reservation System Online",
+        "mpesa_token": get_token_stats(),
+        "connections": get_connection_stats(),
+        "chat_cache": chat_cache.get_stats(),
+        "prompts": prompt_stats.get_stats(),
+        "callbacks": callback_queue.get_stats(),
+        "payment_status": status_hub.get_stats(),
+        "emails": email_dispatcher.get_stats(),
+        "admission": get_admission_stats(),
+        "payments": pay_coalescer.get_stats(),
+        "reconciler": reconciler.get_stats(),
+        "polls": poll_service.get_stats(),
+    }
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus scrape target."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+async def warm_catalog():
+    # Primes the screening catalog so the first chat doesn't wait on Sanity
+    await asyncio.to_thread(get_movie_context)
+
+@app.on_event("shutdown")
+async def close_clients():
+    await close_async_http()
 
-@app.post("/chat")
+@router.post("/chat")
 async def chat_endpoint(request: ChatRequest):
-    context = fetch_movies_for_context()
-    reply = get_ai_response(request.history, context)
+    if request.isAdmin:
+        return {"reply": await get_admin_ai_response_async(request.history)}
+
+    # Served from the in-process catalog; only a cold cache touches Sanity
+    context = await asyncio.to_thread(get_movie_context)
+    reply = await get_ai_response_async(request.history, context)
     return {"reply": reply}
 
 # --- ADMIN CHAT ENDPOINT ---
-@app.post("/admin-chat")
+@router.post("/admin-chat")
 async def admin_chat_endpoint(request: ChatRequest):
     """
     Dedicated endpoint for the Admin Aide (The Curator).
     Helps with Dashboard navigation and Event Planning.
     """
-    reply = get_admin_ai_response(request.history)
+    reply = await get_admin_ai_response_async(request.history)
     return {"reply": reply}
 
-@app.post("/pay")
-async def initiate_payment(request: PaymentRequest):
+# --- STREAMING CHAT (SSE) ---
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    if request.isAdmin:
+        return await admin_chat_stream_endpoint(request)
+    context = await asyncio.to_thread(get_movie_context)
+    frames = await stream_ai_response_async(request.history, context)
+    return StreamingResponse(frames, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/admin-chat/stream")
+async def admin_chat_stream_endpoint(request: ChatRequest):
+    frames = await stream_admin_ai_response_async(request.history)
+    return StreamingResponse(frames, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/catalog/invalidate")
+async def invalidate_catalog_endpoint(x_webhook_secret: str = Header(None)):
+    """
+    Sanity webhook target: called when screenings are published or edited.
+    """
+    if SANITY_WEBHOOK_SECRET and x_webhook_secret != SANITY_WEBHOOK_SECRET:
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+
+    version = invalidate_catalog()
+    poll_service.invalidate()
+    return {"status": "refreshing", "version": version}
+
+# --- PUBLIC SCREENINGS ---
+# Served from the catalog's redacted snapshot; secret titles never leave it before revealDate.
+PUBLIC_MAX_AGE = 60
+
+def public_cache_headers(etag: str) -> dict:
+    # Never cached past the next reveal, so the real title shows up on time
+    max_age = PUBLIC_MAX_AGE
+    reveal_in = screening_catalog.seconds_to_next_reveal()
+    if reveal_in is not None:
+        max_age = int(min(max_age, reveal_in))
+    return {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+
+@router.get("/screenings")
+async def list_screenings(upcoming: bool = True, if_none_match: str = Header(None)):
+    screenings = await asyncio.to_thread(get_upcoming_screenings if upcoming else get_public_screenings)
+    etag = f'"{screening_catalog.public_etag}-{len(screenings)}-{int(upcoming)}"'
+    headers = public_cache_headers(etag)
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(screenings, headers=headers)
+
+@router.get("/screenings/{screening_id}")
+async def public_screening(screening_id: str, if_none_match: str = Header(None)):
+    screening = await asyncio.to_thread(get_public_screening, screening_id)
+    if screening is None:
+        raise HTTPException(status_code=404, detail="Screening not found")
+    etag = f'"{screening_catalog.public_etag}-{screening_id}"'
+    headers = public_cache_headers(etag)
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(screening, headers=headers)
+
+@router.get("/availability/{screening_id}")
+async def availability(screening_id: str):
+    screening = await asyncio.to_thread(get_screening, screening_id)
+    capacity = (screening or {}).get("capacity")
+    try:
+        available = await seat_inventory.availability(screening_id, capacity)
+    except Exception as e:
+        logger.error(f"INVENTORY ERROR: {e}")
+        available = None
+    return {"screening_id": screening_id, "capacity": capacity, "available": available}
+
+@router.post("/pay")
+async def initiate_payment(request: PaymentRequest, response: Response, idempotency_key: str = Header(None)):
+    """
+    Starts an STK push. Double-taps and client retries of the same
+    submission share one attempt and get the same checkout_id.
+    """
+    fingerprint = (normalize_phone(request.phone), request.screening_id, request.tickets)
     try:
-        print(f"DEBUG: Starting payment for {request.name}...")
+        result, shared = await pay_coalescer.run(fingerprint, idempotency_key, lambda: start_payment(request))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if shared:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def start_payment(request: PaymentRequest):
+    # Fails closed: without the catalog entry there is no capacity to hold seats against
+    screening = await asyncio.to_thread(get_screening, request.screening_id)
+    if screening is None:
+        logger.warning(f"PAYMENT REJECTED: unknown screening {request.screening_id}")
+        return {"status": "error", "details": "Screening not found"}
+
+    # One STK prompt at a time per phone, however often the button is tapped
+    pay_phone_limiter.check(normalize_phone(request.phone))
+
+    hold_id = None
+    checkout_id = None
+    try:
+        logger.info(f"Starting payment for {request.name}...")
 
         # 1. CALCULATES TOTAL
         total_cost = request.amount * request.tickets
 
-        # 2. Triggers M-Pesa
-        mpesa_res = trigger_stk_push(
+        # 2. Holds the seats before anyone is asked to pay
+        capacity = screening.get("capacity")
+        hold_id = await seat_inventory.hold(request.screening_id, capacity, request.tickets)
+
+        # 3. Triggers M-Pesa
+        mpesa_res = await initiate_stk_push_async(
             phone_number=request.phone, 
             amount=total_cost, 
             reference=request.screening_id
         )
         
-        # 3. Extracts Tracking ID
+        # 4. Extracts Tracking ID
         checkout_id = mpesa_res.get("CheckoutRequestID")
         
         if not checkout_id:
             raise HTTPException(status_code=500, detail="M-Pesa failed to return a tracking ID")
 
-        # 4. Saves to Supabase 
+        await seat_inventory.attach(hold_id, checkout_id)
+
+        # 5. Saves to Supabase 
         data = {
             "name": request.name,       
             "phone": request.phone,
@@ -124,92 +337,395 @@ async def initiate_payment(request: PaymentRequest):
             "status": "pending"
         }
         
-        supabase.table("reservations").insert(data).execute()
-        print(f"DEBUG: Database record created for ID: {checkout_id}")
+        await reservations.create_reservation(data)
+        status_hub.remember(checkout_id, "pending")
+        logger.info(f"Database record created for ID: {checkout_id}")
         
         return {"status": "success", "checkout_id": checkout_id}
+
+    except SoldOutError as e:
+        logger.warning(f"SOLD OUT: {request.screening_id} ({e})")
+        return {"status": "sold_out", "available": e.available, "details": str(e)}
         
     except Exception as e:
-        print(f"PAYMENT ERROR: {str(e)}")
+        if not isinstance(e, Overloaded):
+            logger.error(f"PAYMENT ERROR: {str(e)}")
+        # No STK prompt went out, so nobody can pay for these seats
+        if hold_id and not checkout_id:
+            try:
+                await seat_inventory.release(hold_id=hold_id)
+            except Exception as release_error:
+                logger.error(f"INVENTORY ERROR: {release_error}")
+        if isinstance(e, Overloaded):
+            raise
         return {"status": "error", "details": str(e)}
 
-@app.post("/callback")
+async def send_ticket(checkout_id: str, booking_data: dict):
+    """Non-critical: renders the QR and sends the ticket. Failures are logged only."""
+    try:
+        # Renders the ticket QR now so the email's first open is a cache hit
+        await asyncio.to_thread(get_qr, checkout_id)
+
+        if not (booking_data and booking_data.get("email")):
+            logger.warning("No email found for this booking.")
+            return
+
+        safe_email = sanitize_email(booking_data["email"])
+        logger.info(f"Queueing ticket for {safe_email}...")
+        screening = await asyncio.to_thread(get_ticket_details, booking_data.get("screening_id"))
+        ticket = dict(to_email=safe_email, ticket_id=checkout_id, **screening)
+
+        if CALLBACK_MODE == "inline":
+            # No background thread survives a serverless freeze; sends now
+            await send_ticket_email_async(**ticket)
+        else:
+            # Written to the outbox before the callback job is acked;
+            # the dispatcher task batches and rate-limits the sends
+            await email_dispatcher.enqueue(**ticket)
+
+    except Exception as email_error:
+        logger.error(f"NOTIFICATION ERROR: Failed to send email, but payment is safe. Error: {email_error}")
+
+def _receipt(body: dict):
+    meta = body.get("CallbackMetadata", {}).get("Item", [])
+    return next((item.get("Value") for item in meta if item.get("Name") == "MpesaReceiptNumber"), None)
+
+async def process_payment_results(bodies: list):
+    """
+    Applies a batch of stkCallback bodies (a queue worker's claim, a
+    reconciler page, or one inline callback on serverless).
+    Every status transition goes out in one round trip; the UPDATE only
+    matches rows still awaiting a result and returns them, so a replay
+    never sends a second ticket. Raises on DB errors so the batch is retried.
+    """
+    transitions = []
+    for body in bodies:
+        result_code = body.get("ResultCode")
+        payment_results.inc(result_code=result_code)
+        transitions.append({
+            "checkout_request_id": body.get("CheckoutRequestID"),
+            "status": "paid" if result_code == 0 else "failed",
+            "mpesa_receipt": _receipt(body) if result_code == 0 else None,
+        })
+
+    updated = {row["checkout_request_id"]: row for row in await reservations.apply_transitions(transitions)}
+    if updated:
+        admin_stats.invalidate()
+
+    async def settle(transition: dict):
+        checkout_id = transition["checkout_request_id"]
+        if transition["status"] == "paid":
+            # --- CRITICAL PATH: MARKS PAYMENT AS SUCCESS ---
+            logger.info(f"PAYMENT CONFIRMED for {checkout_id}")
+            booking_data = updated.get(checkout_id)
+            if booking_data:
+                # Before the seat confirm, so a retry after a failed confirm doesn't lose the ticket
+                await send_ticket(checkout_id, booking_data)
+            await seat_inventory.confirm(checkout_id)
+            status_hub.publish(checkout_id, "paid")
+        else:
+            # Payment Failed (User cancelled or insufficient funds)
+            logger.warning(f"PAYMENT FAILED for {checkout_id}")
+            # The same submission may start a fresh STK push now
+            pay_coalescer.forget(checkout_id)
+            await seat_inventory.release(checkout_id=checkout_id)
+            status_hub.publish(checkout_id, "failed")
+
+    for outcome in await asyncio.gather(*(settle(t) for t in transitions), return_exceptions=True):
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+callback_queue = CallbackQueue(process_payment_results)
+# Settles payments whose callback never came, through the same handler
+reconciler = Reconciler(process_payment_results)
+
+def _queue_gauges():
+    stats = callback_queue.get_stats()
+    samples = [("falutin_callback_jobs", {"status": status}, count)
+               for status, count in stats.items() if status != "dead_letters"]
+    samples.append(("falutin_callback_dead_letters", {}, stats.get("dead_letters", 0)))
+    samples.append(("falutin_status_subscribers", {}, status_hub.get_stats()["subscribers"]))
+    check_in = check_in_service.get_stats()
+    samples.append(("falutin_checkin_pending", {}, check_in["pending"]))
+    samples.append(("falutin_checkin_conflicts", {}, check_in["conflicts"]))
+    samples.append(("falutin_poll_votes_pending", {}, poll_service.get_stats()["pending"]))
+    return samples
+
+register_gauges(_queue_gauges)
+
+@app.on_event("startup")
+async def start_callback_workers():
+    if CALLBACK_MODE == "queue":
+        await callback_queue.start()
+        # Sends whatever a previous process left in the outbox
+        email_dispatcher.start()
+        # Serverless instances can't keep a timer; call POST /reconcile on a schedule there
+        reconciler.start()
+    seat_inventory.start()
+    check_in_service.start()
+    poll_service.start()
+
+@app.on_event("shutdown")
+async def stop_callback_workers():
+    await callback_queue.stop()
+    await reconciler.stop()
+    await seat_inventory.stop()
+    await check_in_service.stop()
+    await poll_service.stop()
+    await email_dispatcher.stop()
+
+@router.post("/callback")
+@router.post("/mpesa/callback")
 async def mpesa_callback(data: dict):
     """
     Robust Callback Handler:
-    Ensures payment is recorded even if email notification fails.
+    Persists the callback and acks immediately; the queue workers update the
+    reservation and send the ticket. Daraja re-deliveries are ignored.
+    In inline mode the callback is applied before the ack instead.
     """
     try:
-        print("----- PAYMENT CALLBACK RECEIVED -----")
+        logger.info("----- PAYMENT CALLBACK RECEIVED -----")
         
         # 1. Parses M-Pesa Data
         body = data.get("Body", {}).get("stkCallback", {})
         checkout_id = body.get("CheckoutRequestID")
-        result_code = body.get("ResultCode") 
-        
-        if result_code == 0:
-            # --- CRITICAL PATH: MARKS PAYMENT AS SUCCESS ---
-            print(f"PAYMENT CONFIRMED for {checkout_id}")
-            
-            # Extracts Receipt
-            meta = body.get("CallbackMetadata", {}).get("Item", [])
-            receipt = next((item.get("Value") for item in meta if item.get("Name") == "MpesaReceiptNumber"), None)
-            
-            # Updates DB IMMEDIATELY
-            supabase.table("reservations").update({
-                "status": "paid",
-                "mpesa_receipt": receipt
-            }).eq("checkout_request_id", checkout_id).execute()
-            
-            print("DEBUG: DB Status updated to PAID.")
-            
-            # --- NON-CRITICAL PATH: SENDS EMAIL --
-            try:
-                booking_response = supabase.table("reservations").select("*").eq("checkout_request_id", checkout_id).single().execute()
-                booking_data = booking_response.data
-                
-                if booking_data and booking_data.get("email"):
-                    raw_email = booking_data['email']
-                    safe_email = sanitize_email(raw_email) 
-                    
-                    print(f"DEBUG: Sending ticket to {safe_email}...")
-                    
-                    send_ticket_email(
-                        to_email=safe_email,
-                        movie_title="Falutin Screening", 
-                        date="Upcoming",
-                        ticket_id=checkout_id,
-                        poster_url=""
-                    )
-                    print("DEBUG: Email sent successfully.")
-                else:
-                    print("DEBUG: No email found for this booking.")
-                    
-            except Exception as email_error:
-                print(f"NOTIFICATION ERROR: Failed to send email, but payment is safe. Error: {email_error}")
 
-        else:
-            # Payment Failed (User cancelled or insufficient funds)
-            print(f"PAYMENT FAILED for {checkout_id}")
-            supabase.table("reservations").update({
-                "status": "failed"
-            }).eq("checkout_request_id", checkout_id).execute()
+        if not checkout_id:
+            logger.error("CALLBACK ERROR: Missing CheckoutRequestID")
+        elif CALLBACK_MODE == "inline":
+            await process_payment_results([body])
+        elif not await callback_queue.enqueue(checkout_id, body):
+            logger.info(f"Duplicate callback for {checkout_id} ignored.")
             
     except Exception as e:
-        print(f"FATAL CALLBACK ERROR: {str(e)}")
+        logger.critical(f"FATAL CALLBACK ERROR: {str(e)}")
         
     return {"result": "received"}
 
-@app.get("/check-status/{checkout_id}")
+async def lookup_status(checkout_id: str):
+    """Cached status if fresh, otherwise one DB read (which refreshes the cache)."""
+    status = status_hub.get_cached(checkout_id)
+    if status:
+        return status
+
+    status = await reservations.get_status(checkout_id) or "not_found"
+    if status != "not_found":
+        status_hub.remember(checkout_id, status)
+    return status
+
+@router.post("/reconcile", dependencies=[Depends(require_admin)])
+async def reconcile_pending():
+    """Runs one reconciliation pass now (the scheduled trigger on serverless)."""
+    return await reconciler.run_once()
+
+@router.get("/check-status/{checkout_id}")
 async def check_status(checkout_id: str):
     try:
-        response = supabase.table("reservations").select("status").eq("checkout_request_id", checkout_id).single().execute()
-        
-        if response.data:
-            return {"status": response.data["status"]}
-        else:
-            return {"status": "not_found"}
+        return {"status": await lookup_status(checkout_id)}
             
     except Exception as e:
-        print(f"POLLING ERROR: {e}")
-        return {"status": "pending"}
\ No newline at end of file
+        logger.error(f"POLLING ERROR: {e}")
+        return {"status": "pending"}
+
+# --- PUSH STATUS (SSE) ---
+STATUS_STREAM_TIMEOUT = 180   # STK prompts expire well before this
+STATUS_STREAM_RECHECK = 15    # Safety-net DB check (callback may land on another worker)
+
+@router.get("/status-stream/{checkout_id}")
+async def status_stream(checkout_id: str):
+    """
+    Holds one connection per checkout and pushes the status as soon as the
+    callback is processed. Ends after a terminal status or the timeout.
+    """
+    async def frames():
+        queue = status_hub.subscribe(checkout_id)
+        try:
+            try:
+                status = await lookup_status(checkout_id)
+            except Exception as e:
+                logger.error(f"POLLING ERROR: {e}")
+                status = "pending"
+            yield sse_event({"status": status})
+
+            deadline = time.monotonic() + STATUS_STREAM_TIMEOUT
+            while status not in TERMINAL_STATUSES and time.monotonic() < deadline:
+                try:
+                    status = await asyncio.wait_for(queue.get(), timeout=STATUS_STREAM_RECHECK)
+                except asyncio.TimeoutError:
+                    try:
+                        status = await lookup_status(checkout_id)
+                    except Exception as e:
+                        logger.error(f"POLLING ERROR: {e}")
+                    if status not in TERMINAL_STATUSES:
+                        yield ": keep-alive\n\n"
+                        continue
+                yield sse_event({"status": status})
+
+            yield sse_event({}, event="done")
+        finally:
+            status_hub.unsubscribe(checkout_id, queue)
+
+    return StreamingResponse(frames(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/email")
+async def email_endpoint(request: EmailRequest):
+    """Re-sends a ticket email (batched by the dispatcher)."""
+    await email_dispatcher.enqueue(request.email, request.movie, request.date, request.ticketId, request.poster)
+    return JSONResponse({"status": "queued"}, status_code=202)
+
+# --- TICKET QR CODES ---
+@router.get("/qr/{filename}")
+async def ticket_qr(filename: str, if_none_match: str = Header(None)):
+    """Serves a locally generated ticket QR (PNG/SVG) with long-lived cache headers."""
+    ticket_id, _, kind = filename.rpartition(".")
+    if kind not in CONTENT_TYPES or not is_valid_ticket_id(ticket_id):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    etag = f'"{qr_etag(ticket_id, kind)}"'
+    headers = dict(QR_CACHE_HEADERS, ETag=etag)
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+
+    image = await asyncio.to_thread(get_qr, ticket_id, kind)
+    return Response(content=image, media_type=CONTENT_TYPES[kind], headers=headers)
+
+@router.post("/qr/pregenerate/{screening_id}", dependencies=[Depends(require_admin)])
+async def pregenerate_screening_qr(screening_id: str):
+    """Renders QR codes for every confirmed ticket of a screening ahead of the door rush."""
+    ticket_ids = await reservations.paid_checkout_ids(screening_id)
+    count = await asyncio.to_thread(pregenerate, ticket_ids)
+    return {"status": "ok", "generated": count}
+
+# --- ADMIN STATS ---
+@router.get("/admin/stats", dependencies=[Depends(require_admin)])
+async def admin_stats_endpoint():
+    """Stats Bar figures: overall and per-screening revenue, tickets and occupancy."""
+    return await admin_stats.get()
+
+@router.get("/admin/stats/{screening_id}", dependencies=[Depends(require_admin)])
+async def admin_screening_stats(screening_id: str):
+    stats = await admin_stats.for_screening(screening_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No reservations for this screening")
+    return stats
+
+# --- GUEST LIST FEED ---
+@router.get("/admin/reservations", dependencies=[Depends(require_admin)])
+async def list_reservations(screening_id: str = None, status: str = None, cursor: str = None, limit: int = 50):
+    """
+    Newest-first keyset pages of the guest list. The first page also
+    returns a changes_cursor for /admin/reservations/changes.
+    """
+    try:
+        return await reservation_feed.page(screening_id, status, cursor, limit)
+    except reservation_feed.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/admin/reservations/changes", dependencies=[Depends(require_admin)])
+async def reservation_changes(cursor: str, screening_id: str = None, limit: int = 500):
+    """Rows created or updated since the cursor, so the live view refreshes by delta."""
+    try:
+        return await reservation_feed.changes(cursor, screening_id, limit)
+    except reservation_feed.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/admin/reservations/export", dependencies=[Depends(require_admin)])
+async def export_reservations(screening_id: str = None, status: str = None, format: str = "csv"):
+    """Streams every matching reservation as CSV or NDJSON, one page in memory at a time."""
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    name = f"reservations-{re.sub(r'[^A-Za-z0-9_-]', '_', screening_id or 'all')}.{format}"
+    if format == "csv":
+        body, media_type = reservation_feed.export_csv(screening_id, status), "text/csv"
+    else:
+        body, media_type = reservation_feed.export_ndjson(screening_id, status), "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+# --- DOOR CHECK-IN ---
+class ScanRequest(BaseModel):
+    code: str
+    device: str = "door"
+
+class CheckInSyncRequest(BaseModel):
+    events: list   # [{"code", "action": "check_in" | "undo", "at", "device"}, ...]
+
+@router.post("/checkin/{screening_id}/load", dependencies=[Depends(require_admin)])
+async def load_guest_list(screening_id: str):
+    """Preloads (or reloads) the screening's paid tickets before doors open."""
+    guest_list = await check_in_service.load(screening_id)
+    return guest_list.get_stats()
+
+@router.get("/checkin/{screening_id}", dependencies=[Depends(require_admin)])
+async def export_guest_list(screening_id: str):
+    """The whole guest list, for a door device to scan against while offline."""
+    guest_list = await check_in_service.guest_list(screening_id)
+    return {**guest_list.get_stats(), "guests": [g.to_dict() for g in guest_list.guests.values()]}
+
+@router.post("/checkin/{screening_id}/scan", dependencies=[Depends(require_admin)])
+async def scan_ticket(screening_id: str, request: ScanRequest):
+    return await check_in_service.scan(screening_id, request.code, request.device)
+
+@router.post("/checkin/{screening_id}/undo", dependencies=[Depends(require_admin)])
+async def undo_check_in(screening_id: str, request: ScanRequest):
+    return await check_in_service.undo(screening_id, request.code, request.device)
+
+@router.post("/checkin/{screening_id}/sync", dependencies=[Depends(require_admin)])
+async def sync_check_ins(screening_id: str, request: CheckInSyncRequest):
+    """Uploads an offline device's scans; returns the outcome the database kept for each."""
+    results = await check_in_service.sync(screening_id, request.events)
+    return {"results": results}
+
+@router.get("/checkin-conflicts", dependencies=[Depends(require_admin)])
+async def check_in_conflicts():
+    return {"conflicts": list(check_in_service.conflicts)}
+
+# --- COMMUNITY POLLS ---
+class VoteRequest(BaseModel):
+    option_id: str
+
+def poll_cache_headers(results: dict) -> dict:
+    # Final results never change; open ones are re-read every POLL_RESULTS_TTL anyway
+    max_age = 3600 if results["final"] else int(POLL_RESULTS_TTL)
+    etag = f'"{results["poll_id"]}-{results["version"]}"'
+    return {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+
+@router.get("/polls/active")
+async def active_poll(authorization: str = Header(None)):
+    """The poll members vote in now, with its results (and the caller's own vote when signed in)."""
+    poll = await poll_service.active()
+    if poll is None:
+        raise HTTPException(status_code=404, detail="No active poll")
+    results = await poll_service.results(poll.poll_id)
+    user_id = await member_id(authorization) if authorization else None
+    if user_id is None:
+        return results
+    return {**results, "my_vote": await poll_service.choice(poll, user_id)}
+
+@router.get("/polls/{poll_id}/results")
+async def poll_results(poll_id: str, if_none_match: str = Header(None)):
+    results = await poll_service.results(poll_id)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Poll not found")
+    headers = poll_cache_headers(results)
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(results, headers=headers)
+
+@router.post("/polls/{poll_id}/vote")
+async def cast_vote(poll_id: str, request: VoteRequest, user_id: str = Depends(require_member)):
+    """One vote per member; answered from the in-memory tally and written back in batches."""
+    outcome = await poll_service.vote(poll_id, user_id, request.option_id)
+    if outcome["result"] == "unknown_poll":
+        raise HTTPException(status_code=404, detail="Poll not found")
+    if outcome["result"] == "invalid_option":
+        raise HTTPException(status_code=400, detail="Not an option in this poll")
+    return outcome
+
+@router.get("/admin/polls/{poll_id}/recent", dependencies=[Depends(require_admin)])
+async def recent_poll_votes(poll_id: str, limit: int = 10):
+    """Latest stored votes, for the dashboard's live feed."""
+    return {"votes": await recent_votes(poll_id, max(1, min(limit, 100)))}
+
+app.include_router(router)
+app.include_router(router, prefix="/api")
@@ -1,7 +1,14 @@
 import os
-import requests
+import logging
+import time
+import asyncio
 import base64
 from datetime import datetime
+from clients import get_async_http
+from admission import upstream_gates, Overloaded
+from telemetry import span
+
+logger = logging.getLogger("FalutinAPI.mpesa")
 
 # CONFIGURATION
 CONSUMER_KEY = os.environ.get("MPESA_CONSUMER_KEY")
@@ -9,85 +16,211 @@ CONSUMER_SECRET = os.environ.get("MPESA_CONSUMER_SECRET")
 PASSKEY = os.environ.get("MPESA_PASSKEY")
 BUSINESS_SHORTCODE = "174379" # Safaricom Test Paybill
 
-# URLs
-AUTH_URL = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-STK_PUSH_URL = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
+# URLs (overridable so the bench harness can point at a local fake)
+DARAJA_BASE_URL = os.environ.get("DARAJA_BASE_URL", "https://sandbox.safaricom.co.ke")
+AUTH_URL = f"{DARAJA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
+STK_PUSH_URL = f"{DARAJA_BASE_URL}/mpesa/stkpush/v1/processrequest"
+STK_QUERY_URL = f"{DARAJA_BASE_URL}/mpesa/stkpushquery/v1/query"
+CALLBACK_URL = os.environ.get("MPESA_CALLBACK_URL", "https://falutin-rsvp.vercel.app/api/mpesa/callback")
 
-def get_mpesa_token():
-    """Generates a temporary access token from Safaricom"""
-    if not CONSUMER_KEY or not CONSUMER_SECRET:
-        print("CRITICAL: M-Pesa Keys missing in Vercel Environment Variables.")
-        return None
-        
-    try:
-        auth_string = f"{CONSUMER_KEY}:{CONSUMER_SECRET}"
-        encoded_auth = base64.b64encode(auth_string.encode()).decode()
-        
-        headers = {"Authorization": f"Basic {encoded_auth}"}
-        response = requests.get(AUTH_URL, headers=headers, timeout=8) 
-        
-        if not response.ok:
-            print(f"Safaricom Auth Failed: {response.text}")
+# TOKEN CACHE
+TOKEN_EXPIRY_MARGIN = 60   # Treats the token as expired this many seconds early
+TOKEN_REFRESH_AHEAD = 300  # Starts a background refresh this long before expiry
+# After a failed fetch, token requests fail at once for this long instead of each waiting out another
+TOKEN_FAILURE_TTL = float(os.environ.get("MPESA_TOKEN_FAILURE_TTL", "5"))
+
+def _auth_headers():
+    auth_string = f"{CONSUMER_KEY}:{CONSUMER_SECRET}"
+    encoded_auth = base64.b64encode(auth_string.encode()).decode()
+    return {"Authorization": f"Basic {encoded_auth}"}
+
+def normalize_phone(phone_number: str) -> str:
+    """Formats Phone Number (Must be 254...)"""
+    phone_number = str(phone_number).strip()
+    if phone_number.startswith("0"):
+        phone_number = "254" + phone_number[1:]
+    elif phone_number.startswith("+254"):
+        phone_number = phone_number[1:]
+    return phone_number
+
+def _password():
+    """(Password, Timestamp) pair Daraja expects on STK requests"""
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    password_str = f"{BUSINESS_SHORTCODE}{PASSKEY}{timestamp}"
+    return base64.b64encode(password_str.encode()).decode(), timestamp
+
+def _build_stk_request(token: str, phone_number: str, amount: int, reference: str):
+    """Builds the (payload, headers) pair for an STK push"""
+    password, timestamp = _password()
+
+    phone_number = normalize_phone(phone_number)
+
+    payload = {
+        "BusinessShortCode": BUSINESS_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerPayBillOnline",
+        "Amount": int(amount),
+        "PartyA": phone_number,
+        "PartyB": BUSINESS_SHORTCODE,
+        "PhoneNumber": phone_number,
+        "CallBackURL": CALLBACK_URL,
+        "AccountReference": reference,
+        "TransactionDesc": "Screening Reservation"
+    }
+
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+
+    return payload, headers
+
+class MpesaTokenManager:
+    """
+    Caches the Daraja OAuth token until shortly before it expires.
+    Concurrent refreshes collapse into one in-flight request (single-flight),
+    and a failed refresh is remembered for TOKEN_FAILURE_TTL so the callers
+    queued behind it fail fast rather than retrying one after another.
+    """
+
+    def __init__(self):
+        self.token = None
+        self.expires_at = 0.0
+        self.failed_until = 0.0
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "failures": 0, "failed_fast": 0}
+        self._async_lock = None
+        self._refresher = None
+
+    def _is_valid(self):
+        return self.token is not None and time.monotonic() < self.expires_at - TOKEN_EXPIRY_MARGIN
+
+    def _expires_soon(self):
+        return time.monotonic() > self.expires_at - TOKEN_REFRESH_AHEAD
+
+    def _store(self, data: dict):
+        self.token = data.get("access_token")
+        self.expires_at = time.monotonic() + int(data.get("expires_in", 3599))
+        self.failed_until = 0.0
+        self.stats["refreshes"] += 1
+
+    def _failed(self):
+        self.stats["failures"] += 1
+        self.failed_until = time.monotonic() + TOKEN_FAILURE_TTL
+
+    def _failing(self):
+        return time.monotonic() < self.failed_until
+
+    def _get_async_lock(self):
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        return self._async_lock
+
+    async def get_token_async(self):
+        if self._is_valid():
+            self.stats["hits"] += 1
+            if self._expires_soon() and (self._refresher is None or self._refresher.done()):
+                self._refresher = asyncio.create_task(self._refresh_async())
+            return self.token
+
+        self.stats["misses"] += 1
+        if self._failing():
+            self.stats["failed_fast"] += 1
             return None
-            
-        return response.json().get("access_token")
-    except Exception as e:
-        print(f"Error getting M-Pesa Token: {e}")
+        await self._refresh_async()
+        return self.token if self._is_valid() else None
+
+    async def _refresh_async(self):
+        async with self._get_async_lock():
+            if self._is_valid() and not self._expires_soon():
+                return
+            if self._failing():
+                # The caller ahead of us just failed; don't repeat its wait
+                self.stats["failed_fast"] += 1
+                return
+            try:
+                with span("daraja", "oauth"):
+                    response = await get_async_http().get(AUTH_URL, headers=_auth_headers(), timeout=8)
+
+                if not response.is_success:
+                    self._failed()
+                    logger.error(f"Safaricom Auth Failed: {response.text}")
+                    return
+
+                self._store(response.json())
+            except Exception as e:
+                self._failed()
+                logger.error(f"Error getting M-Pesa Token: {e}")
+
+
+# Shared token cache for every request
+token_manager = MpesaTokenManager()
+
+def get_token_stats():
+    """Hit/miss/refresh counters for the Daraja token cache"""
+    return dict(token_manager.stats)
+
+async def get_mpesa_token_async():
+    """Returns a cached access token from Safaricom, refreshing it when needed"""
+    if not CONSUMER_KEY or not CONSUMER_SECRET:
+        logger.critical("CRITICAL: M-Pesa Keys missing in Vercel Environment Variables.")
         return None
 
-def initiate_stk_push(phone_number: str, amount: int, reference: str = "FalutinTicket"):
+    return await token_manager.get_token_async()
+
+async def initiate_stk_push_async(phone_number: str, amount: int, reference: str = "FalutinTicket"):
     """Triggers the PIN prompt on the user's phone"""
+    import httpx  # deferred like the shared pool in clients.py
     try:
-        token = get_mpesa_token()
+        token = await get_mpesa_token_async()
         if not token:
             return {"error": "Authentication failed. Check M-Pesa API Keys in Vercel."}
-        
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        
+
         if not PASSKEY:
              return {"error": "M-Pesa Passkey missing in Vercel."}
-             
-        password_str = f"{BUSINESS_SHORTCODE}{PASSKEY}{timestamp}"
-        password = base64.b64encode(password_str.encode()).decode()
-        
-        # Formats Phone Number (Must be 254...)
-        phone_number = str(phone_number).strip()
-        if phone_number.startswith("0"):
-            phone_number = "254" + phone_number[1:]
-        elif phone_number.startswith("+254"):
-            phone_number = phone_number[1:]
-        
-        payload = {
-            "BusinessShortCode": BUSINESS_SHORTCODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": int(amount),
-            "PartyA": phone_number,     
-            "PartyB": BUSINESS_SHORTCODE, 
-            "PhoneNumber": phone_number,
-            "CallBackURL": "https://falutin-rsvp.vercel.app/api/mpesa/callback",
-            "AccountReference": reference,
-            "TransactionDesc": "Screening Reservation"
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        # Send the push with an 8-second timeout
-        response = requests.post(STK_PUSH_URL, json=payload, headers=headers, timeout=8)
-        
-        # If Safaricom rejects it, grab their exact text
-        if not response.ok:
+
+        payload, headers = _build_stk_request(token, phone_number, amount, reference)
+
+        async with upstream_gates["daraja"]:
+            with span("daraja", "stk_push"):
+                response = await get_async_http().post(STK_PUSH_URL, json=payload, headers=headers, timeout=8)
+
+        if not response.is_success:
             error_msg = response.text
-            print(f"Safaricom STK Error: {error_msg}")
+            logger.error(f"Safaricom STK Error: {error_msg}")
             return {"error": f"Safaricom rejected the request: {error_msg}"}
-            
+
         return response.json()
-        
-    except requests.exceptions.Timeout:
+
+    except Overloaded:
+        raise
+    except httpx.TimeoutException:
         return {"error": "Safaricom Sandbox took too long to respond. Please try again."}
     except Exception as e:
-        return {"error": f"Server Error: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Server Error: {str(e)}"}
+
+async def query_stk_status_async(checkout_id: str):
+    """
+    STK Push Query: asks Daraja how an STK push ended.
+    Returns the response JSON. A settled prompt carries ResultCode (as a
+    string, "0" = paid); one still being processed carries an errorCode
+    instead. Raises on transport or auth failures.
+    """
+    token = await get_mpesa_token_async()
+    if not token or not PASSKEY:
+        raise RuntimeError("M-Pesa credentials missing")
+
+    password, timestamp = _password()
+    payload = {
+        "BusinessShortCode": BUSINESS_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_id,
+    }
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    async with upstream_gates["daraja"]:
+        with span("daraja", "stk_query"):
+            response = await get_async_http().post(STK_QUERY_URL, json=payload, headers=headers, timeout=8)
+    # Daraja answers "still processing" with a 500 and an errorCode body
+    return response.json()
@@ -0,0 +1,241 @@
+import os
+import logging
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from clients import get_async_http
+from email_service import build_ticket_email, RESEND_API_URL
+from callback_queue import CALLBACK_QUEUE_PATH
+from ratelimit import TokenBucket
+from admission import upstream_gates
+from telemetry import span, register_gauges
+
+logger = logging.getLogger("FalutinAPI.notifications")
+
+# CONFIGURATION
+RESEND_BATCH_URL = f"{RESEND_API_URL}/emails/batch"
+RESEND_EMAILS_URL = f"{RESEND_API_URL}/emails"
+RESEND_BATCH_SIZE = 100                                              # Resend's per-batch maximum
+RESEND_RATE_PER_SEC = float(os.environ.get("RESEND_RATE_PER_SEC", "2"))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", "4"))
+EMAIL_RETRY_DELAY = float(os.environ.get("EMAIL_RETRY_DELAY", "2"))
+# How long the dispatcher waits for more tickets before sending a partial batch
+EMAIL_BATCH_WINDOW = float(os.environ.get("EMAIL_BATCH_WINDOW", "0.5"))
+# A claimed email whose process died is sent again after this long
+EMAIL_LEASE = float(os.environ.get("EMAIL_LEASE", "60"))
+
+# Lives next to the callback queue, so a ticket outlives the callback job that queued it
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS email_outbox_ready ON email_outbox (next_attempt_at);
+"""
+
+
+class EmailDispatcher:
+    """
+    Background sender for ticket emails.
+    Request handlers only write the email to a SQLite outbox; one task
+    drains it into Resend batch calls (up to 100 emails each) paced by a
+    token bucket, and deletes each row once Resend has accepted it.
+    A message whose batch failed is retried on its own with backoff, so
+    one bad address can't keep failing everyone else's tickets.
+    Claims take a lease, like the callback queue, so emails queued by a
+    process that died are picked up again once it lapses.
+    """
+
+    def __init__(self, path: str = CALLBACK_QUEUE_PATH):
+        self.path = path
+        self.bucket = TokenBucket(RESEND_RATE_PER_SEC)
+        self.stats = {"queued": 0, "sent": 0, "batches": 0, "retries": 0, "dropped": 0}
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+    # --- STORAGE ---
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._db_lock:
+            return self._conn().execute(sql, params).fetchall()
+
+    def _insert(self, payload: dict):
+        self._execute(
+            "INSERT INTO email_outbox (payload, next_attempt_at) VALUES (?, ?)",
+            (json.dumps(payload), time.time()),
+        )
+
+    def _claim(self):
+        """Atomically leases up to a batch of the oldest ready emails."""
+        now = time.time()
+        with self._db_lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT id, payload, attempts FROM email_outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+                    (now, RESEND_BATCH_SIZE),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE email_outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + EMAIL_LEASE, row[0]) for row in rows],
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [{"id": row[0], "payload": json.loads(row[1]), "attempts": row[2]} for row in rows]
+
+    def _delete(self, messages: list):
+        with self._db_lock:
+            self._conn().executemany("DELETE FROM email_outbox WHERE id = ?", [(m["id"],) for m in messages])
+
+    def _backoff(self, message: dict, error: str):
+        attempts = message["attempts"] + 1
+        delay = EMAIL_RETRY_DELAY * (2 ** (attempts - 1))
+        self._execute(
+            "UPDATE email_outbox SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+            (attempts, error, time.time() + delay, message["id"]),
+        )
+
+    # --- PUBLIC API ---
+
+    async def enqueue(self, to_email: str, movie_title: str, date: str, ticket_id: str, poster_url: str = ""):
+        """Persists one ticket email; returns once it's on disk, never waits on Resend."""
+        payload = build_ticket_email(to_email, movie_title, date, ticket_id, poster_url)
+        await asyncio.to_thread(self._insert, payload)
+        self.stats["queued"] += 1
+        self._wakeup.set()
+        self.start()
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+
+    # --- WORKER ---
+
+    async def _run(self):
+        while True:
+            messages = await asyncio.to_thread(self._claim)
+            if not messages:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+                # Gathers whatever else arrives within the window (e.g. a callback burst)
+                await asyncio.sleep(EMAIL_BATCH_WINDOW)
+                continue
+
+            for message in messages:
+                if message["attempts"]:
+                    await self._send_single(message)
+            fresh = [m for m in messages if not m["attempts"]]
+            if fresh:
+                await self._send_batch(fresh)
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {os.getenv('RESEND_API_KEY')}"}
+
+    async def _pace(self):
+        """Waits for a send token without blocking the event loop."""
+        while True:
+            wait = self.bucket.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def _send_batch(self, batch: list):
+        if not os.getenv("RESEND_API_KEY"):
+            logger.error("EMAIL ERROR: RESEND_API_KEY is missing.")
+            self.stats["dropped"] += len(batch)
+            await asyncio.to_thread(self._delete, batch)
+            return
+
+        await self._pace()
+        try:
+            async with upstream_gates["resend"]:
+                with span("resend", "batch"):
+                    response = await get_async_http().post(
+                        RESEND_BATCH_URL, json=[m["payload"] for m in batch], headers=self._headers()
+                    )
+            response.raise_for_status()
+        except Exception as e:
+            logger.error(f"EMAIL ERROR: Batch of {len(batch)} failed, retrying individually: {e}")
+            for message in batch:
+                await self._retry(message, str(e))
+            return
+
+        await asyncio.to_thread(self._delete, batch)
+        self.stats["batches"] += 1
+        self.stats["sent"] += len(batch)
+        logger.info(f"Sent {len(batch)} ticket emails in one batch.")
+
+    async def _send_single(self, message: dict):
+        await self._pace()
+        try:
+            async with upstream_gates["resend"]:
+                with span("resend", "send"):
+                    response = await get_async_http().post(
+                        RESEND_EMAILS_URL, json=message["payload"], headers=self._headers()
+                    )
+            response.raise_for_status()
+        except Exception as e:
+            logger.error(f"EMAIL ERROR: {message['payload']['to']}: {e}")
+            await self._retry(message, str(e))
+            return
+
+        await asyncio.to_thread(self._delete, [message])
+        self.stats["sent"] += 1
+
+    async def _retry(self, message: dict, error: str):
+        if message["attempts"] + 1 >= EMAIL_MAX_ATTEMPTS:
+            self.stats["dropped"] += 1
+            logger.error(f"EMAIL ERROR: Giving up on ticket email to {message['payload']['to']}")
+            await asyncio.to_thread(self._delete, [message])
+            return
+
+        self.stats["retries"] += 1
+        await asyncio.to_thread(self._backoff, message, error)
+
+    def _counts(self):
+        """Outbox rows as (not tried yet, retrying after a failure)."""
+        return tuple(self._execute(
+            "SELECT COUNT(*) FILTER (WHERE attempts = 0), COUNT(*) FILTER (WHERE attempts > 0) FROM email_outbox"
+        )[0])
+
+    def get_stats(self):
+        pending, awaiting_retry = self._counts()
+        return dict(self.stats, pending=pending, awaiting_retry=awaiting_retry)
+
+
+email_dispatcher = EmailDispatcher()
+
+
+def _email_gauges():
+    pending, awaiting_retry = email_dispatcher._counts()
+    return [
+        ("falutin_email_pending", {}, pending),
+        ("falutin_email_awaiting_retry", {}, awaiting_retry),
+    ]
+
+register_gauges(_email_gauges)
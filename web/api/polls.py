@@ -0,0 +1,453 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from clients import get_session
+from database import get_async_db
+from catalog import SANITY_QUERY_URL
+from telemetry import span, poll_votes
+
+logger = logging.getLogger("FalutinAPI.polls")
+
+# CONFIGURATION
+POLLS_QUERY = '*[_type == "poll"]{_id, question, isActive, expiresAt, "options": options[]->{_id, title}}'
+# How long poll documents are used without asking Sanity (seconds)
+POLL_DEFS_TTL = int(os.environ.get("POLL_DEFS_TTL", "60"))
+# How often queued votes are written back, and how many per round trip
+POLL_FLUSH_INTERVAL = float(os.environ.get("POLL_FLUSH_INTERVAL", "1"))
+POLL_BATCH = int(os.environ.get("POLL_BATCH", "500"))
+# How long a worker serves the shared totals before re-reading them (seconds)
+POLL_RESULTS_TTL = float(os.environ.get("POLL_RESULTS_TTL", "2"))
+# Rows per keyset page when loading who has already voted
+POLL_PAGE_SIZE = int(os.environ.get("POLL_PAGE_SIZE", "1000"))
+# Serverless instances are frozen between requests: votes are written before the answer there
+POLL_WRITE_THROUGH = os.environ.get("POLL_WRITE_THROUGH", "1" if os.environ.get("VERCEL") else "0") == "1"
+
+VOTES_TABLE = "poll_votes"
+TALLIES_TABLE = "poll_tallies"
+NEVER = datetime.max.replace(tzinfo=timezone.utc)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _expiry(definition: dict) -> datetime:
+    """expiresAt as an aware datetime; a poll without one (or with a malformed one) never expires."""
+    value = definition.get("expiresAt")
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else NEVER
+    except ValueError:
+        return NEVER
+
+
+# --- STORAGE ---
+
+async def _voters_page(poll_id: str, after_user: str, limit: int) -> list:
+    with span("supabase", "poll_voters"):
+        response = await get_async_db().table(VOTES_TABLE).select("user_id,option_id").eq(
+            "poll_id", poll_id).gt("user_id", after_user).order("user_id").limit(limit).execute()
+    return response.data or []
+
+
+async def _stored_choice(poll_id: str, user_id: str):
+    with span("supabase", "poll_choice"):
+        response = await get_async_db().table(VOTES_TABLE).select("option_id").eq(
+            "poll_id", poll_id).eq("user_id", user_id).limit(1).execute()
+    return response.data[0]["option_id"] if response.data else None
+
+
+async def _read_tallies(poll_ids: set) -> dict:
+    """poll_id -> Counter(option_id -> votes), one round trip for every poll asked about."""
+    with span("supabase", "poll_tallies"):
+        response = await get_async_db().table(TALLIES_TABLE).select("poll_id,option_id,votes").in_(
+            "poll_id", list(poll_ids)).execute()
+    totals = {poll_id: Counter() for poll_id in poll_ids}
+    for row in response.data or []:
+        totals[row["poll_id"]][row["option_id"]] = row["votes"]
+    return totals
+
+
+async def _record_votes(votes: list) -> list:
+    """Writes a batch through record_poll_votes() (schema.sql); returns one outcome per vote."""
+    with span("supabase", "record_poll_votes"):
+        response = await get_async_db().rpc("record_poll_votes", {"votes": votes}).execute()
+    return response.data or []
+
+
+async def recent_votes(poll_id: str, limit: int = 10) -> list:
+    with span("supabase", "poll_recent"):
+        response = await get_async_db().table(VOTES_TABLE).select("user_id,option_id,created_at").eq(
+            "poll_id", poll_id).order("created_at", desc=True).limit(limit).execute()
+    return response.data or []
+
+
+# --- ONE POLL ---
+
+class Poll:
+    """
+    One poll's definition and this worker's tally of it.
+    stored is what poll_tallies held when last read (plus votes this worker
+    has written since); queued is votes taken here and not yet written.
+    Results are stored + queued, rebuilt only after a count changes.
+    """
+
+    def __init__(self, definition: dict):
+        self.poll_id = definition["_id"]
+        self.voters = {}            # user_id -> option_id, everyone known to have voted
+        self.stored = Counter()
+        self.queued = Counter()
+        self.stored_at = 0.0
+        self.final = False          # closed and recounted: results never change again
+        self.closer = None
+        self.version = 0
+        self._results = None
+        self.update(definition)
+
+    def update(self, definition: dict):
+        self.question = definition.get("question")
+        self.options = {o["_id"]: o.get("title") for o in definition.get("options") or [] if o and o.get("_id")}
+        self.active = bool(definition.get("isActive"))
+        self.expires_at = _expiry(definition)
+        self.changed()
+
+    def is_open(self) -> bool:
+        return self.active and not self.final and datetime.now(timezone.utc) < self.expires_at
+
+    def changed(self):
+        self.version += 1
+        self._results = None
+
+    def results(self) -> dict:
+        if self._results is None:
+            counts = {option: self.stored[option] + self.queued[option] for option in self.options}
+            total = sum(counts.values())
+            self._results = {
+                "poll_id": self.poll_id,
+                "question": self.question,
+                "expires_at": None if self.expires_at is NEVER else self.expires_at.isoformat(),
+                "open": self.is_open(),
+                "final": self.final,
+                "total": total,
+                "options": [
+                    {"id": option, "title": title, "votes": counts[option],
+                     "percentage": round(100 * counts[option] / total) if total else 0}
+                    for option, title in self.options.items()
+                ],
+                "version": self.version,
+            }
+        return self._results
+
+
+class PollService:
+    """
+    Community poll voting against in-memory tallies.
+    A vote is checked against the poll's voter index (one vote per member),
+    counted, and queued; a background task writes the queue back in batches
+    through record_poll_votes(), which inserts them and bumps poll_tallies
+    in one round trip, then re-reads the totals so every worker converges.
+    The database settles races between workers: a member's first stored
+    vote wins and a later one is taken back out of the local tally.
+    Each poll closes itself at expiresAt with a final flush and recount.
+    """
+
+    def __init__(self):
+        self._definitions = None
+        self._definitions_at = 0.0
+        self._definitions_task = None
+        self._polls = {}
+        self._loading = {}
+        self._pending = []
+        self._write_lock = None
+        self._background = set()
+        self._flusher = None
+        self.stats = {"recorded": 0, "duplicate": 0, "overruled": 0, "written": 0, "flushes": 0}
+
+    # --- DEFINITIONS ---
+
+    def _fetch_definitions(self) -> list:
+        with span("sanity", "polls"):
+            response = get_session(SANITY_QUERY_URL).get(SANITY_QUERY_URL, params={"query": POLLS_QUERY}, timeout=8)
+        response.raise_for_status()
+        return response.json().get("result", [])
+
+    async def _refresh_definitions(self) -> dict:
+        try:
+            documents = await asyncio.to_thread(self._fetch_definitions)
+        except Exception as e:
+            # Keeps the polls we had until the next TTL; only a cold start fails
+            logger.error(f"SANITY ERROR: {str(e)}")
+            if self._definitions is None:
+                raise
+            self._definitions_at = time.monotonic()
+            return self._definitions
+
+        self._definitions = {d["_id"]: d for d in documents if d.get("_id")}
+        self._definitions_at = time.monotonic()
+        for poll_id, poll in self._polls.items():
+            if poll_id in self._definitions:
+                poll.update(self._definitions[poll_id])
+                self._schedule_close(poll)
+        return self._definitions
+
+    async def definitions(self) -> dict:
+        """Poll documents by id, refreshed after POLL_DEFS_TTL (one Sanity request however many wait)."""
+        if self._definitions is not None and time.monotonic() - self._definitions_at < POLL_DEFS_TTL:
+            return self._definitions
+        if self._definitions_task is None:
+            self._definitions_task = asyncio.ensure_future(self._refresh_definitions())
+            self._definitions_task.add_done_callback(lambda _: setattr(self, "_definitions_task", None))
+        return await asyncio.shield(self._definitions_task)
+
+    def invalidate(self):
+        """Sanity webhook: poll documents changed; the next request re-reads them."""
+        self._definitions_at = 0.0
+
+    # --- INDEX ---
+
+    async def _load(self, definition: dict) -> Poll:
+        """Builds a poll's voter index with a keyset scan, and reads its totals."""
+        poll = Poll(definition)
+        after_user = ""
+        while True:
+            rows = await _voters_page(poll.poll_id, after_user, POLL_PAGE_SIZE)
+            for row in rows:
+                poll.voters[row["user_id"]] = row["option_id"]
+            if len(rows) < POLL_PAGE_SIZE:
+                break
+            after_user = rows[-1]["user_id"]
+
+        poll.stored = (await _read_tallies({poll.poll_id}))[poll.poll_id]
+        poll.stored_at = time.monotonic()
+        self._polls[poll.poll_id] = poll
+        self._schedule_close(poll)
+        logger.info(f"Loaded poll {poll.poll_id} ({len(poll.voters)} votes so far)")
+        return poll
+
+    async def poll(self, poll_id: str):
+        """The poll's state, loading it on first use (one load however many votes wait). None if unknown."""
+        definitions = await self.definitions()
+        poll = self._polls.get(poll_id)
+        if poll:
+            return poll
+        definition = definitions.get(poll_id)
+        if definition is None:
+            return None
+        task = self._loading.get(poll_id)
+        if task is None:
+            task = self._loading[poll_id] = asyncio.ensure_future(self._load(definition))
+            task.add_done_callback(lambda _: self._loading.pop(poll_id, None))
+        return await asyncio.shield(task)
+
+    async def active(self):
+        """
+        The poll members see: an isActive poll still open (the soonest to
+        close if several), else the active one that closed last, for its results.
+        """
+        candidates = [d for d in (await self.definitions()).values() if d.get("isActive")]
+        if not candidates:
+            return None
+        now = datetime.now(timezone.utc)
+        still_open = [d for d in candidates if now < _expiry(d)]
+        chosen = min(still_open, key=_expiry) if still_open else max(candidates, key=_expiry)
+        return await self.poll(chosen["_id"])
+
+    # --- VOTES ---
+
+    async def vote(self, poll_id: str, user_id: str, option_id: str) -> dict:
+        """Counts a member's vote. Answered from the tally; the write-back is queued."""
+        poll = await self.poll(poll_id)
+        if poll is None:
+            return {"result": "unknown_poll"}
+        if not poll.is_open():
+            return {"result": "closed", "results": poll.results()}
+        if option_id not in poll.options:
+            return {"result": "invalid_option"}
+
+        choice = poll.voters.get(user_id)
+        if choice is not None:
+            self.stats["duplicate"] += 1
+            poll_votes.inc(outcome="duplicate")
+            return {"result": "already_voted", "choice": choice, "results": poll.results()}
+
+        poll.voters[user_id] = option_id
+        poll.queued[option_id] += 1
+        poll.changed()
+        self._pending.append({"poll_id": poll_id, "user_id": user_id, "option_id": option_id, "voted_at": _now()})
+        self.stats["recorded"] += 1
+        poll_votes.inc(outcome="recorded")
+
+        if POLL_WRITE_THROUGH:
+            await self.flush()
+        return {"result": "recorded", "choice": option_id, "results": poll.results()}
+
+    async def choice(self, poll: Poll, user_id: str):
+        """The member's vote in this poll (None if they haven't voted). Misses ask the database once."""
+        if user_id in poll.voters:
+            return poll.voters[user_id]
+        # May have voted through another worker since this one loaded the poll
+        stored = await _stored_choice(poll.poll_id, user_id)
+        if stored is not None:
+            poll.voters.setdefault(user_id, stored)
+        return stored
+
+    async def results(self, poll_id: str):
+        """Cached results; stale totals are revalidated in the background, never on the request."""
+        poll = await self.poll(poll_id)
+        if poll is None:
+            return None
+        if not poll.final and time.monotonic() - poll.stored_at > POLL_RESULTS_TTL:
+            poll.stored_at = time.monotonic()
+            self._run_in_background(self._revalidate({poll_id}))
+        return poll.results()
+
+    # --- WRITE-BACK ---
+
+    def _lock(self) -> asyncio.Lock:
+        # Writes and total reads take turns, so a re-read never double-counts a vote in flight
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    def _settle(self, chunk: list, outcomes: list):
+        """Moves written votes from queued to stored; a vote the database turned down comes back out."""
+        by_voter = {(o["poll_id"], o["user_id"]): o for o in outcomes}
+        for vote in chunk:
+            poll = self._polls.get(vote["poll_id"])
+            if poll is None:
+                continue
+            outcome = by_voter.get((vote["poll_id"], vote["user_id"])) or {}
+            poll.queued[vote["option_id"]] -= 1
+            if outcome.get("accepted"):
+                poll.stored[vote["option_id"]] += 1
+            else:
+                # Already voted through another worker: that first vote stands
+                if outcome.get("option_id"):
+                    poll.voters[vote["user_id"]] = outcome["option_id"]
+                self.stats["overruled"] += 1
+                poll_votes.inc(outcome="overruled")
+                logger.warning(f"POLL VOTE OVERRULED for {vote['user_id']} in {vote['poll_id']}")
+            poll.changed()
+
+    async def _refresh_totals(self, poll_ids: set):
+        totals = await _read_tallies(poll_ids)
+        for poll_id, counts in totals.items():
+            poll = self._polls.get(poll_id)
+            if poll:
+                poll.stored = counts
+                poll.stored_at = time.monotonic()
+                poll.changed()
+
+    async def flush(self) -> int:
+        """Writes queued votes back in batches, then re-reads the touched totals. Returns how many were written."""
+        async with self._lock():
+            written = 0
+            touched = set()
+            while self._pending:
+                chunk, self._pending = self._pending[:POLL_BATCH], self._pending[POLL_BATCH:]
+                try:
+                    outcomes = await _record_votes(chunk)
+                except Exception:
+                    # Kept in order at the front; the next flush retries them
+                    self._pending[:0] = chunk
+                    raise
+                self._settle(chunk, outcomes)
+                touched.update(vote["poll_id"] for vote in chunk)
+                written += len(chunk)
+
+            if written:
+                self.stats["written"] += written
+                self.stats["flushes"] += 1
+                try:
+                    await self._refresh_totals(touched)
+                except Exception as e:
+                    logger.error(f"POLL RESULTS ERROR: {e}")
+            return written
+
+    async def _revalidate(self, poll_ids: set):
+        try:
+            async with self._lock():
+                await self._refresh_totals(poll_ids)
+        except Exception as e:
+            logger.error(f"POLL RESULTS ERROR: {e}")
+
+    def _run_in_background(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # --- CLOSE ---
+
+    def _schedule_close(self, poll: Poll):
+        if poll.closer:
+            poll.closer.cancel()
+            poll.closer = None
+        if poll.final or poll.expires_at is NEVER:
+            return
+        delay = max(0.0, (poll.expires_at - datetime.now(timezone.utc)).total_seconds())
+        # Fires once, at expiresAt; no polling in between
+        poll.closer = asyncio.get_running_loop().call_later(
+            delay, lambda: self._run_in_background(self.close(poll.poll_id)))
+
+    async def close(self, poll_id: str):
+        """Final flush and recount at expiresAt; the results are frozen after this."""
+        poll = self._polls.get(poll_id)
+        if poll is None or poll.final:
+            return
+        try:
+            await self.flush()
+            async with self._lock():
+                await self._refresh_totals({poll_id})
+        except Exception as e:
+            logger.error(f"POLL CLOSE ERROR for {poll_id}: {e}")
+            # Expired, so no new votes; the recount is retried shortly
+            poll.closer = asyncio.get_running_loop().call_later(
+                POLL_FLUSH_INTERVAL, lambda: self._run_in_background(self.close(poll_id)))
+            return
+        poll.final = True
+        poll.closer = None
+        poll.changed()
+        results = poll.results()
+        leader = max(results["options"], key=lambda o: o["votes"], default=None)
+        logger.info(f"Poll {poll_id} closed: {results['total']} votes"
+                    + (f", leader {leader['title']} ({leader['votes']})" if leader else ""))
+
+    # --- SCHEDULE ---
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(POLL_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"POLL SYNC ERROR: {e}")
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        for poll in self._polls.values():
+            if poll.closer:
+                poll.closer.cancel()
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"POLL SYNC ERROR: {len(self._pending)} votes not written back: {e}")
+
+    # --- STATS ---
+
+    def get_stats(self) -> dict:
+        return dict(
+            self.stats,
+            polls=len(self._polls),
+            voters=sum(len(p.voters) for p in self._polls.values()),
+            pending=len(self._pending),
+        )
+
+
+poll_service = PollService()
@@ -0,0 +1,145 @@
+import os
+import threading
+
+# CONFIGURATION
+CHAT_HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.environ.get("CHAT_SUMMARY_TOKEN_BUDGET", "200"))
+
+# Rough tokens-per-character ratio for llama-style tokenizers on English text
+CHARS_PER_TOKEN = 4
+# Per-message overhead (role markers, separators)
+MESSAGE_OVERHEAD = 4
+# Replaces the middle of a turn too long to fit the budget on its own
+CLIP_MARKER = " […] "
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; close enough for budgeting without a tokenizer."""
+    return len(text) // CHARS_PER_TOKEN + 1 if text else 0
+
+
+def _message_tokens(message: dict) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+def _clip(message: dict, budget: int) -> dict:
+    """
+    Cuts one oversized turn down to `budget` tokens, keeping its start and
+    end (a pasted block usually ends with the actual question).
+    """
+    keep_chars = max(budget - MESSAGE_OVERHEAD - estimate_tokens(CLIP_MARKER), 1) * CHARS_PER_TOKEN
+    content = str(message["content"])
+    head = content[:keep_chars // 2]
+    tail = content[len(content) - (keep_chars - len(head)):]
+    return dict(message, content=head + CLIP_MARKER + tail)
+
+
+def _summarize(turns: list) -> str:
+    """Extractive summary of dropped turns: the guest's earlier questions, clipped."""
+    budget_chars = CHAT_SUMMARY_TOKEN_BUDGET * CHARS_PER_TOKEN
+    questions = []
+    used = 0
+    # Most recent dropped questions first, they are the most relevant
+    for msg in reversed(turns):
+        if msg["role"] != "user":
+            continue
+        snippet = " ".join(str(msg["content"]).split())[:160]
+        if used + len(snippet) > budget_chars:
+            break
+        questions.append(snippet)
+        used += len(snippet)
+
+    if not questions:
+        return ""
+    return "Earlier in this conversation the user asked: " + " / ".join(reversed(questions))
+
+
+class PromptStats:
+    """Running prompt-token metrics across chat requests."""
+
+    def __init__(self):
+        self.requests = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.trimmed_requests = 0
+        self.dropped_turns = 0
+        self.clipped_turns = 0
+        self.last = {}
+        self._lock = threading.Lock()
+
+    def record(self, metrics: dict):
+        with self._lock:
+            self.requests += 1
+            self.total_tokens += metrics["prompt_tokens"]
+            self.max_tokens = max(self.max_tokens, metrics["prompt_tokens"])
+            self.dropped_turns += metrics["dropped_turns"]
+            self.clipped_turns += metrics["clipped_turns"]
+            if metrics["dropped_turns"] or metrics["clipped_turns"]:
+                self.trimmed_requests += 1
+            self.last = metrics
+
+    def get_stats(self):
+        return {
+            "requests": self.requests,
+            "avg_prompt_tokens": round(self.total_tokens / self.requests) if self.requests else 0,
+            "max_prompt_tokens": self.max_tokens,
+            "trimmed_requests": self.trimmed_requests,
+            "dropped_turns": self.dropped_turns,
+            "clipped_turns": self.clipped_turns,
+            "last": self.last,
+        }
+
+
+prompt_stats = PromptStats()
+
+
+def assemble_prompt(system_prompt: str, history: list, budget: int = CHAT_HISTORY_TOKEN_BUDGET):
+    """
+    Builds [system, (summary), *recent turns] with the history kept under `budget` tokens.
+    `history` is a list of {"role", "content"} dicts (already cleaned of empty messages).
+    Returns the messages and this request's prompt-token metrics.
+    """
+    # Clients sometimes echo the system prompt or double-send a message
+    turns = []
+    for msg in history:
+        if msg["role"] == "system":
+            continue
+        if turns and turns[-1] == msg:
+            continue
+        turns.append(msg)
+
+    # Sliding window: newest turns first until the budget runs out
+    kept = []
+    used = 0
+    clipped = 0
+    for msg in reversed(turns):
+        cost = _message_tokens(msg)
+        if not kept and cost > budget:
+            # The newest turn is always sent, but never past the budget on its own
+            msg = _clip(msg, budget)
+            cost = _message_tokens(msg)
+            clipped = 1
+        elif used + cost > budget:
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+
+    dropped = turns[:len(turns) - len(kept)]
+    messages = [{"role": "system", "content": system_prompt}]
+    summary = _summarize(dropped) if dropped else ""
+    if summary:
+        messages.append({"role": "system", "content": summary})
+    messages.extend(kept)
+
+    metrics = {
+        "system_tokens": estimate_tokens(system_prompt) + MESSAGE_OVERHEAD,
+        "history_tokens": used,
+        "summary_tokens": estimate_tokens(summary),
+        "dropped_turns": len(dropped),
+        "clipped_turns": clipped,
+    }
+    metrics["prompt_tokens"] = metrics["system_tokens"] + metrics["history_tokens"] + metrics["summary_tokens"]
+    prompt_stats.record(metrics)
+
+    return messages, metrics
@@ -0,0 +1,81 @@
+import io
+import logging
+import os
+import re
+import hashlib
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger("FalutinAPI.qr_codes")
+
+# CONFIGURATION
+QR_CACHE_DIR = os.environ.get("QR_CACHE_DIR", "/tmp/falutin_qr")
+PUBLIC_API_URL = os.environ.get("PUBLIC_API_URL", "https://falutin-rsvp.vercel.app/api")
+QR_SCALE = 5    # ~150px for a checkout ID, same size as the old hotlink
+QR_BORDER = 2
+
+# Checkout IDs / receipts only; anything else is rejected before it hits the cache
+TICKET_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+# Tickets never change, so browsers and CDNs may keep the image forever
+QR_CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+
+def is_valid_ticket_id(ticket_id: str) -> bool:
+    return bool(ticket_id) and bool(TICKET_ID_PATTERN.match(ticket_id))
+
+
+def qr_url(ticket_id: str, kind: str = "png") -> str:
+    """Public, cacheable URL of a ticket's QR code (used in emails)."""
+    return f"{PUBLIC_API_URL}/qr/{ticket_id}.{kind}"
+
+
+def qr_etag(ticket_id: str, kind: str) -> str:
+    return hashlib.sha256(f"{kind}:{ticket_id}".encode()).hexdigest()[:32]
+
+
+def _render(ticket_id: str, kind: str) -> bytes:
+    import segno  # deferred until a QR is actually drawn (most hits are disk/memory cache)
+    buffer = io.BytesIO()
+    segno.make(ticket_id, error="m").save(buffer, kind=kind, scale=QR_SCALE, border=QR_BORDER)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=2048)
+def get_qr(ticket_id: str, kind: str = "png") -> bytes:
+    """
+    QR image bytes for a ticket. Content-addressed on disk by ticket ID
+    so a cold instance reuses images rendered earlier; hot ones come from memory.
+    """
+    if not is_valid_ticket_id(ticket_id) or kind not in CONTENT_TYPES:
+        raise ValueError("Invalid ticket ID or QR format")
+
+    path = os.path.join(QR_CACHE_DIR, f"{qr_etag(ticket_id, kind)}.{kind}")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    image = _render(ticket_id, kind)
+    try:
+        os.makedirs(QR_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"QR CACHE ERROR: {e}")
+    return image
+
+
+def pregenerate(ticket_ids: list) -> int:
+    """Renders (and caches) PNG codes for many tickets. Returns how many were valid."""
+    count = 0
+    for ticket_id in ticket_ids:
+        if is_valid_ticket_id(ticket_id):
+            get_qr(ticket_id, "png")
+            count += 1
+    return count
@@ -0,0 +1,38 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, bursts up to `capacity`.
+    Thread-safe; used to keep outbound calls under upstream rate limits.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Takes tokens if available. Returns 0, or the seconds to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        """Blocks until the tokens are available."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
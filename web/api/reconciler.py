@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+import reservations
+from callback_queue import CALLBACK_QUEUE_PATH
+from mpesa import query_stk_status_async
+from ratelimit import TokenBucket
+from telemetry import reconciled, reconcile_runs
+
+try:
+    import fcntl
+except ImportError:  # Windows dev box: a single worker, so it always leads
+    fcntl = None
+
+logger = logging.getLogger("FalutinAPI.reconciler")
+
+# CONFIGURATION
+RECONCILE_INTERVAL = int(os.environ.get("RECONCILE_INTERVAL", "120"))
+# Only rows pending at least this long are queried (the STK prompt itself times out after ~60s)
+RECONCILE_MIN_AGE = int(os.environ.get("RECONCILE_MIN_AGE", "180"))
+# Rows older than this are left alone (Daraja stops answering queries for them)
+RECONCILE_MAX_AGE = int(os.environ.get("RECONCILE_MAX_AGE", "86400"))
+RECONCILE_PAGE_SIZE = int(os.environ.get("RECONCILE_PAGE_SIZE", "200"))
+# Parallel STK Push Queries, and the rate they are started at (queries per second)
+RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", "5"))
+RECONCILE_QUERY_RATE = float(os.environ.get("RECONCILE_QUERY_RATE", "5"))
+# Every uvicorn worker starts the timer; only the one holding this lock runs it,
+# so the query rate above is the host's total, not per worker
+RECONCILE_LOCK_PATH = os.environ.get("RECONCILE_LOCK_PATH", f"{CALLBACK_QUEUE_PATH}.reconcile.lock")
+
+
+def _iso(seconds_ago: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)).isoformat()
+
+
+class Reconciler:
+    """
+    Settles reservations whose M-Pesa callback never arrived.
+    Each run keyset-scans pending rows older than RECONCILE_MIN_AGE, asks
+    Daraja's STK Push Query how each prompt ended (a bounded pool, started
+    no faster than RECONCILE_QUERY_RATE), and hands each page's settled
+    results to `apply` — the callback handler — in one batch of
+    callback-shaped bodies, so the status update, ticket email, seat
+    settlement and status push are the same code path. Prompts Daraja is
+    still processing stay pending.
+    The timer only runs in the worker holding RECONCILE_LOCK_PATH; if that
+    process dies the OS drops the lock and another worker takes over.
+    """
+
+    def __init__(self, apply):
+        self.apply = apply
+        self.last_run = None
+        self._bucket = TokenBucket(RECONCILE_QUERY_RATE, max(1.0, RECONCILE_QUERY_RATE))
+        self._lock = None
+        self._task = None
+        self._leader_file = None
+
+    # --- ONE ROW ---
+
+    async def _rate_limit(self):
+        while True:
+            wait = self._bucket.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def _query(self, row: dict):
+        """Returns a callback-shaped body for a settled prompt, or the outcome "pending" | "error"."""
+        checkout_id = row["checkout_request_id"]
+        await self._rate_limit()
+        try:
+            result = await query_stk_status_async(checkout_id)
+            result_code = result.get("ResultCode")
+            if result_code is None:
+                # e.g. errorCode 500.001.1001: "The transaction is being processed"
+                return "pending"
+            return {
+                "CheckoutRequestID": checkout_id,
+                "ResultCode": int(result_code),
+                "ResultDesc": result.get("ResultDesc"),
+                # The query response carries no receipt number
+                "CallbackMetadata": {},
+            }
+        except Exception as e:
+            logger.warning(f"STK QUERY ERROR for {checkout_id}: {e}")
+            return "error"
+
+    # --- ONE PAGE ---
+
+    async def _apply_page(self, settled: list) -> list:
+        """Applies a page's settled bodies in one batch. Returns one outcome per body."""
+        if not settled:
+            return []
+        try:
+            await self.apply(settled)
+        except Exception as e:
+            logger.error(f"RECONCILE APPLY ERROR for {len(settled)} reservations: {e}")
+            return ["error"] * len(settled)
+        return ["paid" if body["ResultCode"] == 0 else "failed" for body in settled]
+
+    # --- ONE RUN ---
+
+    async def run_once(self) -> dict:
+        """One full pass. Returns (and keeps as last_run) what it resolved and how long it took."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            return {"status": "already_running", "last_run": self.last_run}
+
+        async with self._lock:
+            started = time.perf_counter()
+            counts = {"scanned": 0, "paid": 0, "failed": 0, "pending": 0, "error": 0}
+            older_than, newer_than = _iso(RECONCILE_MIN_AGE), _iso(RECONCILE_MAX_AGE)
+            workers = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+
+            async def bounded(row):
+                async with workers:
+                    return await self._query(row)
+
+            after_id = 0
+            while True:
+                rows = await reservations.stale_pending_page(older_than, newer_than, after_id, RECONCILE_PAGE_SIZE)
+                if not rows:
+                    break
+                counts["scanned"] += len(rows)
+                results = await asyncio.gather(*(bounded(row) for row in rows))
+                settled = [result for result in results if isinstance(result, dict)]
+                outcomes = [result for result in results if isinstance(result, str)]
+                for outcome in outcomes + await self._apply_page(settled):
+                    counts[outcome] += 1
+                    reconciled.inc(outcome=outcome)
+                if len(rows) < RECONCILE_PAGE_SIZE:
+                    break
+                after_id = rows[-1]["id"]
+
+            seconds = time.perf_counter() - started
+            reconcile_runs.observe(seconds)
+            self.last_run = dict(counts, resolved=counts["paid"] + counts["failed"],
+                                 seconds=round(seconds, 2), finished_at=time.time())
+            if counts["scanned"]:
+                logger.info(f"RECONCILED {self.last_run['resolved']}/{counts['scanned']} stale reservations "
+                            f"in {seconds:.1f}s ({counts['paid']} paid, {counts['failed']} failed, "
+                            f"{counts['pending']} still processing, {counts['error']} errors)")
+            return self.last_run
+
+    # --- SCHEDULE ---
+
+    def _lead(self) -> bool:
+        """True once this process holds the reconcile lock (checked again every interval)."""
+        if self._leader_file is not None or fcntl is None:
+            return True
+        handle = open(RECONCILE_LOCK_PATH, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._leader_file = handle
+        logger.info(f"Reconciler running in worker {os.getpid()}")
+        return True
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            if not self._lead():
+                continue
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"RECONCILE ERROR: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._leader_file is not None:
+            # Closing releases the lock for the workers still running
+            self._leader_file.close()
+            self._leader_file = None
+
+    def get_stats(self):
+        return {"running": bool(self._lock and self._lock.locked()), "leader": self._leader_file is not None,
+                "last_run": self.last_run}
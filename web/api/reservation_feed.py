@@ -0,0 +1,121 @@
+import io
+import csv
+import json
+import base64
+import asyncio
+import reservations
+from catalog import get_screening
+
+# CONFIGURATION
+FEED_PAGE_MAX = 200
+EXPORT_PAGE_SIZE = 1000
+CHANGES_PAGE_MAX = 500
+
+EXPORT_COLUMNS = ["id", "status", "name", "email", "phone", "tickets", "amount", "movie_title", "screening_id",
+                  "checkout_request_id", "mpesa_receipt", "checked_in_at", "created_at"]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# --- CURSORS ---
+# Opaque to the client: base64 of the keyset position.
+
+def encode_cursor(*position) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(position, list) or not position:
+        raise InvalidCursor("Invalid cursor")
+    return position
+
+
+# --- ROWS ---
+
+def _titles(screening_ids: set) -> dict:
+    """Movie title per screening, from the cached catalog."""
+    return {sid: ((get_screening(sid) or {}).get("movie") or {}).get("title") for sid in screening_ids}
+
+
+async def _with_titles(rows: list) -> list:
+    titles = await asyncio.to_thread(_titles, {row.get("screening_id") for row in rows})
+    for row in rows:
+        row["movie_title"] = titles.get(row.get("screening_id"))
+    return rows
+
+
+async def page(screening_id: str = None, status: str = None, cursor: str = None, limit: int = 50) -> dict:
+    """One page, newest first, plus the cursor for the next (None on the last page)."""
+    limit = max(1, min(limit, FEED_PAGE_MAX))
+    before_id = decode_cursor(cursor)[0] if cursor else None
+    rows = await reservations.feed_page(screening_id, status, before_id, limit)
+    result = {
+        "items": await _with_titles(rows),
+        "next_cursor": encode_cursor(rows[-1]["id"]) if len(rows) == limit else None,
+    }
+    if not cursor:
+        # Where the live view starts asking for deltas
+        head = await reservations.latest_change(screening_id)
+        result["changes_cursor"] = encode_cursor(*head) if head else encode_cursor("1970-01-01T00:00:00+00:00", 0)
+    return result
+
+
+async def changes(cursor: str, screening_id: str = None, limit: int = CHANGES_PAGE_MAX) -> dict:
+    """Rows inserted or updated since `cursor`, and the cursor to ask with next time."""
+    position = decode_cursor(cursor)
+    if len(position) != 2:
+        raise InvalidCursor("Invalid cursor")
+    updated_at, after_id = position
+    limit = max(1, min(limit, CHANGES_PAGE_MAX))
+    rows = await reservations.changes_since(updated_at, after_id, screening_id, limit)
+    next_cursor = encode_cursor(rows[-1]["updated_at"], rows[-1]["id"]) if rows else cursor
+    columns = reservations.FEED_COLUMNS.split(",")
+    items = [{column: row.get(column) for column in columns} for row in rows]
+    return {"items": await _with_titles(items), "cursor": next_cursor, "has_more": len(rows) == limit}
+
+
+# --- EXPORT ---
+
+async def _all_rows(screening_id: str = None, status: str = None):
+    """Every matching row, one keyset page in memory at a time."""
+    before_id = None
+    while True:
+        rows = await reservations.feed_page(screening_id, status, before_id, EXPORT_PAGE_SIZE)
+        for row in await _with_titles(rows):
+            yield row
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        before_id = rows[-1]["id"]
+
+
+async def export_csv(screening_id: str = None, status: str = None):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    async for row in _all_rows(screening_id, status):
+        writer.writerow(row)
+        # Flushed per ~64KB so the response streams without building the file
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def export_ndjson(screening_id: str = None, status: str = None):
+    lines = []
+    size = 0
+    async for row in _all_rows(screening_id, status):
+        line = json.dumps({column: row.get(column) for column in EXPORT_COLUMNS}) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size > 65536:
+            yield "".join(lines)
+            lines, size = [], 0
+    yield "".join(lines)
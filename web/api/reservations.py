@@ -0,0 +1,144 @@
+from database import get_async_db
+from telemetry import span
+
+# All access to the `reservations` table goes through here.
+# Writes return the changed rows with the statement itself (RETURNING /
+# PostgREST's default `return=representation`), so no follow-up SELECT.
+
+TABLE = "reservations"
+
+
+def _first(response):
+    return response.data[0] if response.data else None
+
+
+async def create_reservation(data: dict):
+    """Inserts a pending reservation and returns the stored row."""
+    with span("supabase", "create_reservation"):
+        response = await get_async_db().table(TABLE).insert(data).execute()
+    return _first(response)
+
+
+async def apply_transitions(results: list):
+    """
+    Applies many payment results in one round trip via the
+    apply_payment_results() SQL function (see schema.sql).
+    results: [{"checkout_request_id", "status", "mpesa_receipt"}, ...]
+    Returns the rows that changed: unknown checkouts and replays are
+    skipped, and a late success after a failure/timeout still wins (the
+    money was taken).
+    """
+    if not results:
+        return []
+    with span("supabase", "apply_payment_results"):
+        response = await get_async_db().rpc("apply_payment_results", {"results": results}).execute()
+    return response.data or []
+
+
+async def paid_checkout_ids(screening_id: str):
+    """Checkout IDs of every paid reservation for a screening."""
+    with span("supabase", "paid_checkout_ids"):
+        response = await get_async_db().table(TABLE).select("checkout_request_id").eq("screening_id", screening_id).eq("status", "paid").execute()
+    return [row["checkout_request_id"] for row in response.data or []]
+
+
+async def get_status(checkout_id: str):
+    """Returns the reservation status, or None if there is no such checkout."""
+    with span("supabase", "get_status"):
+        response = await get_async_db().table(TABLE).select("status").eq("checkout_request_id", checkout_id).limit(1).execute()
+    row = _first(response)
+    return row["status"] if row else None
+
+
+async def paid_page(screening_id: str, after_id: int = 0, limit: int = 1000):
+    """
+    One keyset page of a screening's paid reservations (id > after_id),
+    with only the columns the door needs.
+    """
+    with span("supabase", "paid_page"):
+        response = await get_async_db().table(TABLE).select(
+            "id,checkout_request_id,mpesa_receipt,name,tickets,checked_in_at,checked_in_by"
+        ).eq("screening_id", screening_id).eq("status", "paid").gt("id", after_id).order("id").limit(limit).execute()
+    return response.data or []
+
+
+async def find_ticket(code: str):
+    """The reservation a ticket code (checkout ID or M-Pesa receipt) belongs to, or None."""
+    for column in ("checkout_request_id", "mpesa_receipt"):
+        with span("supabase", "find_ticket"):
+            response = await get_async_db().table(TABLE).select(
+                "id,screening_id,status,checkout_request_id,mpesa_receipt,name,tickets,checked_in_at,checked_in_by"
+            ).eq(column, code).limit(1).execute()
+        row = _first(response)
+        if row:
+            return row
+    return None
+
+
+async def apply_check_ins(events: list):
+    """
+    Applies door scans in one round trip via apply_check_ins() (schema.sql).
+    events: [{"checkout_request_id", "action", "at", "device"}, ...]
+    Returns one {"checkout_request_id", "outcome", "checked_in_at", "checked_in_by"} per event.
+    """
+    if not events:
+        return []
+    with span("supabase", "apply_check_ins"):
+        response = await get_async_db().rpc("apply_check_ins", {"events": events}).execute()
+    return response.data or []
+
+
+async def stale_pending_page(older_than: str, newer_than: str, after_id: int = 0, limit: int = 200):
+    """
+    One keyset page (id > after_id) of reservations still pending that were
+    created between the two ISO timestamps.
+    """
+    with span("supabase", "stale_pending_page"):
+        response = await get_async_db().table(TABLE).select("id,checkout_request_id,created_at").eq(
+            "status", "pending"
+        ).lt("created_at", older_than).gt("created_at", newer_than).gt("id", after_id).order("id").limit(limit).execute()
+    return response.data or []
+
+
+# Columns the admin Guest List shows (and exports)
+FEED_COLUMNS = "id,status,name,email,phone,tickets,amount,screening_id,checkout_request_id,mpesa_receipt,checked_in_at,created_at,updated_at"
+
+
+async def feed_page(screening_id: str = None, status: str = None, before_id: int = None, limit: int = 50):
+    """One keyset page of reservations, newest first (id < before_id)."""
+    query = get_async_db().table(TABLE).select(FEED_COLUMNS)
+    if screening_id:
+        query = query.eq("screening_id", screening_id)
+    if status:
+        query = query.eq("status", status)
+    if before_id:
+        query = query.lt("id", before_id)
+    with span("supabase", "feed_page"):
+        response = await query.order("id", desc=True).limit(limit).execute()
+    return response.data or []
+
+
+async def changes_since(updated_at: str, after_id: int, screening_id: str = None, limit: int = 500):
+    """
+    Rows changed after the (updated_at, id) position, oldest change first,
+    via reservation_changes() (schema.sql).
+    """
+    with span("supabase", "reservation_changes"):
+        response = await get_async_db().rpc("reservation_changes", {
+            "p_since": updated_at,
+            "p_after_id": after_id,
+            "p_screening_id": screening_id,
+            "p_limit": limit,
+        }).execute()
+    return response.data or []
+
+
+async def latest_change(screening_id: str = None):
+    """(updated_at, id) of the most recent change, or None for an empty table."""
+    query = get_async_db().table(TABLE).select("id,updated_at")
+    if screening_id:
+        query = query.eq("screening_id", screening_id)
+    with span("supabase", "latest_change"):
+        response = await query.order("updated_at", desc=True).order("id", desc=True).limit(1).execute()
+    row = _first(response)
+    return (row["updated_at"], row["id"]) if row else None
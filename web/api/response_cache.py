@@ -0,0 +1,179 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+# CONFIGURATION
+CHAT_CACHE_SIZE = int(os.environ.get("CHAT_CACHE_SIZE", "512"))
+CHAT_CACHE_TTL = int(os.environ.get("CHAT_CACHE_TTL", "1800"))
+# Trigram similarity needed for a fuzzy hit (0, the default, disables the similarity tier).
+# Questions with digits (dates, times, party sizes) only ever match exactly:
+# "Jan 24" vs "Jan 25" scores ~0.88 but needs a different answer.
+CHAT_CACHE_SIMILARITY = float(os.environ.get("CHAT_CACHE_SIMILARITY", "0"))
+
+
+def _normalize(text: str) -> str:
+    """Lowercases, drops punctuation and collapses whitespace."""
+    text = re.sub(r"[^\w\s]", "", str(text).lower())
+    return " ".join(text.split())
+
+
+def _has_digits(text: str) -> bool:
+    return any(ch.isdigit() for ch in text)
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def context_version(movie_context: str) -> str:
+    """Content hash of the screening context; changes whenever the catalog does."""
+    return hashlib.sha1((movie_context or "").encode()).hexdigest()[:12]
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of concierge replies.
+    Keyed on (context version, normalized earlier turns, normalized question).
+    Exact matches are O(1); the optional similarity tier compares the
+    question's trigrams against cached questions with the same earlier turns.
+    Misses are single-flight: callers asking a question that is already being
+    answered wait for that reply instead of spending another completion.
+    """
+
+    def __init__(self, max_entries: int = CHAT_CACHE_SIZE, ttl: int = CHAT_CACHE_TTL,
+                 similarity: float = CHAT_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.version = None
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0, "coalesced": 0, "saved_tokens": 0, "saved_seconds": 0.0}
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _key(self, history: list, version: str):
+        """Returns (prefix, question) or None if the turn isn't cacheable."""
+        turns = []
+        for msg in history:
+            role = msg.get('role') if isinstance(msg, dict) else getattr(msg, 'role', 'user')
+            content = msg.get('content') if isinstance(msg, dict) else getattr(msg, 'content', '')
+            if content and str(content).strip():
+                turns.append(f"{role}:{_normalize(content)}")
+
+        # Only a conversation that ends on a user question has a reply to cache
+        if not turns or not turns[-1].startswith("user:"):
+            return None
+        return (version, "|".join(turns[:-1])), turns[-1][len("user:"):]
+
+    def _switch_version(self, version: str):
+        # A new catalog version makes every older reply stale
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, history: list, version: str):
+        key = self._key(history, version)
+        if key is None:
+            return None
+        prefix, question = key
+        now = time.monotonic()
+
+        with self._lock:
+            self._switch_version(version)
+
+            entry = self._entries.get((prefix, question))
+            if entry and now - entry["stored_at"] < self.ttl:
+                self._entries.move_to_end((prefix, question))
+                return self._hit(entry, "hits")
+
+            if self.similarity > 0 and not _has_digits(question):
+                grams = _trigrams(question)
+                best, best_score = None, self.similarity
+                for (entry_prefix, entry_question), candidate in self._entries.items():
+                    if entry_prefix != prefix or now - candidate["stored_at"] >= self.ttl:
+                        continue
+                    if _has_digits(entry_question):
+                        continue
+                    union = grams | candidate["trigrams"]
+                    score = len(grams & candidate["trigrams"]) / len(union) if union else 0
+                    if score >= best_score:
+                        best, best_score = candidate, score
+                if best:
+                    return self._hit(best, "similar_hits")
+
+            self.stats["misses"] += 1
+            return None
+
+    def _hit(self, entry: dict, kind: str):
+        self.stats[kind] += 1
+        self.stats["saved_tokens"] += entry["tokens"]
+        self.stats["saved_seconds"] += entry["latency"]
+        return entry["reply"]
+
+    def put(self, history: list, version: str, reply: str, tokens: int = 0, latency: float = 0.0):
+        key = self._key(history, version)
+        if key is None or not reply:
+            return
+        prefix, question = key
+
+        with self._lock:
+            self._switch_version(version)
+            self._entries[(prefix, question)] = {
+                "reply": reply,
+                "trigrams": _trigrams(question),
+                "tokens": tokens,
+                "latency": latency,
+                "stored_at": time.monotonic(),
+            }
+            self._entries.move_to_end((prefix, question))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # --- SINGLE-FLIGHT ---
+
+    def join(self, history: list, version: str):
+        """
+        Called after a miss. Returns the future of the identical question
+        already being answered, or None when this caller answers it; the
+        caller then settles it with finish() or abandon().
+        """
+        key = self._key(history, version)
+        if key is None:
+            return None
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+            return flight
+        self._flights[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def finish(self, history: list, version: str, reply: str, tokens: int = 0, latency: float = 0.0):
+        """Caches a fresh reply and hands it to every caller waiting on it."""
+        self.put(history, version, reply, tokens, latency)
+        self.abandon(history, version, reply)
+
+    def abandon(self, history: list, version: str, reply: str = None):
+        """
+        Ends a flight without caching: waiting callers get `reply` (e.g. the
+        fallback after an upstream error), or ask for themselves when None.
+        """
+        key = self._key(history, version)
+        flight = self._flights.pop(key, None) if key else None
+        if flight is not None and not flight.done():
+            flight.set_result(reply)
+
+    def get_stats(self):
+        lookups = self.stats["hits"] + self.stats["similar_hits"] + self.stats["misses"]
+        stats = dict(self.stats, entries=len(self._entries))
+        stats["hit_rate"] = round((lookups - self.stats["misses"]) / lookups, 3) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 2)
+        return stats
+
+
+# Shared cache for Fellini replies
+chat_cache = ResponseCache()
@@ -0,0 +1,390 @@
+-- Falutin RSVP: reservations table support objects.
+-- Run once in the Supabase SQL editor.
+
+-- Every callback, status poll and reconciliation looks rows up by checkout id
+CREATE UNIQUE INDEX IF NOT EXISTS reservations_checkout_request_id_idx
+    ON reservations (checkout_request_id);
+
+-- Applies many payment results in one round trip and returns the updated rows.
+-- results: [{"checkout_request_id": "...", "status": "paid", "mpesa_receipt": "..."}, ...]
+CREATE OR REPLACE FUNCTION apply_payment_results(results jsonb)
+RETURNS SETOF reservations
+LANGUAGE sql
+AS $$
+    UPDATE reservations AS r
+       SET status = t.status,
+           mpesa_receipt = COALESCE(t.mpesa_receipt, r.mpesa_receipt)
+      FROM jsonb_to_recordset(results) AS t(checkout_request_id text, status text, mpesa_receipt text)
+     WHERE r.checkout_request_id = t.checkout_request_id
+       -- paid is terminal; failed only applies to a pending row (a late success
+       -- may still overturn it). So a replayed result matches nothing and
+       -- returns no row, which is what keeps a second ticket from going out.
+       AND r.status <> 'paid'
+       AND (t.status = 'paid' OR r.status = 'pending')
+ RETURNING r.*;
+$$;
+
+-- --- SEAT INVENTORY ---
+-- One row per screening; held = seats in unpaid STK holds, sold = paid seats.
+CREATE TABLE IF NOT EXISTS screening_inventory (
+    screening_id text PRIMARY KEY,
+    capacity integer NOT NULL,
+    held integer NOT NULL DEFAULT 0,
+    sold integer NOT NULL DEFAULT 0,
+    CHECK (held >= 0 AND sold >= 0)
+);
+
+CREATE TABLE IF NOT EXISTS seat_holds (
+    hold_id text PRIMARY KEY,
+    screening_id text NOT NULL REFERENCES screening_inventory (screening_id),
+    tickets integer NOT NULL,
+    checkout_request_id text UNIQUE,
+    status text NOT NULL DEFAULT 'held',   -- held | sold | released
+    expires_at timestamptz NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS seat_holds_expiring_idx ON seat_holds (expires_at) WHERE status = 'held';
+
+-- Atomically holds seats if enough remain. Returns seats left after the hold, or -1 if sold out.
+-- The conditional UPDATE takes the row lock, so concurrent holds can never oversell.
+CREATE OR REPLACE FUNCTION hold_seats(p_hold_id text, p_screening_id text, p_capacity integer, p_tickets integer, p_ttl_seconds integer)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    remaining integer;
+BEGIN
+    INSERT INTO screening_inventory (screening_id, capacity)
+    VALUES (p_screening_id, p_capacity)
+    ON CONFLICT (screening_id) DO UPDATE SET capacity = EXCLUDED.capacity
+    WHERE screening_inventory.capacity <> EXCLUDED.capacity;
+
+    UPDATE screening_inventory
+       SET held = held + p_tickets
+     WHERE screening_id = p_screening_id
+       AND capacity - held - sold >= p_tickets
+    RETURNING capacity - held - sold INTO remaining;
+
+    IF NOT FOUND THEN
+        RETURN -1;
+    END IF;
+
+    INSERT INTO seat_holds (hold_id, screening_id, tickets, expires_at)
+    VALUES (p_hold_id, p_screening_id, p_tickets, now() + make_interval(secs => p_ttl_seconds));
+
+    RETURN remaining;
+END;
+$$;
+
+-- Links a hold to the M-Pesa checkout it is waiting on.
+CREATE OR REPLACE FUNCTION attach_hold(p_hold_id text, p_checkout_request_id text)
+RETURNS void
+LANGUAGE sql
+AS $$
+    UPDATE seat_holds SET checkout_request_id = p_checkout_request_id WHERE hold_id = p_hold_id;
+$$;
+
+-- Converts a hold to sold (paid) or gives the seats back (failed/abandoned).
+-- A payment that lands after its hold expired is still honoured: the money
+-- was taken. Its seats were already released, so they are added to `sold`
+-- without a capacity check. Such a late payment CAN OVERSELL, by up to its
+-- own ticket count; it shows on the Stats Bar as occupancy above 100%.
+CREATE OR REPLACE FUNCTION settle_hold(p_hold_id text, p_checkout_request_id text, p_paid boolean)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    h seat_holds%ROWTYPE;
+BEGIN
+    SELECT * INTO h FROM seat_holds
+     WHERE (p_hold_id IS NOT NULL AND hold_id = p_hold_id)
+        OR (p_checkout_request_id IS NOT NULL AND checkout_request_id = p_checkout_request_id)
+     FOR UPDATE;
+
+    IF NOT FOUND OR h.status = 'sold' OR (h.status = 'released' AND NOT p_paid) THEN
+        RETURN 0;
+    END IF;
+
+    UPDATE seat_holds SET status = CASE WHEN p_paid THEN 'sold' ELSE 'released' END WHERE hold_id = h.hold_id;
+    UPDATE screening_inventory
+       SET held = held - CASE WHEN h.status = 'held' THEN h.tickets ELSE 0 END,
+           sold = sold + CASE WHEN p_paid THEN h.tickets ELSE 0 END
+     WHERE screening_id = h.screening_id;
+
+    RETURN h.tickets;
+END;
+$$;
+
+-- Releases holds whose STK prompt has timed out. Returns how many screenings got seats back.
+CREATE OR REPLACE FUNCTION expire_seat_holds()
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    released integer;
+BEGIN
+    WITH expired AS (
+        UPDATE seat_holds SET status = 'released'
+         WHERE status = 'held' AND expires_at < now()
+        RETURNING screening_id, tickets
+    ), totals AS (
+        SELECT screening_id, SUM(tickets) AS tickets FROM expired GROUP BY screening_id
+    )
+    UPDATE screening_inventory i
+       SET held = i.held - t.tickets
+      FROM totals t
+     WHERE i.screening_id = t.screening_id;
+
+    GET DIAGNOSTICS released = ROW_COUNT;
+    RETURN released;
+END;
+$$;
+
+-- Seats left per screening (cheap primary-key read).
+CREATE OR REPLACE FUNCTION seats_available(p_screening_id text)
+RETURNS integer
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT capacity - held - sold FROM screening_inventory WHERE screening_id = p_screening_id;
+$$;
+
+-- --- ADMIN ACCESS ---
+-- The API (and the dashboard) read the admin role from app_metadata, which
+-- only the service role can write. Grant it with:
+--   UPDATE auth.users SET raw_app_meta_data = raw_app_meta_data || '{"role": "admin"}' WHERE email = '...';
+
+-- --- ADMIN STATS ---
+-- Per-screening totals kept current by a trigger on reservations, so the
+-- admin Stats Bar reads one row per screening instead of every reservation.
+CREATE TABLE IF NOT EXISTS screening_stats (
+    screening_id text PRIMARY KEY,
+    paid_reservations integer NOT NULL DEFAULT 0,
+    pending_reservations integer NOT NULL DEFAULT 0,
+    tickets_sold integer NOT NULL DEFAULT 0,
+    revenue bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Adds (p_sign = 1) or removes (p_sign = -1) one reservation's contribution.
+CREATE OR REPLACE FUNCTION bump_screening_stats(p_screening_id text, p_status text, p_tickets integer, p_amount bigint, p_sign integer)
+RETURNS void
+LANGUAGE sql
+AS $$
+    INSERT INTO screening_stats (screening_id, paid_reservations, pending_reservations, tickets_sold, revenue)
+    VALUES (
+        p_screening_id,
+        CASE WHEN p_status = 'paid' THEN p_sign ELSE 0 END,
+        CASE WHEN p_status = 'pending' THEN p_sign ELSE 0 END,
+        CASE WHEN p_status = 'paid' THEN p_sign * p_tickets ELSE 0 END,
+        CASE WHEN p_status = 'paid' THEN p_sign * p_amount ELSE 0 END
+    )
+    ON CONFLICT (screening_id) DO UPDATE SET
+        paid_reservations = screening_stats.paid_reservations + EXCLUDED.paid_reservations,
+        pending_reservations = screening_stats.pending_reservations + EXCLUDED.pending_reservations,
+        tickets_sold = screening_stats.tickets_sold + EXCLUDED.tickets_sold,
+        revenue = screening_stats.revenue + EXCLUDED.revenue,
+        updated_at = now();
+$$;
+
+CREATE OR REPLACE FUNCTION reservations_rollup()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.screening_id IS NOT NULL THEN
+        PERFORM bump_screening_stats(OLD.screening_id, OLD.status, COALESCE(OLD.tickets, 0), COALESCE(OLD.amount, 0)::bigint, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.screening_id IS NOT NULL THEN
+        PERFORM bump_screening_stats(NEW.screening_id, NEW.status, COALESCE(NEW.tickets, 0), COALESCE(NEW.amount, 0)::bigint, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS reservations_rollup ON reservations;
+CREATE TRIGGER reservations_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF status, tickets, amount, screening_id ON reservations
+    FOR EACH ROW EXECUTE FUNCTION reservations_rollup();
+
+-- Rebuilds the rollup from reservations (first install, or after bulk edits with triggers disabled).
+CREATE OR REPLACE FUNCTION refresh_screening_stats()
+RETURNS void
+LANGUAGE sql
+AS $$
+    DELETE FROM screening_stats;
+    INSERT INTO screening_stats (screening_id, paid_reservations, pending_reservations, tickets_sold, revenue)
+    SELECT screening_id,
+           COUNT(*) FILTER (WHERE status = 'paid'),
+           COUNT(*) FILTER (WHERE status = 'pending'),
+           COALESCE(SUM(tickets) FILTER (WHERE status = 'paid'), 0),
+           COALESCE(SUM(amount) FILTER (WHERE status = 'paid'), 0)
+      FROM reservations
+     WHERE screening_id IS NOT NULL
+     GROUP BY screening_id;
+$$;
+
+SELECT refresh_screening_stats();
+
+-- What GET /admin/stats reads: the rollup plus capacity from the seat inventory.
+CREATE OR REPLACE VIEW admin_screening_stats AS
+    SELECT s.screening_id, s.paid_reservations, s.pending_reservations,
+           s.tickets_sold, s.revenue, s.updated_at, i.capacity
+      FROM screening_stats s
+      LEFT JOIN screening_inventory i USING (screening_id);
+
+-- --- DOOR CHECK-IN ---
+-- Set when a guest's ticket is scanned at the door; NULL means not yet admitted.
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS checked_in_at timestamptz;
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS checked_in_by text;
+
+-- The door preload pages through one screening's paid rows by id
+CREATE INDEX IF NOT EXISTS reservations_screening_paid_idx
+    ON reservations (screening_id, id) WHERE status = 'paid';
+
+-- Applies a batch of door scans in one round trip.
+-- events: [{"checkout_request_id": "...", "action": "check_in" | "undo", "at": "<timestamptz>", "device": "..."}, ...]
+-- First check-in wins; an undo only clears a check-in made at or before it.
+-- Returns one outcome per event with the row's resulting check-in state.
+CREATE OR REPLACE FUNCTION apply_check_ins(events jsonb)
+RETURNS TABLE (checkout_request_id text, outcome text, checked_in_at timestamptz, checked_in_by text)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    e record;
+    r reservations%ROWTYPE;
+BEGIN
+    FOR e IN SELECT * FROM jsonb_to_recordset(events) AS t(checkout_request_id text, action text, at timestamptz, device text)
+    LOOP
+        IF e.action = 'undo' THEN
+            UPDATE reservations AS x
+               SET checked_in_at = NULL, checked_in_by = NULL
+             WHERE x.checkout_request_id = e.checkout_request_id
+               AND x.checked_in_at <= e.at
+            RETURNING x.* INTO r;
+        ELSE
+            UPDATE reservations AS x
+               SET checked_in_at = e.at, checked_in_by = e.device
+             WHERE x.checkout_request_id = e.checkout_request_id
+               AND x.status = 'paid'
+               AND x.checked_in_at IS NULL
+            RETURNING x.* INTO r;
+        END IF;
+
+        IF FOUND THEN
+            outcome := 'applied';
+        ELSE
+            SELECT * INTO r FROM reservations AS x WHERE x.checkout_request_id = e.checkout_request_id;
+            IF NOT FOUND THEN
+                outcome := 'unknown';
+            ELSIF r.status <> 'paid' THEN
+                outcome := 'not_paid';
+            ELSIF e.action = 'undo' AND r.checked_in_at IS NULL THEN
+                outcome := 'duplicate';   -- already undone
+            ELSIF e.action <> 'undo' AND r.checked_in_at = e.at AND r.checked_in_by IS NOT DISTINCT FROM e.device THEN
+                outcome := 'duplicate';   -- a retried batch
+            ELSE
+                outcome := 'conflict';    -- ticket already used, or re-scanned after the undo
+            END IF;
+        END IF;
+
+        checkout_request_id := e.checkout_request_id;
+        checked_in_at := r.checked_in_at;
+        checked_in_by := r.checked_in_by;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+-- --- PENDING RECONCILIATION ---
+-- The reconciler pages through pending rows by id; paid/failed rows never enter this index
+CREATE INDEX IF NOT EXISTS reservations_pending_idx
+    ON reservations (id) WHERE status = 'pending';
+
+-- --- GUEST LIST FEED ---
+-- updated_at moves on every change, so the admin view can fetch deltas by (updated_at, id)
+ALTER TABLE reservations ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS reservations_touch ON reservations;
+CREATE TRIGGER reservations_touch
+    BEFORE UPDATE ON reservations
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS reservations_updated_idx ON reservations (updated_at, id);
+CREATE INDEX IF NOT EXISTS reservations_screening_id_idx ON reservations (screening_id, id);
+
+-- Rows changed after (p_since, p_after_id), oldest first.
+-- The newest couple of seconds are held back: a change stamped earlier but
+-- committed later would otherwise land behind a cursor that already moved on.
+CREATE OR REPLACE FUNCTION reservation_changes(p_since timestamptz, p_after_id bigint, p_screening_id text DEFAULT NULL, p_limit integer DEFAULT 500)
+RETURNS SETOF reservations
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT *
+      FROM reservations
+     WHERE (updated_at, id) > (p_since, p_after_id)
+       AND updated_at < now() - interval '2 seconds'
+       AND (p_screening_id IS NULL OR screening_id = p_screening_id)
+     ORDER BY updated_at, id
+     LIMIT p_limit;
+$$;
+
+-- --- COMMUNITY POLLS ---
+-- Poll definitions live in Sanity (`poll` documents); votes and running totals live here.
+-- One vote per member per poll: the primary key settles races between workers.
+CREATE TABLE IF NOT EXISTS poll_votes (
+    poll_id text NOT NULL,
+    user_id text NOT NULL,
+    option_id text NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (poll_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS poll_votes_recent_idx ON poll_votes (poll_id, created_at DESC);
+
+-- Kept by record_poll_votes(), so results cost one row per option however many votes exist
+CREATE TABLE IF NOT EXISTS poll_tallies (
+    poll_id text NOT NULL,
+    option_id text NOT NULL,
+    votes integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (poll_id, option_id)
+);
+
+-- Writes a batch of votes in one round trip and bumps the tallies by what was inserted.
+-- votes: [{"poll_id", "user_id", "option_id", "voted_at"}, ...]
+-- Returns one row per vote: accepted = false when the member had already voted
+-- (option_id is then their standing choice, or NULL if that vote committed concurrently).
+CREATE OR REPLACE FUNCTION record_poll_votes(votes jsonb)
+RETURNS TABLE (poll_id text, user_id text, option_id text, accepted boolean)
+LANGUAGE sql
+AS $$
+    WITH incoming AS (
+        SELECT DISTINCT ON (v.poll_id, v.user_id) v.poll_id, v.user_id, v.option_id, v.voted_at
+          FROM jsonb_to_recordset(votes) AS v(poll_id text, user_id text, option_id text, voted_at timestamptz)
+         ORDER BY v.poll_id, v.user_id, v.voted_at
+    ), inserted AS (
+        INSERT INTO poll_votes AS p (poll_id, user_id, option_id, created_at)
+        SELECT i.poll_id, i.user_id, i.option_id, COALESCE(i.voted_at, now()) FROM incoming AS i
+        ON CONFLICT DO NOTHING
+        RETURNING p.poll_id, p.user_id, p.option_id
+    ), bumped AS (
+        INSERT INTO poll_tallies AS t (poll_id, option_id, votes)
+        SELECT n.poll_id, n.option_id, count(*) FROM inserted AS n GROUP BY n.poll_id, n.option_id
+        ON CONFLICT ON CONSTRAINT poll_tallies_pkey DO UPDATE SET votes = t.votes + EXCLUDED.votes
+    )
+    SELECT i.poll_id, i.user_id, COALESCE(n.option_id, p.option_id), n.user_id IS NOT NULL
+      FROM incoming AS i
+      LEFT JOIN inserted AS n ON n.poll_id = i.poll_id AND n.user_id = i.user_id
+      LEFT JOIN poll_votes AS p ON p.poll_id = i.poll_id AND p.user_id = i.user_id;
+$$;
@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import logging
+from database import get_async_db
+from catalog import get_screening
+from telemetry import span
+
+logger = logging.getLogger("FalutinAPI.stats")
+
+# CONFIGURATION
+# How long one rollup read answers the dashboard (seconds)
+STATS_TTL = float(os.environ.get("STATS_TTL", "10"))
+
+VIEW = "admin_screening_stats"
+
+
+def _occupancy(tickets: int, capacity: int):
+    """Percentage of seats sold, or None when the screening has no capacity."""
+    if not capacity:
+        return None
+    return round(100 * tickets / capacity, 1)
+
+
+class AdminStats:
+    """
+    Revenue, tickets and occupancy for the admin Stats Bar.
+    The totals come from the screening_stats rollup (schema.sql), which a
+    trigger keeps current on every reservation change, so a read costs one
+    row per screening however many reservations exist. The result is cached
+    for STATS_TTL and dropped early when a payment settles.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._expires = 0
+        self._lock = None
+
+    # --- CACHE ---
+
+    def invalidate(self):
+        """Next read goes to the database (called on payment transitions)."""
+        self._expires = 0
+
+    async def get(self):
+        if self._snapshot is not None and self._expires > time.monotonic():
+            return self._snapshot
+
+        # One reload per expiry, however many dashboards ask at once
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._snapshot is None or self._expires <= time.monotonic():
+                expires = time.monotonic() + STATS_TTL
+                self._snapshot = await self._load()
+                self._expires = expires
+        return self._snapshot
+
+    async def for_screening(self, screening_id: str):
+        """One screening's figures from the cached snapshot (None if it has no reservations)."""
+        snapshot = await self.get()
+        return next((s for s in snapshot["screenings"] if s["screening_id"] == screening_id), None)
+
+    # --- ROLLUP ---
+
+    async def _load(self):
+        with span("supabase", "admin_stats"):
+            response = await get_async_db().table(VIEW).select("*").execute()
+        rows = response.data or []
+        screenings = await asyncio.to_thread(self._decorate, rows)
+
+        revenue = sum(s["revenue"] for s in screenings)
+        tickets = sum(s["tickets_sold"] for s in screenings)
+        # Occupancy only counts screenings with a known capacity
+        seated = [s for s in screenings if s["capacity"]]
+        capacity = sum(s["capacity"] for s in seated)
+
+        return {
+            "totals": {
+                "revenue": revenue,
+                "tickets_sold": tickets,
+                "paid_reservations": sum(s["paid_reservations"] for s in screenings),
+                "pending_reservations": sum(s["pending_reservations"] for s in screenings),
+                "capacity": capacity,
+                "occupancy": _occupancy(sum(s["tickets_sold"] for s in seated), capacity),
+            },
+            "screenings": screenings,
+            "generated_at": time.time(),
+        }
+
+    @staticmethod
+    def _decorate(rows: list) -> list:
+        """Adds titles, dates and missing capacities from the cached catalog."""
+        screenings = []
+        for row in rows:
+            screening = get_screening(row["screening_id"]) or {}
+            capacity = row.get("capacity") or screening.get("capacity")
+            tickets = row.get("tickets_sold") or 0
+            screenings.append({
+                "screening_id": row["screening_id"],
+                "title": (screening.get("movie") or {}).get("title"),
+                "date": screening.get("date"),
+                "revenue": row.get("revenue") or 0,
+                "tickets_sold": tickets,
+                "paid_reservations": row.get("paid_reservations") or 0,
+                "pending_reservations": row.get("pending_reservations") or 0,
+                "capacity": capacity,
+                "occupancy": _occupancy(tickets, capacity),
+            })
+        screenings.sort(key=lambda s: s["date"] or "", reverse=True)
+        return screenings
+
+
+# Shared instance used by the API
+admin_stats = AdminStats()
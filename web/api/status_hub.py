@@ -0,0 +1,72 @@
+import time
+import asyncio
+
+# Statuses that never change again once reached
+TERMINAL_STATUSES = ("paid", "failed")
+
+# How long a cached status answers polls without touching the DB (seconds)
+PENDING_STATUS_TTL = 5
+TERMINAL_STATUS_TTL = 600
+
+
+class StatusHub:
+    """
+    In-process pub/sub for payment status transitions.
+    The callback worker publishes; /status-stream subscribers get the new
+    status pushed, and the short-TTL cache answers any remaining polls.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._cache = {}
+
+    # --- CACHE ---
+
+    def get_cached(self, checkout_id: str):
+        entry = self._cache.get(checkout_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        self._cache.pop(checkout_id, None)
+        return None
+
+    def remember(self, checkout_id: str, status: str):
+        ttl = TERMINAL_STATUS_TTL if status in TERMINAL_STATUSES else PENDING_STATUS_TTL
+        self._cache[checkout_id] = (status, time.monotonic() + ttl)
+        if len(self._cache) > 10000:
+            self._evict_expired()
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [k for k, (_, expires) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+
+    # --- PUB/SUB ---
+
+    def publish(self, checkout_id: str, status: str):
+        """Records a transition and wakes every subscriber for that checkout."""
+        self.remember(checkout_id, status)
+        for queue in self._subscribers.get(checkout_id, ()):
+            queue.put_nowait(status)
+
+    def subscribe(self, checkout_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(checkout_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, checkout_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(checkout_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[checkout_id]
+
+    def get_stats(self):
+        return {
+            "subscribers": sum(len(q) for q in self._subscribers.values()),
+            "watched_checkouts": len(self._subscribers),
+            "cached_statuses": len(self._cache),
+        }
+
+
+status_hub = StatusHub()
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# --- CONFIGURATION ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Set per request by the HTTP middleware; stamped onto every log line
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+def new_request_id(incoming: str = None) -> str:
+    rid = incoming or uuid.uuid4().hex[:16]
+    request_id_var.set(rid)
+    return rid
+
+
+# --- STRUCTURED LOGGING ---
+
+class _RequestIdFilter(logging.Filter):
+    """Captures the request ID in the calling thread, before the record is queued."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_listener = None
+
+
+def configure_logging():
+    """
+    Routes all logging through a QueueHandler: request handlers only enqueue
+    records; a listener thread does the JSON formatting and the stdout write.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(_RequestIdFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+# --- METRICS ---
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series["counts"]):
+                lines.append(f"{self.name}_bucket{_labels_text(key + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_labels_text(key + (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{_labels_text(key)} {round(series['sum'], 6)}")
+            lines.append(f"{self.name}_count{_labels_text(key)} {series['count']}")
+        return lines
+
+
+http_latency = Histogram("falutin_http_request_seconds", "Endpoint latency")
+upstream_latency = Histogram("falutin_upstream_request_seconds", "Outbound call latency per upstream")
+upstream_errors = Counter("falutin_upstream_errors_total", "Outbound calls that raised")
+payment_results = Counter("falutin_payment_callbacks_total", "M-Pesa callbacks by ResultCode")
+pay_duplicates = Counter("falutin_pay_duplicates_total", "Duplicate /pay submissions answered without a new STK push")
+reconciled = Counter("falutin_reconciled_total", "Stale pending reservations checked by the reconciler, by outcome")
+reconcile_runs = Histogram("falutin_reconcile_run_seconds", "Reconciler run duration", buckets=(1, 5, 15, 30, 60, 120, 300, 600))
+poll_votes = Counter("falutin_poll_votes_total", "Poll votes by outcome")
+
+_metrics = [http_latency, upstream_latency, upstream_errors, payment_results, pay_duplicates, reconciled, reconcile_runs,
+            poll_votes]
+_gauge_collectors = []
+
+
+def register_gauges(collector):
+    """collector() -> [(name, {labels}, value), ...], sampled on every scrape."""
+    _gauge_collectors.append(collector)
+
+
+class span:
+    """
+    Times one outbound call: `with span("groq", "chat"):`.
+    Plain context manager, so it also times awaits inside async code.
+    """
+
+    def __init__(self, upstream: str, operation: str):
+        self.upstream = upstream
+        self.operation = operation
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        upstream_latency.observe(time.perf_counter() - self.started, upstream=self.upstream, operation=self.operation)
+        if exc_type is not None:
+            upstream_errors.inc(upstream=self.upstream, operation=self.operation)
+        return False
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition of every metric and registered gauge."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    seen = set()
+    for collector in _gauge_collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            logging.getLogger("FalutinAPI.telemetry").error(f"Gauge collector failed: {e}")
+            continue
+        for name, labels, value in samples:
+            if name not in seen:
+                lines.append(f"# TYPE {name} gauge")
+                seen.add(name)
+            lines.append(f"{name}{_labels_text(_label_key(labels))} {value}")
+
+    return "\n".join(lines) + "\n"
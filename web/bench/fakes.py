@@ -0,0 +1,582 @@
+"""
+Local stand-ins for every paid upstream the API talks to, served on one port:
+Daraja (OAuth + STK push + delayed result callbacks), Groq chat completions
+(plain and streamed), the Sanity GROQ query, Supabase PostgREST and Resend.
+
+    uvicorn fakes:app --port 9100
+
+Behaviour is set through env vars (or POST /_fake/config at runtime):
+    FAKE_LATENCY="daraja=0.4,groq=1.2"   mean latency per upstream (seconds)
+    FAKE_ERRORS="daraja=0.05"            fraction of calls answered with a 503
+    FAKE_JITTER=0.3                      +/- fraction applied to every latency
+    FAKE_CALLBACK_DELAY=2                seconds from STK push to result callback
+    FAKE_PAY_SUCCESS=0.8                 fraction of callbacks with ResultCode 0
+    FAKE_CALLBACK_LOSS=0.1               fraction of results never called back (STK Push Query still knows)
+    FAKE_CAPACITY=100                    seats per fake screening
+    FAKE_POLL_TTL=86400                  seconds the fake community poll stays open after a reset
+"""
+import os
+import time
+import uuid
+import json
+import random
+import operator
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+import httpx
+
+UPSTREAMS = ("daraja", "groq", "sanity", "supabase", "resend")
+
+# Path prefix -> which upstream it belongs to
+ROUTING = (
+    ("/oauth/", "daraja"),
+    ("/mpesa/", "daraja"),
+    ("/openai/", "groq"),
+    ("/v2021-10-21/", "sanity"),
+    ("/rest/", "supabase"),
+    ("/auth/", "supabase"),
+    ("/emails", "resend"),
+)
+
+DEFAULT_LATENCY = {"daraja": 0.35, "groq": 0.8, "sanity": 0.12, "supabase": 0.03, "resend": 0.15}
+
+
+def _parse_rates(raw: str, defaults: dict = None) -> dict:
+    rates = dict(defaults or {})
+    for part in filter(None, (raw or "").split(",")):
+        name, _, value = part.partition("=")
+        rates[name.strip()] = float(value)
+    return rates
+
+
+class FakeConfig:
+    def __init__(self):
+        self.latency = _parse_rates(os.environ.get("FAKE_LATENCY"), DEFAULT_LATENCY)
+        self.errors = _parse_rates(os.environ.get("FAKE_ERRORS"))
+        self.jitter = float(os.environ.get("FAKE_JITTER", "0.3"))
+        self.callback_delay = float(os.environ.get("FAKE_CALLBACK_DELAY", "2"))
+        self.pay_success = float(os.environ.get("FAKE_PAY_SUCCESS", "0.8"))
+        self.callback_loss = float(os.environ.get("FAKE_CALLBACK_LOSS", "0"))
+        self.capacity = int(os.environ.get("FAKE_CAPACITY", "100"))
+        self.screenings = int(os.environ.get("FAKE_SCREENINGS", "5"))
+        self.token_interval = float(os.environ.get("FAKE_GROQ_TOKEN_INTERVAL", "0.02"))
+        self.poll_ttl = float(os.environ.get("FAKE_POLL_TTL", "86400"))
+
+    def update(self, changes: dict):
+        for name, value in changes.items():
+            if name in ("latency", "errors"):
+                getattr(self, name).update(value)
+            elif hasattr(self, name):
+                setattr(self, name, type(getattr(self, name))(value))
+
+    def delay(self, upstream: str) -> float:
+        base = self.latency.get(upstream, 0)
+        return max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+config = FakeConfig()
+calls = Counter()
+injected = Counter()
+callbacks = Counter()
+outcomes = {}       # checkout_id -> (result_code, settles_at): what STK Push Query reports
+poll_opened = time.time()
+
+app = FastAPI(title="Falutin upstream fakes")
+
+
+@app.middleware("http")
+async def latency_and_errors(request: Request, call_next):
+    upstream = next((name for prefix, name in ROUTING if request.url.path.startswith(prefix)), None)
+    if upstream is None:
+        return await call_next(request)
+
+    calls[upstream] += 1
+    await asyncio.sleep(config.delay(upstream))
+    if random.random() < config.errors.get(upstream, 0):
+        injected[upstream] += 1
+        return JSONResponse({"error": f"injected {upstream} failure"}, status_code=503)
+    return await call_next(request)
+
+
+# --- DARAJA ---
+
+_callback_client = None
+
+
+def callback_body(checkout_id: str, result_code: int = 0, amount: int = 500, phone: str = "254700000000") -> dict:
+    """The stkCallback envelope Daraja POSTs to CallBackURL."""
+    body = {
+        "MerchantRequestID": uuid.uuid4().hex[:12],
+        "CheckoutRequestID": checkout_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully." if result_code == 0 else "Request cancelled by user",
+    }
+    if result_code == 0:
+        body["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": "FK" + uuid.uuid4().hex[:8].upper()},
+            {"Name": "TransactionDate", "Value": int(time.strftime("%Y%m%d%H%M%S"))},
+            {"Name": "PhoneNumber", "Value": int(phone)},
+        ]}
+    return {"Body": {"stkCallback": body}}
+
+
+async def _deliver_callback(url: str, checkout_id: str, amount: int, phone: str):
+    global _callback_client
+    if _callback_client is None:
+        _callback_client = httpx.AsyncClient(timeout=30)
+
+    await asyncio.sleep(config.delay("daraja") + config.callback_delay)
+    result_code = outcomes[checkout_id][0]
+    if random.random() < config.callback_loss:
+        callbacks["lost"] += 1
+        return
+    try:
+        await _callback_client.post(url, json=callback_body(checkout_id, result_code, amount, phone))
+        callbacks["delivered"] += 1
+    except Exception:
+        callbacks["failed"] += 1
+
+
+def _draw_result() -> int:
+    return 0 if random.random() < config.pay_success else 1032
+
+
+@app.get("/oauth/v1/generate")
+async def daraja_oauth():
+    return {"access_token": "fake-" + uuid.uuid4().hex, "expires_in": "3599"}
+
+
+@app.post("/mpesa/stkpush/v1/processrequest")
+async def daraja_stk_push(request: Request):
+    payload = await request.json()
+    checkout_id = "ws_CO_" + uuid.uuid4().hex
+    outcomes[checkout_id] = (_draw_result(), time.monotonic() + config.callback_delay)
+    if payload.get("CallBackURL", "").startswith("http://"):
+        asyncio.create_task(_deliver_callback(
+            payload["CallBackURL"], checkout_id, payload.get("Amount", 0), str(payload.get("PhoneNumber", "0"))
+        ))
+    return {
+        "MerchantRequestID": uuid.uuid4().hex[:12],
+        "CheckoutRequestID": checkout_id,
+        "ResponseCode": "0",
+        "ResponseDescription": "Success. Request accepted for processing",
+        "CustomerMessage": "Success. Request accepted for processing",
+    }
+
+
+@app.post("/mpesa/stkpushquery/v1/query")
+async def daraja_stk_query(request: Request):
+    checkout_id = (await request.json()).get("CheckoutRequestID")
+    callbacks["queried"] += 1
+    # Rows seeded straight into the fake table were never pushed: settle them on first query
+    result_code, settles_at = outcomes.setdefault(checkout_id, (_draw_result(), 0))
+    if time.monotonic() < settles_at:
+        return JSONResponse({"requestId": uuid.uuid4().hex[:12], "errorCode": "500.001.1001",
+                             "errorMessage": "The transaction is being processed"}, status_code=500)
+    return {
+        "ResponseCode": "0",
+        "ResponseDescription": "The service request has been accepted successsfully",
+        "MerchantRequestID": uuid.uuid4().hex[:12],
+        "CheckoutRequestID": checkout_id,
+        "ResultCode": str(result_code),
+        "ResultDesc": "The service request is processed successfully." if result_code == 0 else "Request cancelled by user",
+    }
+
+
+# --- GROQ ---
+
+REPLY = (
+    "Ah, a question worthy of the silver screen! This week we are showing a restored print "
+    "with live commentary, tickets are 500 KES and the doors open at seven."
+)
+
+
+def _completion_chunk(completion_id: str, model: str, delta: dict, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+async def groq_completion(request: Request):
+    payload = await request.json()
+    model = payload.get("model", "fake")
+    completion_id = "chatcmpl-" + uuid.uuid4().hex
+    prompt_tokens = sum(len(m.get("content") or "") for m in payload.get("messages", [])) // 4
+    words = REPLY.split(" ")
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+
+    if not payload.get("stream"):
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def frames():
+        yield f"data: {json.dumps(_completion_chunk(completion_id, model, {'role': 'assistant', 'content': ''}))}\n\n"
+        for i, word in enumerate(words):
+            await asyncio.sleep(config.token_interval)
+            text = word if i == 0 else " " + word
+            yield f"data: {json.dumps(_completion_chunk(completion_id, model, {'content': text}))}\n\n"
+        # Groq reports a stream's usage on its last chunk, under x_groq
+        last = _completion_chunk(completion_id, model, {}, 'stop')
+        last["x_groq"] = {"usage": usage}
+        yield f"data: {json.dumps(last)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(frames(), media_type="text/event-stream")
+
+
+# --- SANITY ---
+
+def _screenings():
+    return [
+        {
+            "_id": f"screening-{i}",
+            "date": f"2026-11-{i:02d}T19:00:00Z",
+            "price": 500,
+            "capacity": config.capacity,
+            "movie": {"title": f"Fake Feature {i}", "description": "A benchmark fixture."},
+            # Every third screening is a secret one, revealed the day before
+            "isSecret": i % 3 == 0,
+            "redactedTitle": f"PROJECT {i}" if i % 3 == 0 else None,
+            "clues": ["1990s", "Neo-Noir"] if i % 3 == 0 else None,
+            "revealDate": f"2026-11-{i - 1:02d}T19:00:00Z" if i % 3 == 0 else None,
+        }
+        for i in range(1, config.screenings + 1)
+    ]
+
+
+def _polls():
+    expires_at = datetime.fromtimestamp(poll_opened + config.poll_ttl, timezone.utc).isoformat()
+    return [{
+        "_id": "poll-1",
+        "question": "What should we screen next month?",
+        "isActive": True,
+        "expiresAt": expires_at,
+        "options": [{"_id": f"movie-{i}", "title": f"Fake Feature {i}"} for i in range(1, 5)],
+    }]
+
+
+@app.get("/v2021-10-21/data/query/{dataset}")
+async def sanity_query(dataset: str, request: Request):
+    if '_type == "poll"' in request.query_params.get("query", ""):
+        return {"result": _polls(), "ms": 1}
+    etag = f'"catalog-{config.screenings}-{config.capacity}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({"result": _screenings(), "ms": 1}, headers={"ETag": etag})
+
+
+# --- SUPABASE (PostgREST) ---
+
+tables = {"reservations": {}}
+inventory = {}      # screening_id -> {"capacity", "held", "sold"}
+holds = {}          # hold_id -> {"screening_id", "tickets", "checkout_request_id", "status"}
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _touch(row: dict):
+    """What the reservations_touch trigger does."""
+    row["updated_at"] = _now_iso()
+
+
+def _numeric(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _compare(test):
+    """Range operator: numeric columns (keyset ids) compare as numbers, the rest as text."""
+    return lambda a, b: a is not None and (test(a, float(b)) if _numeric(a) else test(str(a), b))
+
+
+_OPS = {
+    "eq": lambda a, b: str(a) == b,
+    "neq": lambda a, b: str(a) != b,
+    "gt": _compare(operator.gt),
+    "gte": _compare(operator.ge),
+    "lt": _compare(operator.lt),
+    "lte": _compare(operator.le),
+    "is": lambda a, b: (a is None) == (b == "null"),
+    "in": lambda a, b: str(a) in [v.strip('"') for v in b.strip("()").split(",")],
+}
+
+
+def _admin_screening_stats():
+    """The admin_screening_stats view (schema.sql), computed from the fake tables."""
+    stats = {}
+    for r in tables["reservations"].values():
+        row = stats.setdefault(r.get("screening_id"), {
+            "screening_id": r.get("screening_id"), "paid_reservations": 0, "pending_reservations": 0,
+            "tickets_sold": 0, "revenue": 0, "capacity": (inventory.get(r.get("screening_id")) or {}).get("capacity"),
+        })
+        if r.get("status") == "paid":
+            row["paid_reservations"] += 1
+            row["tickets_sold"] += r.get("tickets") or 0
+            row["revenue"] += r.get("amount") or 0
+        elif r.get("status") == "pending":
+            row["pending_reservations"] += 1
+    return stats.values()
+
+
+VIEWS = {"admin_screening_stats": _admin_screening_stats}
+
+
+def _query_rows(table: str, params):
+    rows = list(VIEWS[table]() if table in VIEWS else tables.setdefault(table, {}).values())
+    for column, expression in params.multi_items():
+        if column in ("select", "limit", "offset", "order", "on_conflict"):
+            continue
+        op, _, value = expression.partition(".")
+        test = _OPS.get(op)
+        if test:
+            rows = [r for r in rows if test(r.get(column), value)]
+
+    for clause in reversed(params.get("order", "").split(",") if params.get("order") else []):
+        column, _, direction = clause.partition(".")
+        rows.sort(key=lambda r: (r.get(column) is None, r.get(column) if _numeric(r.get(column)) else str(r.get(column))),
+                  reverse=direction.startswith("desc"))
+
+    offset = int(params.get("offset", 0))
+    rows = rows[offset:]
+    if params.get("limit"):
+        rows = rows[:int(params["limit"])]
+    return rows
+
+
+def _project(rows: list, select: str):
+    if not select or select == "*":
+        return rows
+    columns = [c.strip() for c in select.split(",")]
+    return [{c: r.get(c) for c in columns} for r in rows]
+
+
+def _row_key(table: str, row: dict):
+    return row.get("checkout_request_id") or row.get("id") or uuid.uuid4().hex
+
+
+@app.get("/rest/v1/{table}")
+async def postgrest_select(table: str, request: Request):
+    rows = _query_rows(table, request.query_params)
+    return _project(rows, request.query_params.get("select"))
+
+
+@app.post("/rest/v1/{table}")
+async def postgrest_insert(table: str, request: Request):
+    payload = await request.json()
+    stored = tables.setdefault(table, {})
+    created = []
+    for row in payload if isinstance(payload, list) else [payload]:
+        key = _row_key(table, row)
+        if key in stored:
+            return JSONResponse({"code": "23505", "message": "duplicate key value"}, status_code=409)
+        row = dict({"id": len(stored) + 1, "created_at": _now_iso()}, **row)
+        row.setdefault("updated_at", row["created_at"])
+        stored[key] = row
+        created.append(row)
+    return JSONResponse(created, status_code=201)
+
+
+@app.patch("/rest/v1/{table}")
+async def postgrest_update(table: str, request: Request):
+    changes = await request.json()
+    rows = _query_rows(table, request.query_params)
+    for row in rows:
+        row.update(changes)
+        _touch(row)
+    return rows
+
+
+def _inventory(screening_id: str, capacity: int = None):
+    entry = inventory.setdefault(screening_id, {"capacity": capacity or config.capacity, "held": 0, "sold": 0})
+    if capacity:
+        entry["capacity"] = capacity
+    return entry
+
+
+def _settle(hold_id, checkout_id, paid):
+    hold = holds.get(hold_id) if hold_id else next(
+        (h for h in holds.values() if checkout_id and h["checkout_request_id"] == checkout_id), None
+    )
+    if not hold or hold["status"] == "sold" or (hold["status"] == "released" and not paid):
+        return 0
+    entry = _inventory(hold["screening_id"])
+    if hold["status"] == "held":
+        entry["held"] -= hold["tickets"]
+    if paid:
+        entry["sold"] += hold["tickets"]
+    hold["status"] = "sold" if paid else "released"
+    return hold["tickets"]
+
+
+def _apply_payment_results(results):
+    updated = []
+    for result in results:
+        row = tables["reservations"].get(result.get("checkout_request_id"))
+        if row and row.get("status") != "paid" and (result["status"] == "paid" or row.get("status") == "pending"):
+            row["status"] = result["status"]
+            if result.get("mpesa_receipt"):
+                row["mpesa_receipt"] = result["mpesa_receipt"]
+            _touch(row)
+            updated.append(row)
+    return updated
+
+
+def _apply_check_ins(events):
+    """Same rules as apply_check_ins() in schema.sql: first check-in wins."""
+    results = []
+    for event in events:
+        row = tables["reservations"].get(event["checkout_request_id"])
+        undo = event["action"] == "undo"
+        if row is None:
+            outcome = "unknown"
+        elif undo and row.get("checked_in_at") and row["checked_in_at"] <= event["at"]:
+            row["checked_in_at"], row["checked_in_by"], outcome = None, None, "applied"
+            _touch(row)
+        elif not undo and row.get("status") == "paid" and not row.get("checked_in_at"):
+            row["checked_in_at"], row["checked_in_by"], outcome = event["at"], event["device"], "applied"
+            _touch(row)
+        elif row.get("status") != "paid":
+            outcome = "not_paid"
+        elif undo and not row.get("checked_in_at"):
+            outcome = "duplicate"
+        elif not undo and (row["checked_in_at"], row.get("checked_in_by")) == (event["at"], event["device"]):
+            outcome = "duplicate"
+        else:
+            outcome = "conflict"
+        results.append({"checkout_request_id": event["checkout_request_id"], "outcome": outcome,
+                        "checked_in_at": (row or {}).get("checked_in_at"), "checked_in_by": (row or {}).get("checked_in_by")})
+    return results
+
+
+def _reservation_changes(since: str, after_id: int, screening_id: str = None, limit: int = 500):
+    """Same as reservation_changes() in schema.sql, including the 2s hold-back."""
+    settled = (datetime.now(timezone.utc) - timedelta(seconds=2)).isoformat()
+    rows = [r for r in tables["reservations"].values()
+            if (r["updated_at"], r["id"]) > (since, after_id) and r["updated_at"] < settled
+            and (screening_id is None or r.get("screening_id") == screening_id)]
+    return sorted(rows, key=lambda r: (r["updated_at"], r["id"]))[:limit]
+
+
+def _record_poll_votes(votes):
+    """Same as record_poll_votes() in schema.sql: a member's first vote wins."""
+    stored, tallies = tables.setdefault("poll_votes", {}), tables.setdefault("poll_tallies", {})
+    results = []
+    for vote in votes:
+        key = (vote["poll_id"], vote["user_id"])
+        accepted = key not in stored
+        if accepted:
+            stored[key] = {"poll_id": vote["poll_id"], "user_id": vote["user_id"], "option_id": vote["option_id"],
+                           "created_at": vote.get("voted_at") or _now_iso()}
+            tally = tallies.setdefault((vote["poll_id"], vote["option_id"]),
+                                       {"poll_id": vote["poll_id"], "option_id": vote["option_id"], "votes": 0})
+            tally["votes"] += 1
+        results.append({"poll_id": vote["poll_id"], "user_id": vote["user_id"],
+                        "option_id": stored[key]["option_id"], "accepted": accepted})
+    return results
+
+
+@app.post("/rest/v1/rpc/{function}")
+async def postgrest_rpc(function: str, request: Request):
+    args = await request.json()
+    # One event loop, no awaits below: every RPC is atomic, like the row-locked SQL
+    if function == "hold_seats":
+        entry = _inventory(args["p_screening_id"], args["p_capacity"])
+        if entry["capacity"] - entry["held"] - entry["sold"] < args["p_tickets"]:
+            return -1
+        entry["held"] += args["p_tickets"]
+        holds[args["p_hold_id"]] = {
+            "screening_id": args["p_screening_id"], "tickets": args["p_tickets"],
+            "checkout_request_id": None, "status": "held",
+        }
+        return entry["capacity"] - entry["held"] - entry["sold"]
+    if function == "attach_hold":
+        if args["p_hold_id"] in holds:
+            holds[args["p_hold_id"]]["checkout_request_id"] = args["p_checkout_request_id"]
+        return None
+    if function == "settle_hold":
+        return _settle(args.get("p_hold_id"), args.get("p_checkout_request_id"), args.get("p_paid"))
+    if function == "seats_available":
+        entry = inventory.get(args["p_screening_id"])
+        return entry["capacity"] - entry["held"] - entry["sold"] if entry else None
+    if function == "expire_seat_holds":
+        return 0
+    if function == "apply_payment_results":
+        return _apply_payment_results(args.get("results", []))
+    if function == "reservation_changes":
+        return _reservation_changes(args["p_since"], args["p_after_id"], args.get("p_screening_id"), args.get("p_limit", 500))
+    if function == "apply_check_ins":
+        return _apply_check_ins(args.get("events", []))
+    if function == "record_poll_votes":
+        return _record_poll_votes(args.get("votes", []))
+    return JSONResponse({"code": "PGRST202", "message": f"Could not find function {function}"}, status_code=404)
+
+
+@app.get("/auth/v1/user")
+async def supabase_auth_user(request: Request):
+    """Tokens "member-<n>" belong to member n; every other bearer token is an admin, so /admin/* routes can be driven."""
+    token = request.headers.get("authorization", "")[7:]
+    if token.startswith("member-"):
+        return {"id": token, "email": f"{token}@bench.local", "app_metadata": {"role": "member"}}
+    return {"id": "bench-admin", "email": "admin@bench.local", "app_metadata": {"role": "admin"}}
+
+
+# --- RESEND ---
+
+@app.post("/emails")
+async def resend_send():
+    return {"id": uuid.uuid4().hex}
+
+
+@app.post("/emails/batch")
+async def resend_batch(request: Request):
+    payload = await request.json()
+    return {"data": [{"id": uuid.uuid4().hex} for _ in payload]}
+
+
+# --- CONTROL ---
+
+@app.get("/_fake/stats")
+async def fake_stats():
+    statuses = Counter(r.get("status") for r in tables["reservations"].values())
+    return {
+        "calls": dict(calls),
+        "injected_errors": dict(injected),
+        "callbacks": dict(callbacks),
+        "reservations": dict(statuses),
+        "checked_in": sum(1 for r in tables["reservations"].values() if r.get("checked_in_at")),
+        "poll_votes": len(tables.get("poll_votes", {})),
+        "inventory": inventory,
+    }
+
+
+@app.post("/_fake/config")
+async def fake_config(request: Request):
+    config.update(await request.json())
+    return {"latency": config.latency, "errors": config.errors, "callback_delay": config.callback_delay}
+
+
+@app.post("/_fake/reset")
+async def fake_reset():
+    global poll_opened
+    poll_opened = time.time()
+    for store in (calls, injected, callbacks, outcomes, inventory, holds):
+        store.clear()
+    for rows in tables.values():
+        rows.clear()
+    return {"status": "reset"}
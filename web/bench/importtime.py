@@ -0,0 +1,120 @@
+"""
+Cold-start import profile for the API entry point.
+
+Imports `index` in fresh interpreters under `python -X importtime` and
+reports where the time goes: total, the heaviest top-level imports
+(cumulative, like the tree `-X importtime` prints) and the app's own
+modules. Exits non-zero when the median total exceeds the budget, so it
+doubles as the cold-start regression check in CI
+(.github/workflows/cold-start.yml):
+
+    python importtime.py                       # fail if over DEFAULT_BUDGET_MS
+    python importtime.py --budget-ms 400       # a tighter budget
+    python importtime.py --budget-ms 0         # report only
+    COLD_START_BUDGET_MS=400 python importtime.py --runs 7
+"""
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(BENCH_DIR), "api")
+
+# With the lazy imports, `import index` measured a 410-540 ms median on a
+# 1-vCPU box (7-9 runs). The budget leaves room for runner noise but still
+# fails if groq (~175 ms) or postgrest (~85 ms) is imported eagerly again.
+DEFAULT_BUDGET_MS = 600
+
+# "import time:       412 |        953 |   fastapi.routing"
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def profile_once(module: str) -> list:
+    """[(depth, package, self_us, cumulative_us)] for one cold import of `module`."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=API_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((len(indent) // 2, name, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def summarize(rows: list, module: str, app_modules: set) -> dict:
+    """
+    Total = cumulative time of `module`. Dependencies are charged to the
+    package the app imported them through (fastapi, groq, ...), which is what
+    a lazy import would save.
+    """
+    by_package = defaultdict(int)
+    own = {}
+    total = 0
+    stack = []   # -X importtime prints children before parents; walk it in reverse
+    for depth, name, self_us, cumulative_us in reversed(rows):
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        parent = stack[-1][1] if stack else None
+        stack.append((depth, name))
+
+        if name == module:
+            total = cumulative_us
+        if name in app_modules:
+            own[name] = self_us
+        elif parent in app_modules:
+            by_package[name.split(".")[0]] += cumulative_us
+
+    return {
+        "total_ms": total / 1000,
+        "top_level_ms": {k: v / 1000 for k, v in by_package.items()},
+        "app_self_ms": {k: v / 1000 for k, v in own.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="index", help="entry module to import (default: index)")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to sample; the median is reported")
+    parser.add_argument("--top", type=int, default=15, help="how many heavy imports to list")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("COLD_START_BUDGET_MS", DEFAULT_BUDGET_MS)),
+                        help=f"fail if the median total exceeds this (default {DEFAULT_BUDGET_MS}; 0 = report only)")
+    args = parser.parse_args()
+
+    app_modules = {f[:-3] for f in os.listdir(API_DIR) if f.endswith(".py")}
+    samples = [summarize(profile_once(args.module), args.module, app_modules) for _ in range(args.runs)]
+    median = statistics.median(s["total_ms"] for s in samples)
+    # Breakdown from the run closest to the median
+    sample = min(samples, key=lambda s: abs(s["total_ms"] - median))
+
+    print(f"import {args.module}: median {median:.1f} ms over {args.runs} runs "
+          f"(min {min(s['total_ms'] for s in samples):.1f}, max {max(s['total_ms'] for s in samples):.1f})")
+
+    print("\nheaviest imports, by package the app pulled them in through (cumulative ms):")
+    ranked = sorted(sample["top_level_ms"].items(), key=lambda kv: kv[1], reverse=True)
+    for name, ms in ranked[:args.top]:
+        print(f"  {ms:>8.1f}  {name}")
+
+    print("\napp modules (self ms):")
+    for name, ms in sorted(sample["app_self_ms"].items(), key=lambda kv: kv[1], reverse=True):
+        print(f"  {ms:>8.1f}  {name}")
+
+    if args.budget_ms and median > args.budget_ms:
+        print(f"\nFAIL: cold-start import {median:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+        sys.exit(1)
+    if args.budget_ms:
+        print(f"\nOK: within budget {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
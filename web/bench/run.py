@@ -0,0 +1,529 @@
+"""
+Offline load harness for the API.
+
+Starts the upstream fakes (fakes.py) and one API entry point wired to them,
+drives a scripted scenario, and reports p50/p95/p99 latency and requests per
+second per endpoint. Nothing leaves the machine; no sandbox quota is spent.
+
+    python run.py --scenario ticket-drop --target asgi
+    python run.py --scenario all --target both --requests 500 --concurrency 100
+    python run.py --scenario chat-surge --target asgi --workers 4 --latency groq=2 --errors groq=0.05
+    python run.py --scenario door-rush --target asgi --requests 2000 --concurrency 20
+    python run.py --scenario reconcile --target asgi --requests 1000
+    python run.py --scenario poll-spike --target asgi --requests 5000 --concurrency 200
+
+Targets:
+    asgi    the deployed entry (uvicorn index:app), --workers N for multi-process
+    flask   the previous Flask entry, checked out from git (--flask-ref);
+            --single-threaded mimics one request per serverless instance
+
+Needs the API requirements (web/api/requirements.txt). The flask target runs
+code the API no longer ships, so its extra packages are installed separately:
+
+    pip install flask==3.0.0 flask-cors==4.0.0 resend==0.8.0
+"""
+import os
+import sys
+import hmac
+import time
+import json
+import base64
+import hashlib
+import random
+import asyncio
+import argparse
+import importlib.util
+import tempfile
+import subprocess
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+import httpx
+
+from fakes import callback_body
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(BENCH_DIR), "api")
+REPO_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+
+# Per target: the path serving each step (None = the entry point has no such route)
+ROUTES = {
+    "asgi": {"pay": "/api/pay", "callback": "/api/mpesa/callback", "chat": "/api/chat",
+             "status": "/api/check-status/{}", "health": "/api/health"},
+    "flask": {"pay": "/api/pay", "callback": "/api/mpesa/callback", "chat": "/api/chat",
+              "status": None, "health": "/api/health"},
+}
+
+# Admin routes (check-in) accept this key in the bench environment
+ADMIN_KEY = "bench-admin"
+# Member access tokens are signed with this, so the API verifies them without calling Supabase Auth
+JWT_SECRET = "bench-jwt-secret"
+# Imported by the legacy Flask entry; not in the API requirements any more
+FLASK_PACKAGES = ("flask", "flask_cors", "resend")
+
+QUESTIONS = [
+    "What's showing this week?",
+    "How much are tickets?",
+    "What time do the doors open?",
+    "Is there parking at the venue?",
+    "Can I bring a friend?",
+    "what's showing this week",
+    "Tell me about the next screening.",
+    "Do you have any horror films coming up?",
+]
+
+
+# --- PROCESSES ---
+
+def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited during startup (code {process.returncode})")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_fakes(port: int, latency: str, errors: str, capacity: int):
+    env = dict(os.environ, FAKE_LATENCY=latency or "", FAKE_ERRORS=errors or "", FAKE_CAPACITY=str(capacity))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fakes:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BENCH_DIR, env=env,
+    )
+    _wait_until_up(f"http://127.0.0.1:{port}/_fake/stats", process)
+    return process
+
+
+def target_env(target: str, port: int, fake_url: str, workdir: str) -> dict:
+    """Points every upstream at the fakes and lifts per-client limits (all load comes from one IP)."""
+    return dict(
+        os.environ,
+        DARAJA_BASE_URL=fake_url,
+        GROQ_BASE_URL=fake_url,
+        SANITY_API_URL=fake_url,
+        RESEND_API_URL=fake_url,
+        SUPABASE_URL=fake_url,
+        SUPABASE_KEY="bench.bench.bench",
+        GROQ_API_KEY="bench",
+        RESEND_API_KEY="bench",
+        MPESA_CONSUMER_KEY="bench",
+        MPESA_CONSUMER_SECRET="bench",
+        MPESA_PASSKEY="bench",
+        MPESA_CALLBACK_URL=f"http://127.0.0.1:{port}{ROUTES[target]['callback']}",
+        PAY_PER_IP_PER_MIN="1000000",
+        CHAT_PER_IP_PER_MIN="1000000",
+        CALLBACK_QUEUE_PATH=os.path.join(workdir, "callbacks.db"),
+        QR_CACHE_DIR=os.path.join(workdir, "qr"),
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+        ADMIN_API_KEY=ADMIN_KEY,
+        SUPABASE_JWT_SECRET=JWT_SECRET,
+        RECONCILE_QUERY_RATE="200",
+        RECONCILE_CONCURRENCY="20",
+    )
+
+
+def legacy_flask_ref() -> str:
+    """The last commit whose web/api/index.py was still the Flask app."""
+    removed_in = subprocess.check_output(
+        ["git", "log", "-1", "--format=%H", "-S", "from flask import", "--", "web/api/index.py"],
+        cwd=REPO_DIR, text=True,
+    ).strip()
+    return f"{removed_in}~1"
+
+
+def checkout_api(ref: str, workdir: str) -> str:
+    """Extracts web/api as of `ref` into workdir; returns the extracted api directory."""
+    archive = subprocess.run(["git", "archive", ref, "web/api"], cwd=REPO_DIR, check=True, capture_output=True)
+    subprocess.run(["tar", "-x", "-C", workdir], input=archive.stdout, check=True)
+    return os.path.join(workdir, "web", "api")
+
+
+def start_target(target: str, port: int, fake_url: str, workdir: str, args):
+    env = target_env(target, port, fake_url, workdir)
+    if target == "asgi":
+        env["WEB_CONCURRENCY"] = str(args.workers)
+        command = [sys.executable, "-m", "uvicorn", "index:app", "--port", str(port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+        cwd = API_DIR
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "index", "run", "--port", str(port),
+                   "--without-threads" if args.single_threaded else "--with-threads"]
+        cwd = checkout_api(args.flask_ref or legacy_flask_ref(), workdir)
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+    _wait_until_up(f"http://127.0.0.1:{port}{ROUTES[target]['health']}", process)
+    return process
+
+
+def stop(process: subprocess.Popen):
+    if process and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# --- MEASUREMENT ---
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)    # step -> [(seconds, status)]
+        self.started = time.perf_counter()
+        self.finished = None
+
+    async def timed(self, step: str, call):
+        started = time.perf_counter()
+        try:
+            response = await call
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.samples[step].append((time.perf_counter() - started, status))
+        return response
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder: Recorder) -> dict:
+    wall = (recorder.finished or time.perf_counter()) - recorder.started
+    report = {}
+    for step, samples in recorder.samples.items():
+        latencies = sorted(s[0] for s in samples)
+        statuses = defaultdict(int)
+        for _, status in samples:
+            statuses[str(status)] += 1
+        report[step] = {
+            "requests": len(samples),
+            "rps": round(len(samples) / wall, 1) if wall else 0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "statuses": dict(statuses),
+        }
+    return {"wall_seconds": round(wall, 2), "steps": report}
+
+
+# --- SCENARIOS ---
+
+def _phone(i: int) -> str:
+    return f"2547{i:08d}"
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def member_token(i: int) -> str:
+    """A Supabase-style HS256 access token for member i, valid for an hour."""
+    header = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    claims = {"sub": f"member-{i}", "role": "authenticated", "exp": int(time.time()) + 3600,
+              "app_metadata": {"role": "member"}}
+    payload = _b64(json.dumps(claims).encode())
+    signature = _b64(hmac.new(JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest())
+    return f"{header}.{payload}.{signature}"
+
+
+async def ticket_drop(client, target, recorder, requests, concurrency, fake):
+    """Everyone hits Buy the moment tickets open, then watches their payment status."""
+    routes = ROUTES[target]
+    gate = asyncio.Semaphore(concurrency)
+
+    async def buyer(i):
+        async with gate:
+            if target == "asgi":
+                payload = {"name": f"Buyer {i}", "phone": _phone(i), "email": f"buyer{i}@example.com",
+                           "tickets": random.choice((1, 1, 2)), "amount": 500, "screening_id": "screening-1"}
+            else:
+                payload = {"phone": _phone(i), "amount": 500}
+            response = await recorder.timed("pay", client.post(routes["pay"], json=payload))
+
+        if not routes["status"] or response is None or response.status_code != 200:
+            return
+        checkout_id = response.json().get("checkout_id") or response.json().get("CheckoutRequestID")
+        if not checkout_id:
+            return
+        # Polls like the booking page's fallback path until the callback lands
+        for _ in range(10):
+            await asyncio.sleep(1)
+            async with gate:
+                status = await recorder.timed("check-status", client.get(routes["status"].format(checkout_id)))
+            if status is not None and status.status_code == 200 and status.json().get("status") in ("paid", "failed"):
+                return
+
+    await asyncio.gather(*(buyer(i) for i in range(requests)))
+
+
+async def callback_storm(client, target, recorder, requests, concurrency, fake):
+    """A backlog of Daraja results arrives at once, with re-deliveries mixed in."""
+    checkout_ids = [f"ws_CO_bench{i:06d}" for i in range(requests)]
+    for chunk_start in range(0, requests, 200):
+        rows = [{"name": f"Buyer {i}", "phone": _phone(i), "email": f"buyer{i}@example.com", "tickets": 1,
+                 "amount": 500, "screening_id": "screening-2", "checkout_request_id": checkout_ids[i],
+                 "status": "pending"} for i in range(chunk_start, min(chunk_start + 200, requests))]
+        await fake.post("/rest/v1/reservations", json=rows)
+
+    # ~20% duplicates: Daraja retries when the ack is slow
+    deliveries = checkout_ids + random.sample(checkout_ids, requests // 5)
+    random.shuffle(deliveries)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def deliver(checkout_id):
+        async with gate:
+            body = callback_body(checkout_id, 0 if random.random() < 0.8 else 1032)
+            await recorder.timed("callback", client.post(ROUTES[target]["callback"], json=body))
+
+    await asyncio.gather(*(deliver(c) for c in deliveries))
+    recorder.stop()
+
+    if target == "asgi":
+        # Time until the durable queue has applied every result
+        drain_started = time.perf_counter()
+        while time.perf_counter() - drain_started < 120:
+            stats = (await fake.get("/_fake/stats")).json()
+            if not stats["reservations"].get("pending"):
+                break
+            await asyncio.sleep(0.25)
+        recorder.drain_seconds = round(time.perf_counter() - drain_started, 2)
+
+
+async def chat_surge(client, target, recorder, requests, concurrency, fake):
+    """A burst of visitors asking Fellini the same handful of questions."""
+    gate = asyncio.Semaphore(concurrency)
+
+    async def visitor(i):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        payload = {"history": [{"role": "user", "content": question}]}
+        if target == "flask":
+            payload["context"] = ""
+        async with gate:
+            await recorder.timed("chat", client.post(ROUTES[target]["chat"], json=payload))
+
+    await asyncio.gather(*(visitor(i) for i in range(requests)))
+
+
+async def door_rush(client, target, recorder, requests, concurrency, fake):
+    """
+    Doors open: a queue of ticket holders scanned at the door. Most show the
+    QR, some read out their M-Pesa receipt, and ~10% get scanned twice.
+    Reports scans/second and how long the write-back took to catch up.
+    """
+    screening_id = "screening-door"
+    headers = {"X-Admin-Key": ADMIN_KEY}
+    for chunk_start in range(0, requests, 200):
+        rows = [{"name": f"Guest {i}", "phone": _phone(i), "email": f"guest{i}@example.com", "tickets": 1,
+                 "amount": 500, "screening_id": screening_id, "checkout_request_id": f"ws_CO_door{i:06d}",
+                 "mpesa_receipt": f"RCP{i:07d}", "status": "paid"} for i in range(chunk_start, min(chunk_start + 200, requests))]
+        await fake.post("/rest/v1/reservations", json=rows)
+
+    await recorder.timed("checkin-load", client.post(f"/api/checkin/{screening_id}/load", headers=headers))
+
+    codes = [f"RCP{i:07d}" if random.random() < 0.2 else f"ws_CO_door{i:06d}" for i in range(requests)]
+    codes += random.sample(codes, requests // 10)
+    random.shuffle(codes)
+    gate = asyncio.Semaphore(concurrency)
+    recorder.scan_results = Counter()
+
+    async def scan(code):
+        async with gate:
+            response = await recorder.timed("scan", client.post(f"/api/checkin/{screening_id}/scan",
+                                                                json={"code": code, "device": "bench"}, headers=headers))
+        if response is not None and response.status_code == 200:
+            recorder.scan_results[response.json()["result"]] += 1
+
+    await asyncio.gather(*(scan(code) for code in codes))
+    recorder.stop()
+
+    # Time until every admitted guest is written back to the database
+    sync_started = time.perf_counter()
+    while time.perf_counter() - sync_started < 60:
+        if (await fake.get("/_fake/stats")).json()["checked_in"] >= recorder.scan_results["admitted"]:
+            break
+        await asyncio.sleep(0.1)
+    recorder.sync_seconds = round(time.perf_counter() - sync_started, 2)
+
+
+async def reconcile(client, target, recorder, requests, concurrency, fake):
+    """
+    A backlog of reservations whose callbacks were lost, settled by one
+    reconciler pass (STK Push Query per row). Reports rows resolved and run time.
+    """
+    created_at = (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
+    for chunk_start in range(0, requests, 200):
+        rows = [{"name": f"Buyer {i}", "phone": _phone(i), "email": f"buyer{i}@example.com", "tickets": 1,
+                 "amount": 500, "screening_id": "screening-3", "checkout_request_id": f"ws_CO_lost{i:06d}",
+                 "status": "pending", "created_at": created_at} for i in range(chunk_start, min(chunk_start + 200, requests))]
+        await fake.post("/rest/v1/reservations", json=rows)
+
+    response = await recorder.timed("reconcile", client.post("/api/reconcile", headers={"X-Admin-Key": ADMIN_KEY}))
+    recorder.stop()
+    if response is not None and response.status_code == 200:
+        recorder.reconcile_run = response.json()
+
+
+async def poll_spike(client, target, recorder, requests, concurrency, fake):
+    """
+    A poll is announced and every member votes at once; ~10% double-tap,
+    and one in five checks the results afterwards. Reports votes/second and
+    how long the write-back took to get every vote into the database.
+    """
+    poll = await recorder.timed("poll-active", client.get("/api/polls/active"))
+    if poll is None or poll.status_code != 200:
+        return
+    poll_id = poll.json()["poll_id"]
+    options = [option["id"] for option in poll.json()["options"]]
+
+    voters = list(range(requests)) + random.sample(range(requests), requests // 10)
+    random.shuffle(voters)
+    gate = asyncio.Semaphore(concurrency)
+    recorder.vote_results = Counter()
+
+    async def member(i):
+        headers = {"Authorization": f"Bearer {member_token(i)}"}
+        async with gate:
+            response = await recorder.timed("vote", client.post(f"/api/polls/{poll_id}/vote",
+                                                                json={"option_id": random.choice(options)}, headers=headers))
+        if response is not None and response.status_code == 200:
+            recorder.vote_results[response.json()["result"]] += 1
+        if i % 5 == 0:
+            async with gate:
+                await recorder.timed("poll-results", client.get(f"/api/polls/{poll_id}/results"))
+
+    await asyncio.gather(*(member(i) for i in voters))
+    recorder.stop()
+
+    # Time until every recorded vote is in the database
+    sync_started = time.perf_counter()
+    while time.perf_counter() - sync_started < 60:
+        if (await fake.get("/_fake/stats")).json()["poll_votes"] >= recorder.vote_results["recorded"]:
+            break
+        await asyncio.sleep(0.1)
+    recorder.sync_seconds = round(time.perf_counter() - sync_started, 2)
+
+
+SCENARIOS = {"ticket-drop": ticket_drop, "callback-storm": callback_storm, "chat-surge": chat_surge,
+             "door-rush": door_rush, "reconcile": reconcile, "poll-spike": poll_spike}
+# Scenarios for routes the Flask entry never had
+ASGI_ONLY = ("door-rush", "reconcile", "poll-spike")
+
+
+# --- REPORTING ---
+
+def print_report(target: str, scenario: str, summary: dict, extras: dict):
+    print(f"\n=== {scenario} @ {target}  ({summary['wall_seconds']}s wall) ===")
+    print(f"{'step':<14}{'requests':>9}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for step, row in summary["steps"].items():
+        print(f"{step:<14}{row['requests']:>9}{row['rps']:>9}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+              f"{row['p99_ms']:>10}  {row['statuses']}")
+    for name, value in extras.items():
+        print(f"  {name}: {json.dumps(value)}")
+
+
+async def run_scenario(scenario: str, target: str, port: int, fake_port: int, args) -> dict:
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=fake_url, timeout=30) as fake, \
+            httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits) as client:
+        await fake.post("/_fake/reset")
+        recorder = Recorder()
+        await SCENARIOS[scenario](client, target, recorder, args.requests, args.concurrency, fake)
+        if recorder.finished is None:
+            recorder.stop()
+
+        summary = summarize(recorder)
+        extras = {"upstream_calls": (await fake.get("/_fake/stats")).json()["calls"]}
+        if hasattr(recorder, "drain_seconds"):
+            extras["queue_drain_seconds"] = recorder.drain_seconds
+        if hasattr(recorder, "reconcile_run"):
+            extras["reconcile_run"] = recorder.reconcile_run
+        if hasattr(recorder, "scan_results"):
+            extras["scan_results"] = dict(recorder.scan_results)
+            extras["checkin_sync_seconds"] = recorder.sync_seconds
+        if hasattr(recorder, "vote_results"):
+            extras["vote_results"] = dict(recorder.vote_results)
+            extras["poll_sync_seconds"] = recorder.sync_seconds
+        if scenario == "ticket-drop" and target == "asgi":
+            # Oversell check: seats held + sold may never exceed capacity
+            inventory = (await fake.get("/_fake/stats")).json()["inventory"].get("screening-1", {})
+            extras["inventory"] = inventory
+            extras["oversold"] = inventory.get("held", 0) + inventory.get("sold", 0) > inventory.get("capacity", 0)
+        health = (await client.get(ROUTES[target]["health"])).json()
+        extras["connections"] = health.get("connections")
+        if scenario == "chat-surge":
+            extras["chat_cache"] = health.get("chat_cache")
+
+        print_report(target, scenario, summary, extras)
+        return {"target": target, "scenario": scenario, **summary, "extras": extras}
+
+
+def print_comparison(results: list):
+    """Requests per second per instance, Flask entry vs ASGI entry, per scenario step."""
+    by_key = {(r["target"], r["scenario"], step): row["rps"] for r in results for step, row in r["steps"].items()}
+    print("\n=== rps per instance: flask -> asgi ===")
+    for (target, scenario, step), flask_rps in by_key.items():
+        asgi_rps = by_key.get(("asgi", scenario, step))
+        if target == "flask" and asgi_rps is not None:
+            ratio = f"{asgi_rps / flask_rps:.1f}x" if flask_rps else "n/a"
+            print(f"  {scenario:<16}{step:<14}{flask_rps:>9} -> {asgi_rps:<9} ({ratio})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=[*SCENARIOS, "all"], default="all")
+    parser.add_argument("--target", choices=["asgi", "flask", "both"], default="asgi")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", help='per-upstream latency, e.g. "daraja=0.4,groq=1.5"')
+    parser.add_argument("--errors", help='per-upstream error rate, e.g. "daraja=0.05"')
+    parser.add_argument("--capacity", type=int, default=100, help="seats per fake screening")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the asgi target")
+    parser.add_argument("--single-threaded", action="store_true", help="serve the flask target one request at a time")
+    parser.add_argument("--flask-ref", help="git ref of the Flask entry to compare against (default: last Flask commit)")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    scenarios = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    targets = ["flask", "asgi"] if args.target == "both" else [args.target]
+    if "flask" in targets and not all(importlib.util.find_spec(m) for m in FLASK_PACKAGES):
+        parser.error(f"the flask target needs {', '.join(FLASK_PACKAGES)}; "
+                     "pip install flask==3.0.0 flask-cors==4.0.0 resend==0.8.0, or use --target asgi")
+    results = []
+
+    fakes = start_fakes(args.fake_port, args.latency, args.errors, args.capacity)
+    try:
+        for target in targets:
+            for scenario in scenarios:
+                if scenario in ASGI_ONLY and target != "asgi":
+                    continue
+                # Fresh process per run: cold caches, empty queue, no leftover holds
+                with tempfile.TemporaryDirectory() as workdir:
+                    process = start_target(target, args.port, f"http://127.0.0.1:{args.fake_port}", workdir, args)
+                    try:
+                        results.append(asyncio.run(run_scenario(scenario, target, args.port, args.fake_port, args)))
+                    finally:
+                        stop(process)
+    finally:
+        stop(fakes)
+
+    if len(targets) > 1:
+        print_comparison(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,8 @@
 import Link from "next/link";
 import { supabase } from "@/lib/supabase"; 
 import AdminChatBot from "@/components/adminchatbot";
-import { useEffect, useState, useCallback } from "react";
-import { LayoutDashboard, Ticket, Clapperboard, Users, BarChart3, RadioTower, Bell, Home, Film, Image as ImageIcon, LogOut, ExternalLink, DollarSign, AlertCircle, RefreshCw, Trophy, type LucideIcon, CheckCircle, XCircle, Search, UserCog } from "lucide-react";
+import { useEffect, useState, useCallback, useRef } from "react";
+import { LayoutDashboard, Ticket, Clapperboard, Users, BarChart3, RadioTower, Bell, Home, Film, Image as ImageIcon, LogOut, ExternalLink, Download, DollarSign, AlertCircle, RefreshCw, Trophy, type LucideIcon, CheckCircle, XCircle, Search, UserCog } from "lucide-react";
 
 type AdminView = 'dashboard' | 'manifest' | 'studio' | 'talent' | 'dailies' | 'broadcast' | 'notifications';
 
@@ -17,8 +17,8 @@ interface Profile {
 }
 
 interface VoteStat { title: string; count: number; percentage: number; }
-interface RecentVote { id: number; movie_choice: string; created_at: string; user_id: string; }
-interface ReservationData { id: number; movie_title: string; name: string; email: string; amount: number; status: string; created_at: string; }
+interface RecentVote { user_id: string; option_id: string; created_at: string; title?: string; }
+interface ReservationData { id: number; movie_title: string | null; name: string; email: string; amount: number; status: string; created_at: string; screening_id?: string; checkout_request_id?: string; checked_in_at?: string | null; }
 interface SidebarItemProps { icon: LucideIcon; label: string; active: boolean; onClick: () => void; badge?: number; }
 interface ExternalLinkItemProps { href: string; icon: LucideIcon; label: string; }
 interface StatCardProps { label: string; value: string | number; icon: LucideIcon; color: string; }
@@ -34,7 +34,7 @@ export default function AdminDashboard() {
   const [loading, setLoading] = useState(true);
   const [activeView, setActiveView] = useState<AdminView>('dashboard');
   
-  const [stats] = useState({ revenue: 12500, members: 142, ticketsSold: 85, unreadAlerts: 3 });
+  const [stats, setStats] = useState<{ revenue: number; members: number; ticketsSold: number; occupancy: number | null; unreadAlerts: number }>({ revenue: 0, members: 142, ticketsSold: 0, occupancy: null, unreadAlerts: 3 });
 
   const [voteStats, setVoteStats] = useState<VoteStat[]>([]);
   const [recentVotes, setRecentVotes] = useState<RecentVote[]>([]); 
@@ -43,46 +43,112 @@ export default function AdminDashboard() {
   const [reservations, setReservations] = useState<ReservationData[]>([]);
   const [members, setMembers] = useState<Profile[]>([]);
   const [loadingData, setLoadingData] = useState(false);
+  const [accessToken, setAccessToken] = useState<string | null>(null);
+  const [manifestCursor, setManifestCursor] = useState<string | null>(null);
+  const changesCursor = useRef<string | null>(null);
+
+  // Stats Bar figures are aggregated server-side from the screening_stats rollup
+  const fetchStats = useCallback(async (accessToken: string) => {
+    const res = await fetch('/api/admin/stats', { headers: { Authorization: `Bearer ${accessToken}` } });
+    if (!res.ok) return;
+    const { totals } = await res.json();
+    setStats(prev => ({ ...prev, revenue: totals.revenue, ticketsSold: totals.tickets_sold, occupancy: totals.occupancy }));
+  }, []);
 
   useEffect(() => {
     async function checkAdmin() {
       const { data: { session } } = await supabase.auth.getSession();
       const user = session?.user;
       
-      if (!user || user.user_metadata?.role !== "admin") {
+      if (!user || user.app_metadata?.role !== "admin") {
         console.warn("Unauthorized or stale session detected. Redirecting.");
         window.location.href = "/login"; 
       } else {
         setLoading(false);
+        setAccessToken(session.access_token);
+        fetchStats(session.access_token);
       }
     }
     checkAdmin();
-  }, []); 
+  }, [fetchStats]); 
+
+  const adminFetch = useCallback((path: string) => fetch(path, { headers: { Authorization: `Bearer ${accessToken}` } }), [accessToken]);
 
+  // Tallies come from the API's cached poll results instead of reading every vote row
   const fetchVoteData = useCallback(async () => {
     setLoadingData(true);
-    const { data: votes, error } = await supabase.from('votes').select('*').order('created_at', { ascending: false });
-    if (!error && votes) {
-        setTotalVotes(votes.length);
-        setRecentVotes(votes.slice(0, 5)); 
-        const tally: Record<string, number> = {};
-        votes.forEach((v) => { tally[v.movie_choice] = (tally[v.movie_choice] || 0) + 1; });
-        const statsArray: VoteStat[] = Object.keys(tally).map(key => ({
-            title: key,
-            count: tally[key],
-            percentage: Math.round((tally[key] / votes.length) * 100)
-        })).sort((a, b) => b.count - a.count);
-        setVoteStats(statsArray);
+    const res = await fetch('/api/polls/active');
+    if (res.ok) {
+        const poll = await res.json();
+        setTotalVotes(poll.total);
+        setVoteStats(poll.options
+            .map((o: { title: string; votes: number; percentage: number }) => ({ title: o.title, count: o.votes, percentage: o.percentage }))
+            .sort((a: VoteStat, b: VoteStat) => b.count - a.count));
+        const titles: Record<string, string> = Object.fromEntries(poll.options.map((o: { id: string; title: string }) => [o.id, o.title]));
+        const recent = await adminFetch(`/api/admin/polls/${poll.poll_id}/recent?limit=5`);
+        if (recent.ok) {
+            const { votes } = await recent.json();
+            setRecentVotes(votes.map((v: RecentVote) => ({ ...v, title: titles[v.option_id] ?? v.option_id })));
+        }
     }
     setLoadingData(false);
-  }, []);
+  }, [adminFetch]);
 
+  // The guest list is paged by the API (newest first) instead of pulling every reservation
   const fetchManifestData = useCallback(async () => {
     setLoadingData(true);
-    const { data, error } = await supabase.from('reservations').select('*').order('created_at', { ascending: false });
-    if (!error && data) { setReservations(data); }
+    const res = await adminFetch('/api/admin/reservations?limit=50');
+    if (res.ok) {
+      const data = await res.json();
+      setReservations(data.items);
+      setManifestCursor(data.next_cursor);
+      changesCursor.current = data.changes_cursor;
+    }
     setLoadingData(false);
-  }, []);
+  }, [adminFetch]);
+
+  const loadMoreManifest = async () => {
+    if (!manifestCursor) return;
+    setLoadingData(true);
+    const res = await adminFetch(`/api/admin/reservations?limit=50&cursor=${encodeURIComponent(manifestCursor)}`);
+    if (res.ok) {
+      const data = await res.json();
+      setReservations(prev => [...prev, ...data.items]);
+      setManifestCursor(data.next_cursor);
+    }
+    setLoadingData(false);
+  };
+
+  const exportManifest = async () => {
+    const res = await adminFetch('/api/admin/reservations/export?format=csv');
+    if (!res.ok) { alert("Export failed"); return; }
+    const url = URL.createObjectURL(await res.blob());
+    const link = document.createElement("a");
+    link.href = url;
+    link.download = "reservations.csv";
+    link.click();
+    URL.revokeObjectURL(url);
+  };
+
+  // Live manifest: merges only the rows that changed since the last poll
+  useEffect(() => {
+    if (activeView !== 'manifest') return;
+    const timer = setInterval(async () => {
+      if (!changesCursor.current) return;
+      const res = await adminFetch(`/api/admin/reservations/changes?cursor=${encodeURIComponent(changesCursor.current)}`);
+      if (!res.ok) return;
+      const data = await res.json();
+      changesCursor.current = data.cursor;
+      if (!data.items.length) return;
+      setReservations(prev => {
+        const changed = new Map<number, ReservationData>(data.items.map((r: ReservationData) => [r.id, r]));
+        const known = new Set(prev.map(r => r.id));
+        const added = data.items.filter((r: ReservationData) => !known.has(r.id)).reverse();
+        return [...added, ...prev.map(r => changed.get(r.id) ?? r)];
+      });
+    }, 10000);
+    return () => clearInterval(timer);
+  }, [activeView, adminFetch]);
 
   const fetchTalentData = useCallback(async () => {
     setLoadingData(true);
@@ -97,6 +163,21 @@ export default function AdminDashboard() {
     else fetchTalentData();
   };
 
+  // Door check-in goes through the API's in-memory guest list, not a row update per guest
+  const handleCheckIn = async (reservation: ReservationData) => {
+    if (!reservation.screening_id || !reservation.checkout_request_id) return;
+    const action = reservation.checked_in_at ? 'undo' : 'scan';
+    const res = await fetch(`/api/checkin/${encodeURIComponent(reservation.screening_id)}/${action}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${accessToken}` },
+      body: JSON.stringify({ code: reservation.checkout_request_id, device: 'admin' }),
+    });
+    if (!res.ok) { alert("Check-in failed"); return; }
+    const { result, guest } = await res.json();
+    if (!guest) { alert(`Check-in failed: ${result}`); return; }
+    setReservations(prev => prev.map(r => r.id === reservation.id ? { ...r, checked_in_at: guest.checked_in_at } : r));
+  };
+
   const handleViewChange = (view: AdminView) => {
     setActiveView(view);
     if (view === 'dailies') fetchVoteData();
@@ -183,10 +264,10 @@ export default function AdminDashboard() {
           {activeView === 'dashboard' && (
             <div className="space-y-8">
                 <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-4 gap-4">
-                    <StatCard label="Total Revenue" value={`$${stats.revenue.toLocaleString()}`} icon={DollarSign} color="text-green-400" />
+                    <StatCard label="Total Revenue" value={`KES ${stats.revenue.toLocaleString()}`} icon={DollarSign} color="text-green-400" />
                     <StatCard label="Active Members" value={stats.members} icon={Users} color="text-blue-400" />
                     <StatCard label="Tickets Sold" value={stats.ticketsSold} icon={Ticket} color="text-yellow-400" />
-                    <StatCard label="Pending Alerts" value={stats.unreadAlerts} icon={AlertCircle} color="text-red-400" />
+                    <StatCard label="Occupancy" value={stats.occupancy === null ? '—' : `${stats.occupancy}%`} icon={BarChart3} color="text-red-400" />
                 </div>
                 <div className="bg-neutral-900 border border-white/5 rounded-2xl p-6">
                     <h3 className="text-lg font-bold mb-6">Recent Activity Feed</h3>
@@ -267,10 +348,10 @@ export default function AdminDashboard() {
                       <h4 className="text-sm font-bold uppercase tracking-widest text-gray-500 mb-4">Live Feed</h4>
                       <div className="divide-y divide-white/5">
                           {recentVotes.map((vote) => (
-                              <div key={vote.id} className="py-3 flex justify-between items-center">
+                              <div key={`${vote.user_id}-${vote.created_at}`} className="py-3 flex justify-between items-center">
                                   <div className="flex items-center gap-3">
                                       <div className="w-2 h-2 bg-yellow-500 rounded-full animate-pulse" />
-                                      <span className="text-sm text-gray-300">User <span className="font-mono text-xs text-gray-500">{vote.user_id.slice(0,6)}...</span> voted for <span className="text-white font-bold">{vote.movie_choice}</span></span>
+                                      <span className="text-sm text-gray-300">User <span className="font-mono text-xs text-gray-500">{vote.user_id.slice(0,6)}...</span> voted for <span className="text-white font-bold">{vote.title}</span></span>
                                   </div>
                                   <span className="text-xs text-gray-600 font-mono">
                                       {new Date(vote.created_at).toLocaleTimeString()}
@@ -296,6 +377,9 @@ export default function AdminDashboard() {
                         <button onClick={fetchManifestData} className="flex items-center gap-2 text-sm bg-white/10 hover:bg-white/20 px-4 py-2 rounded-full transition-colors">
                             <RefreshCw className={`w-4 h-4 ${loadingData ? 'animate-spin' : ''}`} /> Refresh
                         </button>
+                        <button onClick={exportManifest} className="flex items-center gap-2 text-sm bg-white/10 hover:bg-white/20 px-4 py-2 rounded-full transition-colors">
+                            <Download className="w-4 h-4" /> Export
+                        </button>
                     </div>
                 </div>
 
@@ -309,6 +393,7 @@ export default function AdminDashboard() {
                                     <th className="p-4 font-bold">Movie</th>
                                     <th className="p-4 font-bold">Date</th>
                                     <th className="p-4 font-bold text-right">Amount</th>
+                                    <th className="p-4 font-bold text-right">Door</th>
                                 </tr>
                             </thead>
                             <tbody className="divide-y divide-white/5">
@@ -337,11 +422,18 @@ export default function AdminDashboard() {
                                             <td className="p-4 text-right font-bold font-mono text-white">
                                                 KES {reservation.amount}
                                             </td>
+                                            <td className="p-4 text-right">
+                                                {reservation.status === 'paid' && (
+                                                    <button onClick={() => handleCheckIn(reservation)} className={`text-[10px] font-black uppercase px-3 py-1 rounded-full border transition-colors ${reservation.checked_in_at ? 'text-gray-400 border-white/10 hover:bg-white/10' : 'text-yellow-400 border-yellow-500/30 hover:bg-yellow-500/10'}`}>
+                                                        {reservation.checked_in_at ? 'Undo' : 'Check In'}
+                                                    </button>
+                                                )}
+                                            </td>
                                         </tr>
                                     ))
                                 ) : (
                                     <tr>
-                                        <td colSpan={5} className="p-8 text-center text-gray-500">
+                                        <td colSpan={6} className="p-8 text-center text-gray-500">
                                             {loadingData ? "Loading manifest..." : "No reservations found."}
                                         </td>
                                     </tr>
@@ -350,6 +442,13 @@ export default function AdminDashboard() {
                         </table>
                     </div>
                 </div>
+                {manifestCursor && (
+                    <div className="flex justify-center">
+                        <button onClick={loadMoreManifest} disabled={loadingData} className="text-sm bg-white/10 hover:bg-white/20 px-6 py-2 rounded-full transition-colors disabled:opacity-50">
+                            {loadingData ? "Loading..." : "Load More"}
+                        </button>
+                    </div>
+                )}
             </div>
           )}
 
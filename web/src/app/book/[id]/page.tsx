@@ -1,7 +1,7 @@
 "use client";
 
 import { useState, useEffect, useRef } from "react";
-import { client, urlFor } from "@/lib/sanity";
+import { urlFor } from "@/lib/sanity";
 import Image from "next/image";
 import { useParams } from "next/navigation"; 
 import { format } from "date-fns";
@@ -14,12 +14,16 @@ interface ScreeningDetail {
   _id: string;
   date: string;
   price: number;
+  isFree?: boolean;
   locationName?: string;
   location?: { lat: number; lng: number };
+  isSecret?: boolean;
+  revealed?: boolean;
+  clues?: string[];
   movie: {
     title: string;
-    poster: object; 
-    description: string;
+    poster: object | null;
+    description: string | null;
     themes?: string[];
     trailer?: string;
   };
@@ -46,26 +50,31 @@ export default function BookingPage() {
   const [status, setStatus] = useState("idle");
   const [checkoutId, setCheckoutId] = useState("");
   const ticketRef = useRef<HTMLDivElement>(null);
+  // One key per booking attempt: resubmits of the same attempt reuse the same STK push
+  const idempotencyKey = useRef<string | null>(null);
 
   // 2. FETCHES DATA
   useEffect(() => {
     async function fetchData() {
-      const query = `*[_type == "screening" && _id == $id][0]{
-        _id, date, price,
-        locationName, location,
-        movie->{ title, poster, description, themes, trailer }
-      }`;
-      const data = await client.fetch(query, { id });
-      setScreening(data);
+      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/screenings/${id}`);
+      setScreening(res.ok ? await res.json() : null);
       setLoading(false);
     }
     if (id) fetchData();
   }, [id]);
 
-  // 3. POLLING LOGIC
+  // 3. STATUS UPDATES (pushed by the API; falls back to polling if the stream drops)
   useEffect(() => {
     let interval: NodeJS.Timeout;
-    if (status === "processing" && checkoutId) {
+    let source: EventSource | null = null;
+
+    // A settled failure (declined, cancelled or timed-out prompt) needs a fresh STK push on retry
+    const paymentFailed = () => {
+      idempotencyKey.current = null;
+      setStatus("error");
+    };
+
+    const startPolling = () => {
       interval = setInterval(async () => {
         try {
           const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/check-status/${checkoutId}`);
@@ -76,7 +85,7 @@ export default function BookingPage() {
                 setStatus("paid"); 
                 clearInterval(interval);
               } else if (data.status === "failed") {
-                setStatus("error");
+                paymentFailed();
                 clearInterval(interval);
               }
           }
@@ -84,8 +93,31 @@ export default function BookingPage() {
             console.error("Polling Network Error", e); 
         }
       }, 2000);
+    };
+
+    if (status === "processing" && checkoutId) {
+      source = new EventSource(`${process.env.NEXT_PUBLIC_API_URL}/status-stream/${checkoutId}`);
+
+      source.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.status === "paid") {
+          setStatus("paid");
+          source?.close();
+        } else if (data.status === "failed") {
+          paymentFailed();
+          source?.close();
+        }
+      };
+
+      source.onerror = () => {
+        source?.close();
+        startPolling();
+      };
     }
-    return () => clearInterval(interval);
+    return () => {
+      source?.close();
+      clearInterval(interval);
+    };
   }, [status, checkoutId]);
 
 // --- 4. DOWNLOAD TICKET LOGIC ---
@@ -116,11 +148,12 @@ export default function BookingPage() {
     if (!screening) return; 
 
     setStatus("processing");
+    idempotencyKey.current ??= crypto.randomUUID();
 
     try {
       const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/pay`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "Idempotency-Key": idempotencyKey.current },
         body: JSON.stringify({
           name: name,         
           phone: phone,
@@ -133,8 +166,12 @@ export default function BookingPage() {
 
       const data = await res.json();
       if (data.status === "success") setCheckoutId(data.checkout_id);
-      else setStatus("error");
+      else {
+        idempotencyKey.current = null;
+        setStatus("error");
+      }
     } catch (err) {
+      // The request may still have reached the server: a retry keeps the same key
       console.error(err);
       setStatus("error");
     }
@@ -205,7 +242,7 @@ export default function BookingPage() {
             <div>
                 <h3 className="text-xs font-bold uppercase tracking-widest text-gray-500 mb-3">Synopsis</h3>
                 <p className="text-gray-300 leading-relaxed text-lg border-l-2 border-yellow-500 pl-4">
-                    {screening.movie.description}
+                    {screening.movie.description ?? screening.clues?.join(" • ")}
                 </p>
             </div>
 
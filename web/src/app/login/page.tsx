@@ -29,7 +29,7 @@ export default function LoginPage() {
 
         // Session Check
         const { data: { session } } = await supabase.auth.getSession();
-        const userRole = session?.user?.user_metadata?.role;
+        const userRole = session?.user?.app_metadata?.role;
         
         console.log("Logged in as:", userRole);
 
@@ -17,14 +17,18 @@ const supabase = createClient(
   process.env.NEXT_PUBLIC_SUPABASE_ANON_KEY!
 );
 
-const POLL_OPTIONS = [
-  { id: "pulp_fiction", title: "Pulp Fiction", year: "1994", genre: "Crime/Drama" },
-  { id: "spirited_away", title: "Spirited Away", year: "2001", genre: "Animation" },
-  { id: "oldboy", title: "Oldboy", year: "2003", genre: "Neo-noir Thriller" },
-];
-
 // --- TYPES ---
 type ViewState = 'dashboard' | 'discussion' | 'gallery';
+interface PollOption { id: string; title: string; votes: number; percentage: number; }
+interface Poll {
+  poll_id: string;
+  question: string;
+  open: boolean;
+  expires_at: string | null;
+  total: number;
+  options: PollOption[];
+  my_vote?: string | null;
+}
 interface Message {
   id: number;
   content: string;
@@ -41,6 +45,8 @@ export default function MemberLounge() {
   const [activeView, setActiveView] = useState<ViewState>('dashboard');
 
   // --- DASHBOARD STATE ---
+  const [poll, setPoll] = useState<Poll | null>(null);
+  const [accessToken, setAccessToken] = useState("");
   const [hasVoted, setHasVoted] = useState(false);
   const [selectedMovie, setSelectedMovie] = useState("");
   const [voteLoading, setVoteLoading] = useState(false);
@@ -61,8 +67,18 @@ export default function MemberLounge() {
       if (!user) { router.push("/login"); return; }
       setUser(user);
 
-      const { data: vote } = await supabase.from("votes").select("*").eq("user_id", user.id).single();
-      if (vote) { setHasVoted(true); setSelectedMovie(vote.movie_choice); }
+      // The poll and tallies are served by the API; it also knows whether this member has voted
+      const { data: { session } } = await supabase.auth.getSession();
+      const token = session?.access_token ?? "";
+      setAccessToken(token);
+      const pollRes = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/polls/active`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (pollRes.ok) {
+        const activePoll: Poll = await pollRes.json();
+        setPoll(activePoll);
+        if (activePoll.my_vote) { setHasVoted(true); setSelectedMovie(activePoll.my_vote); }
+      }
 
       const { data: msgs } = await supabase.from("messages").select("*").order("created_at", { ascending: true }).limit(50);
       if (msgs) setMessages(msgs);
@@ -104,14 +120,22 @@ export default function MemberLounge() {
   // --- HANDLERS ---
   const handleLogout = async () => { await supabase.auth.signOut(); router.push("/"); };
   
-  const handleVote = async (movieTitle: string) => {
-    if (!user) return;
+  const handleVote = async (optionId: string) => {
+    if (!user || !poll) return;
     setVoteLoading(true);
     try {
-      const { error } = await supabase.from("votes").insert([{ user_id: user.id, movie_choice: movieTitle }]);
-      if (error) throw error;
-      setHasVoted(true); setSelectedMovie(movieTitle);
-    } catch { alert("You have already voted!"); } 
+      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/polls/${poll.poll_id}/vote`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", Authorization: `Bearer ${accessToken}` },
+        body: JSON.stringify({ option_id: optionId }),
+      });
+      if (!res.ok) throw new Error(`Vote failed (${res.status})`);
+      const outcome = await res.json();
+      if (outcome.results) setPoll((prev) => prev && { ...prev, ...outcome.results });
+      if (outcome.result === "closed") { alert("This poll has closed."); return; }
+      if (outcome.result === "already_voted") alert("You have already voted!");
+      setHasVoted(true); setSelectedMovie(outcome.choice);
+    } catch { alert("Your vote didn't go through. Please try again."); }
     finally { setVoteLoading(false); }
   };
 
@@ -264,16 +288,19 @@ export default function MemberLounge() {
                       </div>
 
                       <div className="bg-neutral-900 border border-white/10 rounded-2xl p-8">
+                          {poll && <p className="text-sm text-gray-400 mb-4">{poll.question}</p>}
                           <div className="space-y-3">
-                              {POLL_OPTIONS.map((movie) => (
+                              {!poll && <p className="text-gray-500 text-sm italic">No poll running right now.</p>}
+                              {poll?.options.map((movie) => (
                                   <button
                                       key={movie.id}
-                                      onClick={() => handleVote(movie.title)}
-                                      disabled={hasVoted || voteLoading}
-                                      className={`w-full flex items-center justify-between p-4 rounded-xl border transition-all ${selectedMovie === movie.title ? "bg-yellow-500 border-yellow-500 text-black" : "bg-black border-white/10 hover:border-yellow-500/50"}`}
+                                      onClick={() => handleVote(movie.id)}
+                                      disabled={hasVoted || voteLoading || !poll.open}
+                                      className={`w-full flex items-center justify-between p-4 rounded-xl border transition-all ${selectedMovie === movie.id ? "bg-yellow-500 border-yellow-500 text-black" : "bg-black border-white/10 hover:border-yellow-500/50"}`}
                                   >
                                       <span className="font-bold">{movie.title}</span>
-                                      {selectedMovie === movie.title ? (
+                                      {(hasVoted || !poll.open) && <span className="font-mono text-xs ml-auto mr-3">{movie.percentage}%</span>}
+                                      {selectedMovie === movie.id ? (
                                         <CheckCircle className="w-5 h-5" />
                                       ) : (
                                         !hasVoted && <div className="w-5 h-5 rounded-full border border-white/20" />
@@ -4,22 +4,9 @@ import { useState, useEffect } from "react";
 import Link from "next/link";
 import { motion } from "framer-motion"; 
 import { ArrowRight, Mail, Lock } from "lucide-react";
-import { client } from "@/lib/sanity";
+import type { Screening } from "@/lib/sanity";
 import MovieCard from "@/components/moviecard";
 
-// --- TYPE DEFINITIONS ---
-interface Screening {
-  _id: string;
-  date: string;
-  price: number;
-  locationName?: string;
-  movie: {
-    title: string;
-    poster: object;
-    description: string;
-  };
-}
-
 export default function HomePage() {
   const [screenings, setScreenings] = useState<Screening[]>([]);
   const [loading, setLoading] = useState(true);
@@ -27,16 +14,10 @@ export default function HomePage() {
   // --- DATA FETCHING (Optimized) ---
   useEffect(() => {
     async function fetchData() {
-      const query = `*[_type == "screening" && date > now()] | order(date asc) {
-        _id, date, price, locationName,
-        movie->{ title, poster, description }
-      }`;
-      
-      // 👇 UPDATED: Added caching options for better performance
-      const data = await client.fetch(query, {}, {
-        next: { revalidate: 60 } // Checks for new data every 60s
-      });
-      
+      // Served by the API from its cached catalog (secret titles stay redacted until reveal)
+      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/screenings?upcoming=true`);
+      const data = res.ok ? await res.json() : [];
+
       setScreenings(data);
       setLoading(false);
     }
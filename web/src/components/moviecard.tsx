@@ -38,14 +38,14 @@ export default function MovieCard({ screening }: { screening: Screening }) {
             </h3>
           </Link>
           <span className="font-mono text-yellow-500 text-sm whitespace-nowrap">
-            KES {screening.price}
+            {screening.isFree ? "FREE" : `KES ${screening.price}`}
           </span>
         </div>
 
         {/* 3. EXPANDABLE SYNOPSIS */}
         <div className="relative">
           <p className={`text-gray-400 text-xs leading-relaxed transition-all duration-300 ${isExpanded ? "line-clamp-none" : "line-clamp-2"}`}>
-            {screening.movie.description}
+            {screening.movie.description ?? screening.clues?.join(" • ")}
           </p>
           
           <button 
@@ -18,10 +18,17 @@ export interface Screening {
   _id: string;
   date: string;
   price: number;
+  isFree?: boolean;
+  locationName?: string;
+  // Secret screenings: the API swaps the film for codename + clues until revealDate
+  isSecret?: boolean;
+  revealed?: boolean;
+  codename?: string;
+  clues?: string[];
   movie: {
     title: string;
-    poster: object;
-    description: string;
+    poster: object | null;
+    description: string | null;
   };
 }
 